@@ -0,0 +1,129 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from benchmarks.synthetic import STATEMENT_FIELDS, synthetic_statement
+
+
+class FMPStub(object):
+    """
+    Local stand-in for the FMP api serving synthetic json for the statement, profile and stock list endpoints.
+    Point the fetch layer at it with `FMP_BASE_URL=stub.url` (or `shared.FMP_BASE_URL = stub.url`).
+
+        with FMPStub(latency=0.02, throttle_rate=0.01) as stub:
+            ...
+            print(stub.stats())
+    """
+
+    def __init__(self,
+                 latency: float = 0.0,
+                 throttle_rate: float = 0.0,
+                 retry_after: float = 0.0,
+                 port: int = 0,
+                 seed: int = 0,
+                 etag: bool = True):
+        """
+        :param latency: seconds every response is delayed by
+        :param throttle_rate: fraction of requests answered with HTTP 429
+        :param retry_after: Retry-After header of the 429 responses
+        :param port: port to listen on, 0 picks a free one
+        :param seed: seed of the 429 injection
+        :param etag: send ETag headers and answer matching If-None-Match requests with 304
+        """
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.etag = etag
+        self._random = random.Random(seed)
+        self._counts = Counter()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'FMPStub':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self) -> dict:
+        """
+        :return: number of requests, 429 responses and bytes served since the last reset
+        """
+        with self._lock:
+            return dict(self._counts)
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _respond(self, path: str, query: dict):
+        parts = path.strip('/').split('/')
+        with self._lock:
+            self._counts['requests'] += 1
+            throttled = self.throttle_rate > 0 and self._random.random() < self.throttle_rate
+            if throttled:
+                self._counts['throttled'] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if throttled:
+            return 429, {'Error Message': 'Limit Reach'}
+        if len(parts) == 2 and parts[0] in STATEMENT_FIELDS:
+            limit = int(query.get('limit', ['5'])[0])
+            return 200, synthetic_statement(parts[0], parts[1], query.get('period', ['annual'])[0], limit)
+        if len(parts) == 2 and parts[0] == 'profile':
+            return 200, [{'symbol': parts[1], 'companyName': f"{parts[1]} Inc.", 'mktCap': 1e9,
+                          'sector': 'Technology', 'industry': 'Software', 'exchangeShortName': 'NASDAQ'}]
+        if parts == ['stock', 'list']:
+            return 200, [{'symbol': f"T{i:05d}", 'name': f"T{i:05d} Inc.", 'exchangeShortName': 'NASDAQ',
+                          'type': 'stock'} for i in range(100)]
+        return 404, {'Error Message': f"Unknown endpoint {path}"}
+
+    def _handler(self):
+        stub = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                status, payload = stub._respond(url.path, parse_qs(url.query))
+                body = json.dumps(payload).encode()
+                etag = f'"{hashlib.sha1(body).hexdigest()}"' if stub.etag and status == 200 else None
+                if etag is not None and self.headers.get('If-None-Match') == etag:
+                    status, body = 304, b''
+                with stub._lock:
+                    stub._counts['bytes'] += len(body)
+                    if status == 304:
+                        stub._counts['not_modified'] += 1
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                if etag is not None:
+                    self.send_header('ETag', etag)
+                if status == 429:
+                    self.send_header('Retry-After', str(stub.retry_after))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return _Handler
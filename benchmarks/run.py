@@ -0,0 +1,224 @@
+"""
+Time the download and evaluation paths against a local FMP stub and synthetic data, e.g.
+
+    python -m benchmarks.run --sizes 50 500 --latency 0.02 --throttle-rate 0.01 --output bench.json
+
+Results are written as json so runs of different versions can be compared.
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Callable, List
+from src import shared
+from benchmarks.fmp_stub import FMPStub
+from benchmarks.synthetic import synthetic_tickers, synthetic_yf_download, write_artifacts, write_sp500_stocks
+
+CASES = ['batch_fetch', 'download_sp500_metrics', 'batch_fetch_tickers_ohlc', 'make_data', 'evaluate']
+_NOTEBOOKS_DIR = os.path.join(shared.PROJECT_DIR, 'notebooks')
+
+
+def main(argv: List[str] = None):
+    args = _parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp, FMPStub(latency=args.latency, throttle_rate=args.throttle_rate,
+                                                      retry_after=args.retry_after, seed=args.seed) as stub:
+        # the fetch layer reads these at call time, DataDownloader reads API_KEY on construction
+        os.environ['FMP_BASE_URL'] = shared.FMP_BASE_URL = stub.url
+        os.environ.setdefault('API_KEY', 'benchmark')
+        project_dir = shared.PROJECT_DIR
+        try:
+            for n in args.sizes:
+                ctx = _Context(os.path.join(tmp, f"n{n}"), synthetic_tickers(n), args, stub)
+                for case in args.cases:
+                    result = _run_case(case, ctx)
+                    results.append(result)
+                    print(f"{case:<26} n={n:<6} min={result['min']:.3f}s median={result['median']:.3f}s",
+                          file=sys.stderr)
+        finally:
+            shared.PROJECT_DIR = project_dir
+
+    report = {'meta': _meta(args), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    return report
+
+
+class _Context(object):
+    def __init__(self, root: str, tickers: List[str], args: argparse.Namespace, stub: FMPStub):
+        self.root = root
+        self.tickers = tickers
+        self.args = args
+        self.stub = stub
+        self.val = None
+
+    @property
+    def fetch_project(self) -> str:
+        # downloads go to their own project dir so they never overwrite the synthetic artifacts
+        return os.path.join(self.root, 'fetch')
+
+    @property
+    def artifacts(self) -> str:
+        return os.path.join(self.root, 'data', 'artifacts')
+
+
+def _run_case(case: str, ctx: _Context) -> dict:
+    setup, func = {
+        'batch_fetch': (_setup_fetch, _batch_fetch),
+        'download_sp500_metrics': (_setup_fetch, _download_sp500_metrics),
+        'batch_fetch_tickers_ohlc': (None, _batch_fetch_tickers_ohlc),
+        'make_data': (_setup_data, _make_data),
+        'evaluate': (_setup_evaluate, _evaluate),
+    }[case]
+    setup_seconds = _time(setup, ctx) if setup else 0.0
+    seconds, stub_stats = [], []
+    for _ in range(ctx.args.repeat):
+        ctx.stub.reset()
+        seconds.append(_time(func, ctx))
+        stub_stats.append(ctx.stub.stats())
+    return {
+        'case': case,
+        'n_tickers': len(ctx.tickers),
+        'seconds': seconds,
+        'min': min(seconds),
+        'median': statistics.median(seconds),
+        'setup_seconds': setup_seconds,
+        'stub': stub_stats[-1],
+    }
+
+
+def _time(func: Callable, ctx: _Context) -> float:
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        func(ctx)
+    return time.perf_counter() - start
+
+
+def _downloader(ctx: _Context):
+    from src.fetch_data import DataDownloader
+    from src.rate_limit import RateLimiter
+
+    return DataDownloader(rate_limiter=RateLimiter(requests_per_minute=ctx.args.rpm))
+
+
+def _setup_fetch(ctx: _Context):
+    shared.PROJECT_DIR = ctx.fetch_project
+    write_sp500_stocks(os.path.join(ctx.fetch_project, 'artifacts'), ctx.tickers)
+
+
+def _batch_fetch(ctx: _Context):
+    downloader = _downloader(ctx)
+    downloader.batch_fetch(downloader.fetch_key_metrics, ctx.tickers, period='quarter', limit=ctx.args.limit)
+
+
+def _download_sp500_metrics(ctx: _Context):
+    from src import general
+
+    general._downloader = _downloader(ctx)
+    general.download_sp500_metrics(general.get_downloader().fetch_key_metrics, period='quarter',
+                                   limit=ctx.args.limit)
+
+
+def _batch_fetch_tickers_ohlc(ctx: _Context):
+    import yfinance
+    from src import fetch_data
+
+    download = yfinance.download
+    yfinance.download = synthetic_yf_download
+    try:
+        fetch_data.DataDownloader().batch_fetch_tickers_ohlc(
+            ctx.tickers, start_date=f"{ctx.args.start_year}-01-01", end_date=f"{ctx.args.end_year}-12-31")
+    finally:
+        yfinance.download = download
+
+
+def _setup_data(ctx: _Context):
+    if not os.path.exists(ctx.artifacts):
+        write_artifacts(ctx.artifacts, ctx.tickers, ctx.args.start_year, ctx.args.end_year, seed=ctx.args.seed)
+
+
+def _make_data(ctx: _Context):
+    utils = _notebook_utils()
+    # time the cold load, not the pickle cache of load_statements
+    shutil.rmtree(os.path.join(ctx.artifacts, 'cache'), ignore_errors=True)
+    utils._PATH = ctx.artifacts + os.sep
+    _, ctx.val, _ = utils.make_data()
+
+
+def _setup_evaluate(ctx: _Context):
+    if ctx.val is None:
+        _setup_data(ctx)
+        _make_data(ctx)
+
+
+def _evaluate(ctx: _Context):
+    utils = _notebook_utils()
+
+    class _TopPeModel(utils.Model):
+        def preprocess(self, data):
+            return data
+
+        def predict(self, data):
+            return data.sort_values('peRatio', ascending=False)
+
+    utils.Evaluator(_TopPeModel()).evaluate(ctx.val)
+
+
+def _notebook_utils():
+    if _NOTEBOOKS_DIR not in sys.path:
+        sys.path.insert(0, _NOTEBOOKS_DIR)
+    import utils
+
+    return utils
+
+
+def _meta(args: argparse.Namespace) -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=shared.PROJECT_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'args': vars(args),
+    }
+
+
+def _parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 500, 5000], help='numbers of tickers')
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=CASES)
+    parser.add_argument('--repeat', type=int, default=1, help='timed runs per case and size')
+    parser.add_argument('--latency', type=float, default=0.0, help='stub response delay in seconds')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='fraction of stub responses that are 429')
+    parser.add_argument('--retry-after', type=float, default=0.0, help='Retry-After of the 429 responses')
+    parser.add_argument('--rpm', type=int, default=1_000_000,
+                        help='rate limiter budget, the default effectively disables client side pacing')
+    parser.add_argument('--limit', type=int, default=40, help='statement entries fetched per ticker')
+    parser.add_argument('--start-year', type=int, default=2005, help='first year of the synthetic data')
+    parser.add_argument('--end-year', type=int, default=2016, help='last year of the synthetic statements')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='json file to write the results to, stdout if omitted')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main()
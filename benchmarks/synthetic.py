@@ -0,0 +1,129 @@
+import os
+import zlib
+import numpy as np
+import pandas as pd
+from typing import List
+from src.price_panel import PricePanel
+
+_OHLC_FIELDS = ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
+_SECTORS = ['Information Technology', 'Health Care', 'Financials', 'Industrials', 'Energy', 'Utilities']
+
+# a handful of representative numeric fields per FMP endpoint used in fetch_data.py
+STATEMENT_FIELDS = {
+    'key-metrics': ['revenuePerShare', 'netIncomePerShare', 'marketCap', 'peRatio', 'pbRatio', 'roe',
+                    'debtToEquity', 'dividendYield', 'freeCashFlowPerShare', 'currentRatio'],
+    'income-statement': ['revenue', 'costOfRevenue', 'grossProfit', 'operatingIncome', 'netIncome', 'eps',
+                         'ebitda', 'weightedAverageShsOut'],
+    'balance-sheet-statement': ['cashAndCashEquivalents', 'totalCurrentAssets', 'totalAssets', 'totalLiabilities',
+                                'totalStockholdersEquity', 'totalDebt', 'netDebt'],
+    'cash-flow-statement': ['netIncome', 'operatingCashFlow', 'capitalExpenditure', 'freeCashFlow',
+                            'dividendsPaid', 'commonStockRepurchased'],
+    'income-statement-growth': ['growthRevenue', 'growthGrossProfit', 'growthNetIncome', 'growthEPS'],
+    'balance-sheet-statement-growth': ['growthTotalAssets', 'growthTotalLiabilities', 'growthTotalDebt'],
+    'cash-flow-statement-growth': ['growthOperatingCashFlow', 'growthFreeCashFlow', 'growthCapitalExpenditure'],
+    'ratios': ['currentRatio', 'grossProfitMargin', 'netProfitMargin', 'returnOnEquity', 'priceEarningsRatio'],
+    'financial-growth': ['revenueGrowth', 'epsgrowth', 'freeCashFlowGrowth', 'bookValueperShareGrowth'],
+}
+
+
+def synthetic_tickers(n: int) -> List[str]:
+    return [f"T{i:05d}" for i in range(n)]
+
+
+def synthetic_statement(api_path: str, symbol: str, period: str, limit: int, last_year: int = 2023) -> List[dict]:
+    """
+    FMP shaped json rows of one ticker, newest first, deterministic per (endpoint, symbol).
+    """
+    rng = np.random.default_rng(zlib.crc32(f"{api_path}/{symbol}".encode()))
+    fields = STATEMENT_FIELDS.get(api_path, STATEMENT_FIELDS['key-metrics'])
+    freq = pd.offsets.QuarterEnd() if period == 'quarter' else pd.offsets.YearEnd()
+    dates = pd.date_range(end=pd.Timestamp(last_year, 12, 31), periods=limit, freq=freq)[::-1]
+    values = rng.normal(size=(limit, len(fields))).round(6).tolist()
+    rows = []
+    for date, value in zip(dates, values):
+        row = {
+            'date': date.strftime('%Y-%m-%d'),
+            'symbol': symbol,
+            'reportedCurrency': 'USD',
+            'calendarYear': str(date.year),
+            'period': f"Q{date.quarter}" if period == 'quarter' else 'FY',
+        }
+        row.update(zip(fields, value))
+        rows.append(row)
+    return rows
+
+
+def synthetic_ohlc(tickers: List[str], start: str, end: str, seed: int = 0) -> pd.DataFrame:
+    """
+    Long Date, Ticker, OHLCV frame of geometric random walks on business days.
+    """
+    dates = pd.bdate_range(start, end)
+    arrays = _ohlc_arrays(len(dates), len(tickers), seed)
+    df = pd.DataFrame({
+        'Date': np.repeat(dates.values, len(tickers)),
+        'Ticker': pd.Categorical(np.tile(tickers, len(dates)), categories=sorted(tickers)),
+    })
+    for f in _OHLC_FIELDS:
+        df[f] = arrays[f].ravel()
+    return df
+
+
+def synthetic_yf_download(tickers, period: str = None, start: str = None, end: str = None,
+                          group_by: str = 'ticker', seed: int = 0, **kwargs) -> pd.DataFrame:
+    """
+    Stand-in for `yf.download` returning the same wide frame with (ticker, field) columns.
+    """
+    tickers = [tickers] if isinstance(tickers, str) else list(tickers)
+    dates = pd.bdate_range(start or '2000-01-01', end or '2023-12-31', name='Date')
+    arrays = _ohlc_arrays(len(dates), len(tickers), seed)
+    data = np.stack([arrays[f] for f in _OHLC_FIELDS], axis=2).reshape(len(dates), -1)
+    columns = pd.MultiIndex.from_product([tickers, _OHLC_FIELDS], names=['Ticker', 'Price'])
+    df = pd.DataFrame(data, index=dates, columns=columns)
+    return df if group_by == 'ticker' else df.swaplevel(axis=1).sort_index(axis=1)
+
+
+def write_artifacts(root: str, tickers: List[str], start_year: int, end_year: int, seed: int = 0):
+    """
+    Lay out a synthetic artifacts folder the way `make_data` expects it: sp500_stocks.csv,
+    {ticker}/quarter/key_metrics.csv and the sp500_panel price panel (SPY included).
+    """
+    write_sp500_stocks(root, tickers)
+
+    n_quarters = (end_year - start_year + 1) * 4
+    for ticker in tickers:
+        _dir = os.path.join(root, ticker.lower(), 'quarter')
+        os.makedirs(_dir, exist_ok=True)
+        rows = synthetic_statement('key-metrics', ticker, 'quarter', n_quarters, last_year=end_year)
+        pd.DataFrame(rows).to_csv(os.path.join(_dir, 'key_metrics.csv'), index=False)
+
+    panel_tickers = sorted(tickers + ['SPY'])
+    dates = pd.bdate_range(f"{start_year}-01-01", f"{end_year + 3}-12-31").values.astype('datetime64[D]')
+    arrays = _ohlc_arrays(len(dates), len(panel_tickers), seed)
+    PricePanel(dates, panel_tickers, arrays).save(os.path.join(root, 'sp500_panel'))
+
+
+def write_sp500_stocks(root: str, tickers: List[str]):
+    """
+    Write a synthetic artifacts/sp500_stocks.csv listing `tickers`.
+    """
+    os.makedirs(root, exist_ok=True)
+    pd.DataFrame({
+        'Symbol': tickers,
+        'Security': tickers,
+        'GICS Sector': [_SECTORS[i % len(_SECTORS)] for i in range(len(tickers))],
+        'GICS Sub-Industry': [f"Sub {i % 20}" for i in range(len(tickers))],
+    }).to_csv(os.path.join(root, 'sp500_stocks.csv'), index=False)
+
+
+def _ohlc_arrays(n_dates: int, n_tickers: int, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    close = (50 * np.exp(np.cumsum(rng.normal(3e-4, 0.02, (n_dates, n_tickers)), axis=0))).astype('float32')
+    spread = np.abs(rng.normal(0, 0.01, (n_dates, n_tickers))).astype('float32')
+    return {
+        'Open': close * (1 + spread / 2),
+        'High': close * (1 + spread),
+        'Low': close * (1 - spread),
+        'Close': close,
+        'Adj Close': close,
+        'Volume': rng.integers(10_000, 10_000_000, (n_dates, n_tickers)).astype('float64'),
+    }
@@ -0,0 +1,131 @@
+import contextlib
+import io
+import itertools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Tuple, Union
+import pandas as pd
+import utils
+from utils import Model, Evaluator, DATA_CUT_OFF, TRAIN_CUT_OFF, VAL_CUT_OFF
+from src.price_panel import PricePanel
+from src.membership import MembershipIndex
+
+# read-only data shared with the worker processes, inherited on fork instead of pickled per task
+_SHARED = dict()
+
+
+def rolling_windows(start: int = DATA_CUT_OFF,
+                    end: int = VAL_CUT_OFF,
+                    train_years: int = TRAIN_CUT_OFF - DATA_CUT_OFF,
+                    test_years: int = 1,
+                    step: int = 1,
+                    expanding: bool = False) -> List[Tuple[int, int, int]]:
+    """
+    Walk-forward windows between `start` and `end` calendar years.
+    :param start: first train year
+    :param end: last test year is end - 1
+    :param train_years: length of the train window
+    :param test_years: length of each test window
+    :param step: years the windows move forward by
+    :param expanding: keep the train start fixed at `start` instead of rolling it
+    :return: list of (train_start, test_start, test_end), train is [train_start, test_start), test [test_start, test_end)
+    """
+    windows = []
+    test_start = start + train_years
+    while test_start + test_years <= end:
+        train_start = start if expanding else test_start - train_years
+        windows.append((train_start, test_start, test_start + test_years))
+        test_start += step
+    return windows
+
+
+def model_grid(model_cls: type, **grid) -> Dict[str, Model]:
+    """
+    One model per combination of parameters, e.g. model_grid(PEModel, top_pe=[10, 20], sector=['IT', None])
+    :return: dict of readable name -> model instance
+    """
+    keys = list(grid)
+    models = dict()
+    for values in itertools.product(*(grid[k] for k in keys)):
+        params = dict(zip(keys, values))
+        name = f"{model_cls.__name__}(" + ", ".join(f"{k}={v!r}" for k, v in params.items()) + ")"
+        models[name] = model_cls(**params)
+    return models
+
+
+def walk_forward(models: Union[Dict[str, Model], List[Model]],
+                 data: pd.DataFrame,
+                 windows: List[Tuple[int, int, int]] = None,
+                 horizons: List[int] = (1, 2),
+                 quarters: List[str] = ("Q1",),
+                 workers: int = None,
+                 membership: MembershipIndex = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Evaluate every (model, window) pair in a process pool.
+    Each model is fit on the train years of a window and evaluated on its test years; returns after the test
+    window are still used as exit prices for the horizons. Requires `make_data()` to have loaded the prices.
+    :param models: dict of name -> model, or a list of models named by class
+    :param data: metrics in the format of `make_data()` sets, e.g. pd.concat([train, val])
+    :param windows: from `rolling_windows`, defaults to yearly test windows over the data
+    :param horizons: holding periods in years
+    :param quarters: report periods to rebalance on
+    :param workers: number of processes, defaults to cpu count
+    :param membership: point in time SP500 membership, train and test rows of stocks outside the index
+        at the report date are dropped
+    :return: one row per (model, window), and a per model summary across windows
+    """
+    if utils._PANEL is None and utils._DF_OHLC is None:
+        raise ValueError("Price data is not initialized, run make_data() before the backtest")
+    if not isinstance(models, dict):
+        models = {f"{type(m).__name__}_{i}": m for i, m in enumerate(models)}
+    if membership is not None:
+        data = data[membership.contains(data['symbol'], data['date'])]
+    if windows is None:
+        windows = rolling_windows(int(data['calendarYear'].min()), int(data['calendarYear'].max()) - max(horizons) + 1)
+
+    panel = utils._PANEL if utils._PANEL is not None else PricePanel.from_frame(utils._DF_OHLC, fields=['Close'])
+    shared = {'data': data, 'panel': panel, 'ohlc': utils._DF_OHLC,
+              'horizons': list(horizons), 'quarters': list(quarters)}
+    jobs = [(name, model, window) for name, model in models.items() for window in windows]
+    if not jobs:
+        raise ValueError(f"No (model, window) pairs to run, models {list(models)} windows {windows}")
+    if 'fork' in multiprocessing.get_all_start_methods():
+        _SHARED.update(shared)
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+    else:
+        # no fork, the shared data is pickled once per worker rather than once per job
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(shared,))
+    try:
+        with pool:
+            rows = list(pool.map(_run_job, jobs, chunksize=max(1, len(jobs) // (4 * (workers or os.cpu_count())))))
+    finally:
+        _SHARED.clear()
+
+    res = pd.DataFrame(rows)
+    metric_cols = [c for c in res.columns if c.endswith('_avg')]
+    summary = res.groupby('model', sort=False)[metric_cols].agg(['mean', 'std'])
+    summary.columns = [f"{metric}_{agg}" for metric, agg in summary.columns]
+    return res, summary.sort_values(summary.columns[0], ascending=False)
+
+
+def _init_worker(shared: dict):
+    _SHARED.update(shared)
+
+
+def _run_job(job) -> dict:
+    name, model, (train_start, test_start, test_end) = job
+    data = _SHARED['data']
+    horizons = _SHARED['horizons']
+    utils._PANEL = _SHARED['panel']
+    utils._DF_OHLC = _SHARED['ohlc']
+
+    years = data['calendarYear']
+    train = data[(years >= train_start) & (years < test_start)]
+    # returns of the last test year are realised up to max(horizons) years later
+    test = data[(years >= test_start) & (years < test_end + max(horizons))]
+    with contextlib.redirect_stdout(io.StringIO()):
+        model.fit(train)
+        overall_agg, _ = Evaluator(model, horizons=horizons, quarters=_SHARED['quarters']).evaluate(test)
+    return {'model': name, 'train_start': train_start, 'test_start': test_start, 'test_end': test_end,
+            **overall_agg}
@@ -7,37 +7,42 @@ sys.path.append(parent_dir)
 
 import pandas as pd
 import numpy as np
-from tqdm import tqdm
 from abc import ABC
-from datetime import datetime, timedelta
-from collections import defaultdict
+from datetime import timedelta
+from typing import List
 from src.general import download_sp500_ohlc
+from src.loader import load_statements
+from src.schema import compact_metrics, read_ohlc_csv
+from src.price_panel import PricePanel
+from src.trading_calendar import TradingCalendar
+from src.membership import MembershipIndex
+from src.features import build_feature_panel, add_price_features
+from src.analytics import analyze
 
 _PATH = "../artifacts/"
 
 DATA_CUT_OFF = 1985
 TRAIN_CUT_OFF = 2005
 VAL_CUT_OFF = 2015
-_TEST: pd.DataFrame
-_DF_OHLC: pd.DataFrame
+_TEST: pd.DataFrame = None
+_DF_OHLC: pd.DataFrame = None
+_PANEL: PricePanel = None
 
 
-def make_data():
+def make_data(features: bool = False):
     """
     Preprocessing train, val and test set for model building.
+    :param features: join every statement endpoint with TTM, YoY and price features (see `src.features`)
+        instead of the key metrics only
     :return: Train set, Val set and OHLC price data of all SP500 stocks back to as early as traceable.
     """
-    global _PATH, _TEST, _DF_OHLC
-    df_stock = pd.DataFrame()
-    for d in tqdm(os.listdir(_PATH)):
-        sub_path = os.path.join(_PATH, d)
-        if os.path.isdir(sub_path):
-            sub = pd.read_csv(os.path.join(sub_path, 'quarter', 'key_metrics.csv'))
-            df_stock = pd.concat([df_stock, sub])
-
-    df_stock.loc[df_stock['symbol'].isnull(), 'symbol'] = df_stock.loc[df_stock['symbol'].isnull(), 'wsymbol']
-    df_stock.drop(['wsymbol'], inplace=True, axis=1)
-    print("Loading quarterly metrics done data shape", df_stock.shape)
+    global _PATH, _TEST, _DF_OHLC, _PANEL
+    if features:
+        df_stock = build_feature_panel('quarter', artifacts_dir=_PATH)
+        print("Loading quarterly feature panel done data shape", df_stock.shape)
+    else:
+        df_stock = load_statements('key_metrics', 'quarter', artifacts_dir=_PATH)
+        print("Loading quarterly metrics done data shape", df_stock.shape)
 
     basic = pd.read_csv(os.path.join(_PATH, 'sp500_stocks.csv'))
     basic['Symbol'] = basic['Symbol'].str.replace('.', '-')
@@ -51,7 +56,7 @@ def make_data():
     )
 
     df_stock_all.drop(['Symbol'], axis=1, inplace=True)
-    df_stock_all['date'] = pd.to_datetime(df_stock_all['date'])
+    df_stock_all = compact_metrics(df_stock_all)
 
     train = df_stock_all[
         (df_stock_all['calendarYear'] >= DATA_CUT_OFF) & (df_stock_all['calendarYear'] < TRAIN_CUT_OFF)
@@ -68,18 +73,36 @@ def make_data():
     print('Train size', train.shape, 'Val size', val.shape, 'Test size', _TEST.shape)
 
     _path = os.path.join(_PATH, "sp500_ohlc.csv")
-    if os.path.exists(_path):
-        df_ohlc = pd.read_csv(_path)
+    _panel_path = os.path.join(_PATH, "sp500_panel")
+    if PricePanel.exists(_panel_path):
+        _PANEL = PricePanel.open(_panel_path)
+        df_ohlc = _PANEL.to_long_frame()
     else:
-        print("Downloading sp500 OHLC")
-        df_ohlc = download_sp500_ohlc(period='max', save_file='sp500_ohlc.csv')
-    df_ohlc['Date'] = pd.to_datetime(df_ohlc['Date'])
+        if os.path.exists(_path):
+            df_ohlc = read_ohlc_csv(_path)
+        else:
+            print("Downloading sp500 OHLC")
+            df_ohlc = download_sp500_ohlc(period='max', save_file='sp500_ohlc.csv')
+        _PANEL = PricePanel.from_frame(df_ohlc)
+        _PANEL.save(_panel_path)
     print("sp500 OHLC downloaded", df_ohlc.shape)
     _DF_OHLC = df_ohlc
+    if features:
+        # prices as of the day each report became public
+        train = add_price_features(train, _PANEL)
+        val = add_price_features(val, _PANEL)
+        _TEST = add_price_features(_TEST, _PANEL)
     return train, val, df_ohlc
 
 
 class Model(ABC):
+    def fit(self, data: pd.DataFrame):
+        """
+        Optionally learn from the training window before evaluation, used by walk-forward backtests.
+        :param data: data frame of the same format as train set.
+        """
+        pass
+
     def preprocess(self, data: pd.DataFrame):
         """
         Put data preprocessing and feature engineering here. The input data should have the same format
@@ -100,10 +123,27 @@ class Model(ABC):
 class Evaluator:
     _top_k = 30
 
-    def __init__(self, model: Model):
+    def __init__(self,
+                 model: Model,
+                 horizons: List[int] = (1, 2),
+                 quarters: List[str] = ("Q1",),
+                 membership: MembershipIndex = None):
+        """
+        :param model: model to evaluate
+        :param horizons: holding periods in years to evaluate returns over
+        :param quarters: report periods the model rebalances on, e.g. ["Q1", "Q2", "Q3", "Q4"]
+        :param membership: point in time SP500 membership, the model only sees stocks that were in the index
+            at the report date instead of today's constituents (survivorship bias)
+        """
         self.data = None
         self.ohlc = None
+        self.panel = None
+        self.calendar = None
+        self.picks = None
         self.model = model
+        self.horizons = list(horizons)
+        self.quarters = list(quarters)
+        self.membership = membership
 
     def evaluate(self, data: pd.DataFrame = None):
         if data is not None:
@@ -114,104 +154,141 @@ class Evaluator:
                 raise ValueError("Test data is not initialized, run make_data() before evaluation")
             self.data = _TEST
             print("Evaluate on test data set", self.data.shape)
+        if self.membership is not None:
+            self.data = self.data[self.membership.contains(self.data['symbol'], self.data['date'])]
+            print("Point in time SP500 members", self.data.shape)
 
-        self.ohlc = _DF_OHLC[_DF_OHLC['Date'] >= self.data['date'].min()][['Date', 'Ticker', 'Close']]
-
-        years = range(self.data['calendarYear'].min(), self.data['calendarYear'].max() - 1)
-        quarter = ["Q1"]
-        eval_res = dict()
+        years = self._years()
+        picks = []
+        groups = self.data.groupby(['calendarYear', 'period'], observed=True, sort=False).indices
         for year in years:
-            for q in quarter:
-                cond_ = (self.data['calendarYear'] == year) & (self.data['period'] == q)
-                sub_ = self.data[cond_]
+            for q in self.quarters:
+                sub_ = self.data.iloc[groups.get((year, q), [])]
                 feat_ = self.model.preprocess(sub_)
-                top_stocks = self.model.predict(feat_)[:self._top_k]['symbol'].to_list()
+                top_stocks = self.model.predict(feat_)[:self._top_k]['symbol'].astype(str).to_list()
                 print("Picked stocks", top_stocks)
+                picks.append(pd.DataFrame({'calendarYear': year, 'period': q, 'symbol': top_stocks}))
+        return self.evaluate_picks(pd.concat(picks, ignore_index=True))
 
-                cond_ = cond_ & (self.data['symbol'].isin(top_stocks))
-                sub_ = self.data[cond_]
-                sub_ = self._find_first_monday_after_thirty_days(sub_)
-                sub_ohlc_ = self._enrich_with_close_price(sub_)
-
-                # evaluate price change after 1 year
-                cond_ = (self.data['calendarYear'] == year + 1) & (self.data['period'] == q) & (
-                    self.data['symbol'].isin(top_stocks))
-                sub_1yr_ = self.data[cond_]
-                sub_1yr_ = self._find_first_monday_after_thirty_days(sub_1yr_)
-                sub_1yr_ohlc_ = self._enrich_with_close_price(sub_1yr_)
-
-                sub_c_ = sub_ohlc_.merge(
-                    sub_1yr_ohlc_,
-                    on='symbol',
-                    how='inner',
-                    suffixes=('', '_1year')
-                )
-                sub_c_['inc_pct_1y'] = sub_c_.eval('(Close_1year-Close)/Close')
-                eval_res['-'.join([str(year), q, '1y'])] = sub_c_
-
-                # evaluate price change after 2 years
-                cond_ = (self.data['calendarYear'] == year + 2) & (self.data['period'] == q) & (
-                    self.data['symbol'].isin(top_stocks))
-                sub_2yr_ = self.data[cond_]
-                sub_2yr_ = self._find_first_monday_after_thirty_days(sub_2yr_)
-                sub_2yr_ohlc_ = self._enrich_with_close_price(sub_2yr_)
-                sub_c_ = sub_ohlc_.merge(
-                    sub_2yr_ohlc_,
-                    on='symbol',
-                    how='inner',
-                    suffixes=('', '_2year')
-                )
-                sub_c_['inc_pct_2y'] = sub_c_.eval('(Close_2year-Close)/Close')
-                eval_res['-'.join([str(year), q, '2y'])] = sub_c_
-                print(f'Done evaluation {str(year)}-{q} ###############')
-
-        aggregated_res = defaultdict(list)
-        indexes = []
-        for year in years:
-            for q in quarter:
-                indexes.append(f"{str(year)}-{q}")
-                for suf in ['1y', '2y']:
-                    key = '-'.join([str(year), q, suf])
-                    sub_ = eval_res[key]
-                    v = sub_[f'inc_pct_{suf}'].values
-
-                    aggregated_res[f'{suf}_mean'].append(np.mean(v))
-                    aggregated_res[f'{suf}_std'].append(np.std(v))
-
-        res_df = pd.DataFrame(aggregated_res, index=indexes)
-        overall_agg = {
-            '1_year_avg': res_df['1y_mean'].mean(),
-            '1_year_std': res_df['1y_mean'].std(),
-            '2_year_avg': res_df['2y_mean'].mean(),
-            '2_year_std': res_df['2y_mean'].std(),
-        }
+    def evaluate_picks(self, picks: pd.DataFrame):
+        """
+        Score the picks of every rebalance date at once.
+        Each pick is bought on the first Monday 30 days after its report `date` and valued on the first Monday
+        30 days after the report of the same period `h` years later, for every horizon `h`.
+        :param picks: data frame with calendarYear, period and symbol of every picked stock
+        :return: overall aggregates and a per rebalance date breakdown
+        """
+        if self.data is None:
+            self.data = _TEST
+        self._init_prices()
+        reports = self._reports()
+
+        picks = picks[['calendarYear', 'period', 'symbol']].astype({'symbol': str, 'period': str})
+        self.picks = picks
+        # one row per (pick, offset in years), offset 0 being the entry
+        offsets = [0] + self.horizons
+        legs = pd.concat([picks.assign(h=h, report_year=picks['calendarYear'] + h) for h in offsets],
+                         ignore_index=True)
+        legs = legs.merge(reports.rename(columns={'calendarYear': 'report_year'}),
+                          on=['symbol', 'report_year', 'period'], how='inner')
+        # row of the first Monday 30 days after the report, the next trading day if that Monday is a holiday
+        rows = self.calendar.first_monday_index(legs['date'], days=30)
+        legs['first_monday'] = self.calendar.day(rows)
+        legs['Close'] = self.panel.take('Close', legs['symbol'].to_numpy(), rows)
+        legs = legs.dropna(subset=['Close'])
+
+        key = ['calendarYear', 'period', 'symbol']
+        prices = legs.pivot_table(index=key, columns='h', values='Close', aggfunc='first')
+        entry = prices[0] if 0 in prices else pd.Series(np.nan, index=prices.index)
+
+        index = pd.MultiIndex.from_product([self._years(), self.quarters], names=['calendarYear', 'period'])
+        aggregated_res = dict()
+        for h in self.horizons:
+            exit_ = prices[h] if h in prices else pd.Series(np.nan, index=prices.index)
+            inc_pct = ((exit_ - entry) / entry).dropna()
+            grouped = inc_pct.groupby(level=['calendarYear', 'period'])
+            aggregated_res[f'{h}y_mean'] = grouped.mean().reindex(index)
+            aggregated_res[f'{h}y_std'] = grouped.std(ddof=0).reindex(index)
+
+        res_df = pd.DataFrame(aggregated_res, index=index)
+        res_df.index = [f"{year}-{q}" for year, q in index]
+        overall_agg = dict()
+        for h in self.horizons:
+            overall_agg[f'{h}_year_avg'] = res_df[f'{h}y_mean'].mean()
+            overall_agg[f'{h}_year_std'] = res_df[f'{h}y_mean'].std()
         return overall_agg, res_df
 
+    def performance(self, picks=None, benchmark: str = 'SPY', risk_free_rate: float = 0.0):
+        """
+        Daily equity curves of holding the picks from one rebalance to the next, and their CAGR, Sharpe, Sortino,
+        Omega, max drawdown, turnover and metrics relative to the benchmark, see `analytics.analyze`.
+        The picks of a report period are bought equal weighted on the latest first Monday 30 days after their
+        reports, as in `evaluate_picks`, and the last ones are held for a year.
+        :param picks: picks as passed to `evaluate_picks`, or name -> picks to compare several strategies at once,
+            defaults to the picks of the last evaluation
+        :param benchmark: ticker held over the same days, or None
+        :param risk_free_rate: annual rate of the Sharpe and Sortino ratios
+        :return: data frame of daily values per strategy and data frame of metrics per strategy
+        """
+        picks = self.picks if picks is None else picks
+        if picks is None:
+            raise ValueError("No picks to evaluate, run evaluate() or pass picks")
+        if isinstance(picks, pd.DataFrame):
+            picks = {type(self.model).__name__: picks}
+        if self.data is None:
+            self.data = _TEST
+        if self.panel is None:
+            self._init_prices()
+        reports = self._reports()
+
+        key = ['calendarYear', 'period', 'symbol']
+        strategies, last = dict(), None
+        for name, p in picks.items():
+            legs = p[key].astype({'symbol': str, 'period': str}).merge(reports, on=key, how='inner')
+            legs['row'] = self.calendar.first_monday_index(legs['date'], days=30)
+            rows = legs.groupby(['calendarYear', 'period'])['row'].transform('max').to_numpy()
+            ok = rows < len(self.calendar)
+            strategies[name] = pd.DataFrame({'date': self.calendar.day(rows[ok]), 'symbol': legs['symbol'][ok]})
+            if ok.any():
+                last = max(last or 0, rows[ok].max())
+        end = None if last is None else self.calendar.days[last] + np.timedelta64(365, 'D')
+        return analyze(self.panel, strategies, benchmark=benchmark, end=end, risk_free_rate=risk_free_rate)
+
+    def _reports(self) -> pd.DataFrame:
+        reports = self.data[['symbol', 'calendarYear', 'period', 'date']].copy()
+        reports['symbol'] = reports['symbol'].astype(str)
+        reports['period'] = reports['period'].astype(str)
+        return reports.drop_duplicates(['symbol', 'calendarYear', 'period'])
+
+    def _years(self):
+        return range(self.data['calendarYear'].min(), self.data['calendarYear'].max() - max(self.horizons) + 1)
+
+    def _init_prices(self):
+        if _PANEL is not None:
+            self.panel = _PANEL
+        else:
+            self.ohlc = _DF_OHLC[_DF_OHLC['Date'] >= self.data['date'].min()][['Date', 'Ticker', 'Close']]
+            self.panel = PricePanel.from_frame(self.ohlc, fields=['Close'])
+        self.calendar = TradingCalendar.from_panel(self.panel)
+
     def calculate_spy_annual_return(self):
         years = range(self.data['calendarYear'].min(), self.data['calendarYear'].max() - 1)
-        sub_ = self.ohlc[self.ohlc['Ticker'] == 'SPY']
-        sub_.sort_values(by='Date', inplace=True)
-        ret = []
-        for year in years:
-            yr_sub_ = sub_[sub_['Date'].dt.year == year]
-            start = yr_sub_.iloc[0]['Close']
-            end = yr_sub_.iloc[-1]['Close']
-            ret.append((end - start) / start)
-        res = pd.DataFrame({'year': years, 'return': ret})
+        if self.panel is None:
+            self._init_prices()
+        close = self.panel.column('Close', 'SPY')
+        # first and last day with a SPY price of every year, from the first report date on as the evaluated
+        # prices are, so the first year only counts from there even if the shared panel starts earlier
+        priced = np.flatnonzero(~np.isnan(close))
+        priced = priced[priced >= self.calendar.next_index(self.data['date'].min())]
+        lo, hi = TradingCalendar(self.panel.dates[priced]).year_index(years)
+        ok = hi > lo
+        start = np.full(len(lo), np.nan)
+        end = np.full(len(lo), np.nan)
+        start[ok] = close[priced[lo[ok]]]
+        end[ok] = close[priced[hi[ok] - 1]]
+        res = pd.DataFrame({'year': years, 'return': (end - start) / start})
         return res, {'average': res['return'].mean(), 'std': res['return'].std()}
 
-    def _find_first_monday_after_thirty_days(self, data):
-        data['date_plus_30'] = data['date'] + pd.Timedelta(days=30)
-        data['first_monday'] = data['date_plus_30'].apply(lambda x: find_next_monday(x))
-        return data
-
-    def _enrich_with_close_price(self, data):
-        return data.merge(
-            self.ohlc,
-            left_on=['symbol', 'first_monday'],
-            right_on=['Ticker', 'Date'],
-            how='inner')[['symbol', 'Close']]
-
 
 def find_next_monday(date: pd.Timestamp):
     # 0 is Monday
@@ -0,0 +1,228 @@
+from typing import Dict, Tuple, Union
+import numpy as np
+import pandas as pd
+from src.price_panel import PricePanel
+from src.trading_calendar import TradingCalendar
+
+TRADING_DAYS = 252
+
+METRIC_COLUMNS = ['start', 'end', 'total_return', 'cagr', 'volatility', 'sharpe', 'sortino', 'omega', 'max_drawdown',
+                  'turnover', 'benchmark_cagr', 'excess_cagr', 'alpha', 'beta', 'tracking_error', 'information_ratio']
+
+
+def sortino_ratio(weights: np.ndarray, returns, target_return=0.0):
+    """
+    Negative annualised Sortino ratio of daily `returns`, the objective minimised by method='sortino'.
+    """
+    returns = np.asarray(returns)
+    portfolio_return = np.sum(returns.mean(axis=0) * weights) * TRADING_DAYS
+    downside_returns = np.where(returns < target_return, returns - target_return, 0)
+    downside_risk = np.sqrt(np.mean(np.square(downside_returns)) * TRADING_DAYS)
+    return -portfolio_return / downside_risk if downside_risk != 0 else float('-inf')
+
+
+def omega_ratio(weights: np.ndarray, returns, threshold_return=0.0):
+    """
+    Negative Omega ratio of daily `returns`, the objective minimised by method='omega'.
+    """
+    threshold_return = threshold_return / TRADING_DAYS
+    relative_returns = np.asarray(returns) @ weights - threshold_return
+    gain = relative_returns[relative_returns > 0].sum()
+    loss = -relative_returns[relative_returns < 0].sum()
+    return -(gain / loss) if loss != 0 else float('-inf')
+
+
+def equity_curves(panel: PricePanel,
+                  strategies: Dict[str, pd.DataFrame],
+                  end=None,
+                  field: str = 'Close',
+                  calendar: TradingCalendar = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Daily value of every strategy, starting at 1 on its first rebalance with a priced pick. Each rebalance buys the
+    target weights at that day's price and holds the shares, so weights drift with prices until the next rebalance;
+    a rebalance without any priced pick keeps the previous shares.
+    Prices are only read for the tickers some strategy holds, forward filled over gaps.
+    :param panel: daily price panel
+    :param strategies: name -> data frame with `date`, `symbol` and optionally `weight` per holding. Every date
+        is a rebalance, resolved to the next trading day; without `weight` the picks of a date are equal weighted.
+        Weights are normalised to sum to one over the names priced at the rebalance
+    :param end: last day of the curves, defaults to the last trading day of the panel
+    :param field: price field
+    :param calendar: trading calendar of the panel, built from it if not given
+    :return: dates x strategies frame of values, NaN before the first priced rebalance, and a rebalances frame with
+        the one way turnover of each rebalance (the first one excluded)
+    """
+    calendar = calendar or TradingCalendar.from_panel(panel)
+    last_row = len(calendar) - 1 if end is None else int(calendar.prev_index(end))
+    plans = {name: _plan(df, calendar, last_row) for name, df in strategies.items()}
+    tickers = sorted({t for plan in plans.values() for _, symbols, _ in plan for t in symbols})
+    prices = _forward_filled(panel, field, tickers, last_row + 1)
+    column_of = {t: i for i, t in enumerate(tickers)}
+
+    values = np.full((last_row + 1, len(plans)), np.nan)
+    rebalances = []
+    for j, (name, plan) in enumerate(plans.items()):
+        holding, held = np.zeros(len(tickers)), None
+        for k, (row, symbols, weights) in enumerate(plan):
+            end_row = plan[k + 1][0] if k + 1 < len(plan) else last_row
+            cols = np.array([column_of[t] for t in symbols], dtype=np.int64)
+            entry = prices[row, cols]
+            priced = ~np.isnan(entry) & (entry > 0)
+            if priced.any():
+                cols, entry, weights = cols[priced], entry[priced], weights[priced] / weights[priced].sum()
+                target = np.zeros(len(tickers))
+                target[cols] = weights
+                if held is not None:
+                    rebalances.append({'strategy': name, 'date': pd.Timestamp(calendar.days[row]),
+                                       'turnover': np.abs(target - holding).sum() / 2})
+                held = cols, entry, weights, 1.0 if held is None else values[row, j]
+            elif held is None:
+                # nothing bought yet, the curve starts at the first rebalance with a priced pick
+                continue
+            # without a priced pick the previous shares are held on and keep drifting
+            cols, entry, weights, value = held
+            segment = value * (prices[row:end_row + 1, cols] / entry) @ weights
+            values[row:end_row + 1, j] = segment
+            drifted = weights * prices[end_row, cols] / entry
+            holding = np.zeros(len(tickers))
+            holding[cols] = drifted / drifted.sum()
+    curves = pd.DataFrame(values, index=pd.DatetimeIndex(calendar.days[:last_row + 1], name='Date'),
+                          columns=list(plans))
+    return curves, pd.DataFrame(rebalances, columns=['strategy', 'date', 'turnover'])
+
+
+def benchmark_curve(panel: PricePanel, ticker: str = 'SPY', start=None, end=None, field: str = 'Close') -> pd.Series:
+    """
+    Buy and hold value of one ticker, 1 on its first priced day on or after `start`.
+    """
+    close = pd.Series(panel.column(field, ticker).astype('float64'), index=pd.DatetimeIndex(panel.dates, name='Date'))
+    close = close.loc[start:end].ffill()
+    first = close.first_valid_index()
+    return close / close.loc[first] if first is not None else close
+
+
+def performance_metrics(curves: pd.DataFrame,
+                        benchmark: pd.Series = None,
+                        turnover: pd.DataFrame = None,
+                        risk_free_rate: float = 0.0,
+                        target_return: float = 0.0,
+                        periods: int = TRADING_DAYS) -> pd.DataFrame:
+    """
+    Return and risk metrics of every equity curve, computed together from one matrix of daily returns.
+    Each curve is measured over its own span, from its first to its last value, and the benchmark over the same span.
+    :param curves: dates x strategies values, e.g. from `equity_curves`
+    :param benchmark: benchmark values on the same dates, e.g. from `benchmark_curve`
+    :param turnover: rebalances frame from `equity_curves`, averaged per strategy
+    :param risk_free_rate: annual rate subtracted in the Sharpe and Sortino ratios
+    :param target_return: annual threshold of the Sortino downside and the Omega ratio
+    :param periods: return periods per year
+    :return: data frame of METRIC_COLUMNS indexed by strategy
+    """
+    values = curves.to_numpy(dtype='float64')
+    dates = curves.index
+    n_rows, n_cols = values.shape
+    valid = ~np.isnan(values)
+    first = np.where(valid.any(axis=0), valid.argmax(axis=0), 0)
+    last = np.where(valid.any(axis=0), n_rows - 1 - valid[::-1].argmax(axis=0), 0)
+    cols = np.arange(n_cols)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        daily = values[1:] / values[:-1] - 1
+        mean = np.nanmean(daily, axis=0)
+        volatility = np.nanstd(daily, axis=0, ddof=1) * np.sqrt(periods)
+        annual_return = mean * periods
+        threshold = target_return / periods
+        downside = np.sqrt(np.nanmean(np.square(np.minimum(daily - threshold, 0)), axis=0) * periods)
+        gains = np.nansum(np.maximum(daily - threshold, 0), axis=0)
+        losses = np.nansum(np.maximum(threshold - daily, 0), axis=0)
+        years = (dates[last] - dates[first]).days.to_numpy() / 365.25
+        total_return = values[last, cols] / values[first, cols] - 1
+        cagr = (1 + total_return) ** (1 / years) - 1
+        max_drawdown = np.nanmin(values / np.fmax.accumulate(values, axis=0) - 1, axis=0)
+        res = pd.DataFrame({
+            'start': dates[first],
+            'end': dates[last],
+            'total_return': total_return,
+            'cagr': cagr,
+            'volatility': volatility,
+            'sharpe': (annual_return - risk_free_rate) / volatility,
+            'sortino': (annual_return - risk_free_rate) / downside,
+            'omega': gains / losses,
+            'max_drawdown': max_drawdown,
+        }, index=curves.columns)
+
+        res['turnover'] = np.nan
+        if turnover is not None and len(turnover):
+            res['turnover'] = turnover.groupby('strategy')['turnover'].mean().reindex(curves.columns)
+
+        for c in METRIC_COLUMNS[-6:]:
+            res[c] = np.nan
+        if benchmark is not None:
+            bench = benchmark.reindex(dates).ffill().to_numpy(dtype='float64')
+            bench_daily = bench[1:] / bench[:-1] - 1
+            # benchmark returns over each strategy's own span
+            bench_daily = np.where(np.isnan(daily), np.nan, bench_daily[:, None])
+            bench_mean = np.nanmean(bench_daily, axis=0)
+            beta = (np.nanmean((daily - mean) * (bench_daily - bench_mean), axis=0)
+                    / np.nanmean(np.square(bench_daily - bench_mean), axis=0))
+            active = daily - bench_daily
+            tracking_error = np.nanstd(active, axis=0, ddof=1) * np.sqrt(periods)
+            benchmark_cagr = (bench[last] / bench[first]) ** (1 / years) - 1
+            res['benchmark_cagr'] = benchmark_cagr
+            res['excess_cagr'] = cagr - benchmark_cagr
+            res['alpha'] = (mean - beta * bench_mean) * periods
+            res['beta'] = beta
+            res['tracking_error'] = tracking_error
+            res['information_ratio'] = np.nanmean(active, axis=0) * periods / tracking_error
+    return res[METRIC_COLUMNS]
+
+
+def analyze(panel: PricePanel,
+            strategies: Dict[str, pd.DataFrame],
+            benchmark: Union[str, pd.Series] = 'SPY',
+            end=None,
+            risk_free_rate: float = 0.0,
+            field: str = 'Close') -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Equity curves and metrics of many strategies against one benchmark, see `equity_curves` and `performance_metrics`.
+    :param benchmark: ticker in the panel held from the first rebalance of any strategy, a curve, or None
+    :return: curves, including the benchmark as its own column, and metrics indexed by strategy
+    """
+    calendar = TradingCalendar.from_panel(panel)
+    curves, rebalances = equity_curves(panel, strategies, end=end, field=field, calendar=calendar)
+    if isinstance(benchmark, str):
+        start = curves.apply(pd.Series.first_valid_index).min()
+        benchmark = benchmark_curve(panel, benchmark, start=start, end=curves.index[-1], field=field).rename(benchmark)
+    metrics = performance_metrics(curves, benchmark, rebalances, risk_free_rate=risk_free_rate)
+    if benchmark is not None:
+        curves = curves.assign(**{str(benchmark.name or 'benchmark'): benchmark.reindex(curves.index)})
+    return curves, metrics
+
+
+def _plan(df: pd.DataFrame, calendar: TradingCalendar, last_row: int) -> list:
+    """
+    Rebalances of one strategy as a list of (row, symbols, weights), sorted by row, up to `last_row`.
+    """
+    df = df.assign(row=calendar.next_index(df['date']), symbol=df['symbol'].astype(str))
+    df = df[df['row'] <= last_row]
+    if 'weight' not in df.columns:
+        df = df.assign(weight=1.0)
+    plan = []
+    for row, group in df.groupby('row', sort=True):
+        # the same symbol picked twice on one day is held once with the summed weight
+        weights = group.groupby('symbol', sort=False)['weight'].sum()
+        plan.append((int(row), weights.index.to_numpy(), weights.to_numpy(dtype='float64')))
+    return plan
+
+
+def _forward_filled(panel: PricePanel, field: str, tickers: list, n_rows: int) -> np.ndarray:
+    """
+    Rows [0, n_rows) of the price columns of `tickers`, NaN gaps filled with the last price, all NaN if unknown.
+    """
+    prices = np.full((n_rows, len(tickers)), np.nan)
+    in_panel = set(panel.tickers)
+    known = [i for i, t in enumerate(tickers) if t in in_panel]
+    if known:
+        cols = [panel.ticker_index(tickers[i]) for i in known]
+        prices[:, known] = panel.fields[field][:n_rows, cols]
+    return pd.DataFrame(prices).ffill().to_numpy()
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import time
+from typing import List, Tuple, Dict, Callable, TYPE_CHECKING
+import aiohttp
+import pandas as pd
+from src import shared
+from src.rate_limit import RateLimiter, shared_rate_limiter, parse_retry_after
+from src.metrics import FetchMetrics
+from src.ingest import ingest_json
+
+if TYPE_CHECKING:
+    from src.http_cache import ResponseCache
+
+_RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class AsyncFetcher(object):
+    """
+    Fetch FMP statement endpoints concurrently over a single pooled aiohttp session.
+    """
+
+    def __init__(self,
+                 api_key: str,
+                 concurrency: int = 16,
+                 timeout: float = 30,
+                 retries: int = 3,
+                 backoff: float = 1.0,
+                 base_url: str = None,
+                 rate_limiter: RateLimiter = None,
+                 metrics: FetchMetrics = None,
+                 cache: 'ResponseCache' = None):
+        """
+        :param api_key: FMP api key
+        :param concurrency: max number of requests in flight, also the size of the connection pool
+        :param timeout: per request timeout in seconds
+        :param retries: number of retries on timeouts, connection errors and 5xx/429 responses
+        :param backoff: base seconds of the exponential backoff between retries
+        :param base_url: FMP api base url, defaults to shared.FMP_BASE_URL
+        :param rate_limiter: limiter every request waits on, defaults to the process wide one
+        :param metrics: recorder of per endpoint latency, status, retries and rate limit waits
+        :param cache: optional response cache, fresh entries skip the request and stale ones are revalidated
+        """
+        self.api_key = api_key
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.base_url = base_url or shared.FMP_BASE_URL
+        self.rate_limiter = rate_limiter or shared_rate_limiter()
+        self.metrics = metrics or FetchMetrics()
+        self.cache = cache
+
+    def run(self,
+            jobs: List[Tuple[str, str, int]],
+            period: str,
+            on_result: Callable = None) -> Dict[Tuple[str, str], pd.DataFrame]:
+        """
+        Run all (api path, ticker, limit) jobs to completion.
+        :param jobs: list of (api path, ticker, number of entries to fetch)
+        :param period: annual or quarter
+        :param on_result: optional callback(api_path, ticker, period, df) run in a worker thread, e.g. to save csv.
+            If it returns a data frame, that frame replaces the fetched one in the results.
+        :return: dict of (api path, ticker) -> data frame for every successful job
+        """
+        return asyncio.run(self.fetch_all(jobs, period, on_result))
+
+    async def fetch_all(self,
+                        jobs: List[Tuple[str, str, int]],
+                        period: str,
+                        on_result: Callable = None) -> Dict[Tuple[str, str], pd.DataFrame]:
+        connector = aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = {}
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            tasks = [
+                self._fetch_job(session, semaphore, api_path, ticker, period, limit, on_result)
+                for api_path, ticker, limit in jobs
+            ]
+            for (api_path, ticker, _), res in zip(jobs, await asyncio.gather(*tasks, return_exceptions=True)):
+                if isinstance(res, Exception):
+                    logging.error(f"Error downloading {api_path} for {ticker} {res}")
+                else:
+                    results[(api_path, ticker)] = res
+        logging.info(f"Finished {len(results)}/{len(jobs)} jobs")
+        return results
+
+    async def _fetch_job(self,
+                         session: aiohttp.ClientSession,
+                         semaphore: asyncio.Semaphore,
+                         api_path: str,
+                         ticker: str,
+                         period: str,
+                         limit: int,
+                         on_result: Callable = None) -> pd.DataFrame:
+        symbol = ticker.replace('.', '-').upper()
+        url = f"{self.base_url}/{api_path}/{symbol}"
+        params = {'period': period, 'limit': limit, 'apikey': self.api_key}
+        body = await self._get_body(session, semaphore, url, params, (api_path, symbol, period, limit))
+        with self.metrics.timed(api_path, 'parse'):
+            df = ingest_json(body, api_path)
+        if on_result is not None:
+            saved = await asyncio.to_thread(on_result, api_path, ticker, period, df)
+            if saved is not None:
+                df = saved
+        return df
+
+    async def _get_body(self,
+                        session: aiohttp.ClientSession,
+                        semaphore: asyncio.Semaphore,
+                        url: str,
+                        params: dict,
+                        key: tuple) -> bytes:
+        endpoint = key[0]
+        entry = await asyncio.to_thread(self.cache.get, key) if self.cache is not None else None
+        if entry is not None and entry.fresh():
+            self.metrics.record_cache(endpoint, 'hit')
+            return entry.body
+        async with semaphore:
+            status, body, headers = await self._get(session, url, params, endpoint,
+                                                    entry.conditional_headers() if entry else None)
+        if status == 304 and entry is not None:
+            self.metrics.record_cache(endpoint, 'revalidated')
+            entry = await asyncio.to_thread(self.cache.revalidated, entry, headers.get('ETag'),
+                                            headers.get('Last-Modified'))
+            body = entry.body
+        elif self.cache is not None:
+            self.metrics.record_cache(endpoint, 'miss')
+            await asyncio.to_thread(self.cache.put, key, body, headers.get('ETag'), headers.get('Last-Modified'))
+        return body
+
+    async def _get(self,
+                   session: aiohttp.ClientSession,
+                   url: str,
+                   params: dict,
+                   endpoint: str,
+                   headers: dict = None) -> Tuple[int, bytes, dict]:
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.metrics.record_retry(endpoint)
+            self.metrics.record_wait(endpoint, await self.rate_limiter.acquire_async())
+            start = time.perf_counter()
+            try:
+                async with session.get(url, params=params, headers=headers) as response:
+                    body = await response.read()
+                    self.metrics.record_request(endpoint, response.status, time.perf_counter() - start, len(body))
+                    if response.status in (200, 304):
+                        self.rate_limiter.on_success()
+                        return response.status, body, response.headers.copy()
+                    body = body.decode(errors='replace')
+                    if response.status not in _RETRY_STATUS or attempt == self.retries:
+                        raise ValueError(response.status, body)
+                    if response.status == 429:
+                        # the limiter pauses every caller, no extra backoff needed
+                        self.rate_limiter.on_throttled(parse_retry_after(response.headers.get('Retry-After')))
+                        continue
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.metrics.record_request(endpoint, type(e).__name__, time.perf_counter() - start)
+                if attempt == self.retries:
+                    raise ValueError(f"Request to {url} failed after {attempt + 1} attempts: {e!r}")
+            await asyncio.sleep(self.backoff * 2 ** attempt)
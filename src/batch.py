@@ -0,0 +1,154 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, Dict, List, Tuple, Union
+
+
+class FetchResult(object):
+    """
+    Outcome of one (ticker, task) of a batch.
+    """
+    __slots__ = ('ticker', 'task', 'value', 'error', 'cancelled')
+
+    def __init__(self, ticker: str, task: str, value=None, error: BaseException = None, cancelled: bool = False):
+        self.ticker = ticker
+        self.task = task
+        self.value = value
+        self.error = error
+        self.cancelled = cancelled
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and not self.cancelled
+
+    def __repr__(self):
+        status = 'ok' if self.ok else 'cancelled' if self.cancelled else f"error={self.error!r}"
+        return f"FetchResult({self.ticker!r}, {self.task!r}, {status})"
+
+
+class Batch(object):
+    """
+    Handle of a submitted batch: one future per (ticker, task). Independent of any other batch running
+    on the same executor.
+    """
+
+    def __init__(self, futures: Dict[Tuple[str, str], Future]):
+        self.futures = futures
+        self._lock = threading.Lock()
+        self._pending = len(futures)
+        self._callbacks = [] if futures else None
+        # set once every future is done and the done callbacks have run
+        self._finished = threading.Event()
+        if not futures:
+            self._finished.set()
+        for future in futures.values():
+            future.add_done_callback(self._on_future_done)
+
+    def add_done_callback(self, fn: Callable[['Batch'], None]):
+        """
+        Call `fn(batch)` once every future has finished or been cancelled, immediately if already done.
+        """
+        with self._lock:
+            if self._callbacks is not None:
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def cancel(self) -> int:
+        """
+        Cancel every task that has not started yet, running tasks are left to finish.
+        :return: number of cancelled tasks
+        """
+        return sum(future.cancel() for future in self.futures.values())
+
+    def done(self) -> bool:
+        return self._finished.is_set()
+
+    def wait(self, timeout: float = None) -> Dict[Tuple[str, str], FetchResult]:
+        """
+        Block until every task has finished and the done callbacks have run.
+        :param timeout: seconds to wait at most, unfinished tasks are then reported as cancelled
+        :return: dict of (ticker, task) -> FetchResult
+        """
+        self._finished.wait(timeout)
+        return self.results()
+
+    def results(self) -> Dict[Tuple[str, str], FetchResult]:
+        """
+        Results of the tasks so far, unfinished tasks are reported as cancelled.
+        """
+        res = {}
+        for (ticker, task), future in self.futures.items():
+            if not future.done() or future.cancelled():
+                res[(ticker, task)] = FetchResult(ticker, task, cancelled=True)
+            elif future.exception() is not None:
+                res[(ticker, task)] = FetchResult(ticker, task, error=future.exception())
+            else:
+                res[(ticker, task)] = FetchResult(ticker, task, value=future.result())
+        return res
+
+    def _on_future_done(self, _future: Future):
+        with self._lock:
+            self._pending -= 1
+            if self._pending > 0:
+                return
+            callbacks, self._callbacks = self._callbacks, None
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception as e:
+                logging.error(f"Error in batch done callback {e!r}")
+        self._finished.set()
+
+
+class BatchExecutor(object):
+    """
+    Bounded thread pool running per-ticker fetch tasks. Any number of batches can be in flight at once,
+    each tracks its own futures.
+    """
+
+    def __init__(self, max_workers: int = None):
+        """
+        :param max_workers: max number of tasks running at once, defaults to twice the cpu count
+        """
+        self.max_workers = max_workers or (os.cpu_count() or 1) * 2
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='batch-fetch')
+
+    def submit(self,
+               tasks: Union[Callable, List[Callable], Dict[str, Callable]],
+               tickers: List[str],
+               **kwargs) -> Batch:
+        """
+        Submit every task for every ticker, tasks are called as `task(ticker=ticker, **kwargs)`.
+        :param tasks: a callable, a list of callables keyed by their __name__, or a dict of name -> callable
+        :param tickers: List of tickers, duplicates are fetched once
+        :return: the batch handle
+        """
+        if callable(tasks):
+            tasks = [tasks]
+        if not isinstance(tasks, dict):
+            tasks = {getattr(task, '__name__', repr(task)): task for task in tasks}
+        futures = {}
+        for ticker in dict.fromkeys(tickers):
+            for name, task in tasks.items():
+                futures[(ticker, name)] = self._pool.submit(task, ticker=ticker, **kwargs)
+        return Batch(futures)
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False):
+        self._pool.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+
+def log_failures(results: Dict[Tuple[str, str], FetchResult]) -> List[FetchResult]:
+    """
+    Log a summary of the failed and cancelled tasks of a batch.
+    :return: the failed and cancelled results
+    """
+    failed = [r for r in results.values() if not r.ok]
+    for r in failed:
+        if r.error is not None:
+            logging.error(f"Error downloading {r.task} for {r.ticker} {r.error!r}")
+    if failed:
+        cancelled = sum(r.cancelled for r in failed)
+        logging.warning(f"{len(failed)}/{len(results)} tasks did not succeed ({cancelled} cancelled)")
+    return failed
@@ -0,0 +1,309 @@
+"""
+Command line entry point of the download jobs, e.g.
+
+    python -m src fetch --endpoints key-metrics,ratios --period quarter --tickers sp500 --workers 8
+    python -m src fetch --endpoints all --async --workers 32 --dry-run
+    python -m src ohlc --period max --chunk-size 50 --save-file sp500_ohlc.csv --panel
+    python -m src tickers --since 2000-01-01
+    python -m src fetch --endpoints all --resume  # only what the job ledger does not record as done
+    python -m src fetch --endpoints all --incremental  # only the periods newer than the stored data
+    python -m src jobs --failed
+
+Only the standard library is imported up front, pandas, requests and yfinance are imported by the
+subcommand that needs them, so `--help`, `--dry-run` plans and small utility calls start quickly.
+"""
+import argparse
+import csv
+import logging
+import os
+import sys
+import time
+from typing import List
+from src import shared
+
+_DEFAULT_LIMIT = 1000
+
+
+def main(argv: List[str] = None) -> int:
+    args = _parse_args(argv)
+    level = logging.WARNING if args.quiet else logging.DEBUG if args.verbose else logging.INFO
+    logging.basicConfig(level=level, format='%(asctime)s %(levelname)s %(message)s')
+    try:
+        return args.func(args) or 0
+    except KeyboardInterrupt:
+        print("Interrupted", file=sys.stderr)
+        return 130
+    except ValueError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+
+
+def _fetch(args: argparse.Namespace) -> int:
+    endpoints = _parse_endpoints(args.endpoints)
+    tickers = _resolve_tickers(args.tickers, args.since)
+    if args.use_async and args.resume:
+        raise ValueError("--resume is not supported with --async")
+    n_requests = len(tickers) * len(endpoints)
+    if args.dry_run:
+        if args.resume:
+            from src.jobs import Job, JobLedger, default_ledger_path
+
+            if os.path.exists(args.ledger or default_ledger_path()):
+                ledger = JobLedger(args.ledger)
+                n_requests = len(ledger.not_done(Job(t, e, args.period) for e in endpoints for t in tickers))
+        _print_plan(f"{args.period} {', '.join(endpoints)}", tickers, n_requests, args.rpm)
+        return 0
+
+    from src import general
+    from src.jobs import JobLedger
+
+    _configure_downloader(args)
+    start = time.perf_counter()
+    failed = []
+    if args.use_async:
+        general.download_sp500_statements(period=args.period, limit=args.limit, endpoints=endpoints,
+                                          concurrency=args.workers or 16, tickers=tickers,
+                                          incremental=args.incremental)
+    else:
+        downloader = general.get_downloader()
+        ledger = JobLedger(args.ledger)
+        for api_path in endpoints:
+            print(f"Fetching {api_path} {args.period}")
+            func = getattr(downloader, shared.FETCH_METHODS[api_path])
+            failed += general.download_sp500_metrics(func, period=args.period, limit=args.limit,
+                                                     batch_size=args.batch_size or args.workers or 10,
+                                                     tickers=tickers,
+                                                     resume=args.resume, retries=args.retries,
+                                                     ledger=ledger, incremental=args.incremental)
+    _print_throughput(n_requests, 'ticker endpoints', time.perf_counter() - start)
+    return 1 if failed else 0
+
+
+def _ohlc(args: argparse.Namespace) -> int:
+    if args.period is None and args.start is None:
+        args.period = 'max'
+    tickers = _resolve_tickers(args.tickers, args.since, args.end)
+    if args.dry_run:
+        window = f"period {args.period}" if args.period else f"{args.start} to {args.end or 'today'}"
+        chunks = f", {-(-len(tickers) // args.chunk_size)} chunks" if args.chunk_size else ''
+        print(f"Would download OHLC of {len(tickers)} tickers, {window}{chunks}")
+        _print_tickers_head(tickers)
+        return 0
+
+    from src import general
+
+    start = time.perf_counter()
+    df = general.download_sp500_ohlc(period=args.period, start_date=args.start, end_date=args.end,
+                                     save_file=args.save_file, save_panel=args.panel, chunk_size=args.chunk_size,
+                                     workers=args.workers, tickers=tickers)
+    print(f"{len(df)} rows")
+    _print_throughput(len(tickers), 'tickers', time.perf_counter() - start)
+    return 0
+
+
+def _profiles(args: argparse.Namespace) -> int:
+    tickers = _resolve_tickers(args.tickers, args.since)
+    if args.dry_run:
+        _print_plan('company profiles', tickers, len(tickers), args.rpm)
+        return 0
+
+    from src import general
+
+    _configure_downloader(args)
+    start = time.perf_counter()
+    general.download_sp500_company_profiles(tickers=tickers)
+    _print_throughput(len(tickers), 'profiles', time.perf_counter() - start)
+    return 0
+
+
+def _tickers(args: argparse.Namespace) -> int:
+    if args.refresh:
+        from src.fetch_data import fetch_sp500_tickers, fetch_sp500_ticker_change_history
+
+        fetch_sp500_tickers(refresh=True)
+        fetch_sp500_ticker_change_history(refresh=True)
+    tickers = _resolve_tickers(args.tickers, args.since, args.until)
+    print('\n'.join(tickers))
+    print(f"{len(tickers)} tickers", file=sys.stderr)
+    return 0
+
+
+def _jobs(args: argparse.Namespace) -> int:
+    from src.jobs import JobLedger, default_ledger_path
+
+    _path = args.ledger or default_ledger_path()
+    if not os.path.exists(_path):
+        raise ValueError(f"{_path} not found, no download has been recorded yet")
+    ledger = JobLedger(_path)
+    endpoint = _parse_endpoints(args.endpoint)[0] if args.endpoint else None
+    if args.failed:
+        rows = ledger.failed(endpoint, args.period)
+        for row in rows:
+            print(f"{row['endpoint']:<32} {row['period']:<8} {row['ticker']:<8} attempts={row['attempts']} "
+                  f"{row['error']}")
+        print(f"{len(rows)} failed jobs", file=sys.stderr)
+        return 1 if rows else 0
+    print(f"{'endpoint':<32} {'period':<8} {'status':<8} {'jobs':>6} {'rows':>10}  last finished")
+    for row in ledger.summary(endpoint, args.period):
+        last = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(row['last_finished'])) if row['last_finished'] else ''
+        print(f"{row['endpoint']:<32} {row['period']:<8} {row['status']:<8} {row['jobs']:>6} "
+              f"{row['rows'] or 0:>10}  {last}")
+    return 0
+
+
+def _parse_endpoints(value: str) -> List[str]:
+    """
+    Comma separated FMP api paths or artifact file names, e.g. `key-metrics,ratios` or `key_metrics`; `all`
+    selects every statement endpoint.
+    """
+    statement_endpoints = shared.STATEMENT_ENDPOINTS
+    if value == 'all':
+        return list(statement_endpoints)
+    by_file_name = {file_name: api_path for api_path, file_name in statement_endpoints.items()}
+    endpoints = []
+    for name in filter(None, (v.strip() for v in value.split(','))):
+        api_path = name if name in statement_endpoints else by_file_name.get(name, name.replace('_', '-'))
+        if api_path not in statement_endpoints:
+            raise ValueError(f"Unknown endpoint {name}, expected some of {list(statement_endpoints)}")
+        if api_path not in endpoints:
+            endpoints.append(api_path)
+    if not endpoints:
+        raise ValueError("No endpoints given")
+    return endpoints
+
+
+def _resolve_tickers(value: str, since: str = None, until: str = None) -> List[str]:
+    """
+    `sp500` for today's constituents plus SPY, or every ticker in the index between `since` and `until`
+    if `since` is given; `@path` for a file with one ticker per line; otherwise a comma separated list.
+    """
+    if value == 'sp500' and since is not None:
+        from src.general import _load_sp500_tickers
+        from src.membership import MembershipIndex
+
+        return _load_sp500_tickers(MembershipIndex.from_artifacts(), since, until)
+    if value == 'sp500':
+        # same list as `general._load_sp500_tickers` without importing pandas
+        _path = os.path.join(shared.PROJECT_DIR, 'artifacts', 'sp500_stocks.csv')
+        if not os.path.exists(_path):
+            raise ValueError(f"{_path} not found, run `python -m src tickers --refresh` first")
+        with open(_path, newline='') as f:
+            return [row['Symbol'] for row in csv.DictReader(f)] + ['SPY']
+    if value.startswith('@'):
+        with open(value[1:]) as f:
+            tickers = [line.strip() for line in f]
+    else:
+        tickers = value.split(',')
+    tickers = list(dict.fromkeys(t.strip().upper() for t in tickers if t.strip() and not t.startswith('#')))
+    if not tickers:
+        raise ValueError(f"No tickers in {value}")
+    return tickers
+
+
+def _configure_downloader(args: argparse.Namespace):
+    from src import general
+    from src.fetch_data import DataDownloader
+    from src.http_cache import ResponseCache
+    from src.rate_limit import RateLimiter
+
+    general._downloader = DataDownloader(
+        rate_limiter=RateLimiter(args.rpm) if args.rpm else None,
+        workers=args.workers,
+        cache=None if args.no_cache else ResponseCache())
+
+
+def _print_plan(what: str, tickers: List[str], n_requests: int, rpm: int = None):
+    rpm = rpm or int(os.getenv('FMP_REQUESTS_PER_MINUTE', 300))
+    print(f"Would fetch {what} for {len(tickers)} tickers: {n_requests} requests, "
+          f"at least {_duration(n_requests / rpm * 60)} at {rpm} requests per minute")
+    _print_tickers_head(tickers)
+
+
+def _print_tickers_head(tickers: List[str], n: int = 10):
+    more = f" ... (+{len(tickers) - n})" if len(tickers) > n else ''
+    print(f"Tickers: {' '.join(tickers[:n])}{more}")
+
+
+def _print_throughput(n: int, unit: str, seconds: float):
+    rate = n / seconds if seconds > 0 else float('inf')
+    print(f"{n} {unit} in {_duration(seconds)} ({rate:.1f}/s)")
+
+
+def _duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+
+def _parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='python -m src', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    # logging flags are accepted after every subcommand, e.g. `fetch ... -q`
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('-v', '--verbose', action='store_true', help="debug logging")
+    common.add_argument('-q', '--quiet', action='store_true', help="warnings only")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    def _add_tickers(p: argparse.ArgumentParser):
+        p.add_argument('--tickers', default='sp500',
+                       help="sp500 (default), a comma separated list, or @file with one ticker per line")
+        p.add_argument('--since', help="with --tickers sp500, every ticker in the index since this date "
+                                       "instead of today's constituents")
+        p.add_argument('--dry-run', action='store_true', help="print what would be downloaded and exit")
+
+    def _add_client(p: argparse.ArgumentParser):
+        p.add_argument('--rpm', type=int, help="FMP requests per minute, defaults to env FMP_REQUESTS_PER_MINUTE")
+        p.add_argument('--no-cache', action='store_true', help="bypass the response cache")
+
+    p = sub.add_parser('fetch', parents=[common],
+                       help="download FMP statement endpoints to artifacts/{ticker}/{period}/")
+    p.add_argument('--endpoints', default='key-metrics',
+                   help="comma separated api paths or file names, e.g. key-metrics,ratios, or all")
+    p.add_argument('--period', choices=['quarter', 'annual'], default='quarter')
+    p.add_argument('--limit', type=int, default=_DEFAULT_LIMIT, help="entries per ticker and endpoint")
+    p.add_argument('--workers', type=int, help="tickers fetched at once, requests in flight with --async")
+    p.add_argument('--batch-size', type=int,
+                   help="tickers in flight at once without --async, defaults to --workers or 10")
+    p.add_argument('--async', dest='use_async', action='store_true',
+                   help="fetch every endpoint in one asyncio pipeline")
+    p.add_argument('--resume', action='store_true',
+                   help="skip the ticker endpoints the job ledger records as done, e.g. after a crash")
+    p.add_argument('--incremental', action='store_true',
+                   help="only fetch the periods newer than the stored data and merge them in")
+    p.add_argument('--retries', type=int, default=2, help="retries of a failed ticker endpoint, with backoff")
+    p.add_argument('--ledger', help="job ledger file, defaults to artifacts/jobs.sqlite")
+    _add_tickers(p)
+    _add_client(p)
+    p.set_defaults(func=_fetch)
+
+    p = sub.add_parser('ohlc', parents=[common], help="download OHLC prices with yfinance")
+    p.add_argument('--period', help="1d,5d,1mo,3mo,6mo,1y,2y,5y,10y,ytd or max (default) unless --start is given")
+    p.add_argument('--start', help="first date, YYYY-MM-DD")
+    p.add_argument('--end', help="last date, YYYY-MM-DD")
+    p.add_argument('--chunk-size', type=int, help="checkpointed chunks of this many tickers, resumable")
+    p.add_argument('--workers', type=int, default=2, help="chunks downloaded in parallel")
+    p.add_argument('--save-file', help="csv file name under artifacts")
+    p.add_argument('--panel', action='store_true', help="save the memory-mapped price panel")
+    _add_tickers(p)
+    p.set_defaults(func=_ohlc)
+
+    p = sub.add_parser('profiles', parents=[common],
+                       help="download company profiles to artifacts/sp500_company_profiles.csv")
+    _add_tickers(p)
+    _add_client(p)
+    p.set_defaults(func=_profiles, workers=None)
+
+    p = sub.add_parser('tickers', parents=[common], help="print tickers one per line")
+    p.add_argument('--tickers', default='sp500', help="sp500 (default), a comma separated list or @file")
+    p.add_argument('--since', help="every ticker in the index since this date")
+    p.add_argument('--until', help="with --since, end of the membership window")
+    p.add_argument('--refresh', action='store_true', help="scrape the constituents and change history first")
+    p.set_defaults(func=_tickers)
+
+    p = sub.add_parser('jobs', parents=[common], help="status of the recorded fetch jobs")
+    p.add_argument('--endpoint', help="only this endpoint, api path or file name")
+    p.add_argument('--period', choices=['quarter', 'annual'])
+    p.add_argument('--failed', action='store_true', help="list the failed jobs with their last error")
+    p.add_argument('--ledger', help="job ledger file, defaults to artifacts/jobs.sqlite")
+    p.set_defaults(func=_jobs)
+    return parser.parse_args(argv)
@@ -0,0 +1,143 @@
+from typing import Iterator, List, Tuple
+import numpy as np
+import pandas as pd
+
+
+class RollingCovariance(object):
+    """
+    Covariance over a sliding window kept as sufficient statistics, so moving the window costs
+    O(days added or removed x n_assets^2) instead of recomputing over the whole window.
+    Missing values (e.g. tickers before their listing date) are handled pairwise, like DataFrame.cov.
+    """
+
+    def __init__(self, n_assets: int):
+        self.n_assets = n_assets
+        self._count = np.zeros((n_assets, n_assets))  # rows where both assets are present
+        self._sum = np.zeros((n_assets, n_assets))  # [i, j]: sum of asset i over rows where j is present
+        self._cross = np.zeros((n_assets, n_assets))
+        self._sq_norms = 0.0  # sum over rows of |x|^4, for Ledoit-Wolf shrinkage
+        self._rows = 0
+        self._shift = None
+
+    def add(self, rows: np.ndarray):
+        self._update(rows, 1.0)
+
+    def remove(self, rows: np.ndarray):
+        self._update(rows, -1.0)
+
+    @property
+    def count(self) -> int:
+        return self._rows
+
+    def mean(self) -> np.ndarray:
+        n = np.diag(self._count)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.diag(self._sum) / n + self._shift
+
+    def cov(self, ddof: int = 1) -> np.ndarray:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            res = (self._cross - self._sum * self._sum.T / self._count) / (self._count - ddof)
+        res[self._count <= ddof] = np.nan
+        return res
+
+    def ledoit_wolf(self) -> Tuple[np.ndarray, float]:
+        """
+        Ledoit-Wolf shrinkage of the window covariance towards a scaled identity.
+        The shrinkage intensity uses raw rather than demeaned fourth moments, which is accurate when
+        mean daily returns are small next to their volatility.
+        :return: shrunk covariance and the shrinkage intensity
+        """
+        t = self._rows
+        sample = self.cov(ddof=0)
+        return _shrink_to_identity(sample, self._sq_norms / t ** 2 - np.sum(sample ** 2) / t)
+
+    def _update(self, rows: np.ndarray, sign: float):
+        rows = np.atleast_2d(np.asarray(rows, dtype='float64'))
+        if rows.size == 0:
+            return
+        if self._shift is None:
+            # moments are accumulated around a fixed shift to limit cancellation in cross - sum * sum / count
+            self._shift = np.nan_to_num(np.nanmean(rows, axis=0))
+        present = ~np.isnan(rows)
+        x = np.where(present, rows - self._shift, 0.0)
+        if present.all():
+            # dense rows, pairwise counts and sums collapse to per-asset ones
+            self._count += sign * len(rows)
+            self._sum += sign * x.sum(axis=0)[:, None]
+        else:
+            m = present.astype('float64')
+            self._count += sign * (m.T @ m)
+            self._sum += sign * (x.T @ m)
+        self._cross += sign * (x.T @ x)
+        self._sq_norms += sign * np.sum(np.sum(x ** 2, axis=1) ** 2)
+        self._rows += int(sign) * len(rows)
+
+
+def rolling_window_moments(returns: pd.DataFrame,
+                           windows: List[Tuple[str, str]]) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Mean and covariance of `returns` over each (start, end) date window, both inclusive, updating the
+    statistics incrementally between consecutive windows. Windows must move forward in time.
+    :param returns: daily returns indexed by date, one column per asset
+    :param windows: e.g. [("2000-01-01", "2009-12-31"), ("2001-01-01", "2010-12-31")]
+    :return: iterator of (mean, covariance)
+    """
+    values = returns.to_numpy(dtype='float64')
+    index = returns.index
+    stats = RollingCovariance(values.shape[1])
+    lo = hi = 0
+    for start, end in windows:
+        new_lo = int(index.searchsorted(pd.Timestamp(start), side='left'))
+        new_hi = int(index.searchsorted(pd.Timestamp(end), side='right'))
+        if new_lo < lo or new_hi < hi:
+            raise ValueError(f"Windows must move forward, got ({start}, {end}) after row {lo}-{hi}")
+        if new_lo >= hi:
+            # no overlap with the previous window, start over
+            stats = RollingCovariance(values.shape[1])
+            stats.add(values[new_lo:new_hi])
+        else:
+            stats.add(values[hi:new_hi])
+            stats.remove(values[lo:new_lo])
+        lo, hi = new_lo, new_hi
+        yield stats.mean(), stats.cov()
+
+
+def ewm_covariance(returns, halflife: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Exponentially weighted mean and covariance, the latest day weighted most.
+    :param returns: daily returns without missing values, one column per asset
+    :param halflife: days for a weight to halve
+    :return: mean and covariance (with the unbiased weights correction)
+    """
+    x = np.asarray(returns, dtype='float64')
+    decay = 0.5 ** (1 / halflife)
+    w = decay ** np.arange(len(x) - 1, -1, -1)
+    w /= w.sum()
+    mean = w @ x
+    centered = x - mean
+    cov = (centered * w[:, None]).T @ centered / (1 - np.sum(w ** 2))
+    return mean, cov
+
+
+def ledoit_wolf(returns) -> Tuple[np.ndarray, float]:
+    """
+    Ledoit-Wolf (2004) shrinkage of the sample covariance towards a scaled identity.
+    :param returns: daily returns without missing values, one column per asset
+    :return: shrunk covariance and the shrinkage intensity
+    """
+    x = np.asarray(returns, dtype='float64')
+    t = len(x)
+    x = x - x.mean(axis=0)
+    sample = x.T @ x / t
+    return _shrink_to_identity(sample, np.sum(np.sum(x ** 2, axis=1) ** 2) / t ** 2 - np.sum(sample ** 2) / t)
+
+
+def _shrink_to_identity(sample: np.ndarray, b_bar2: float) -> Tuple[np.ndarray, float]:
+    n = len(sample)
+    mu = np.trace(sample) / n
+    target = mu * np.eye(n)
+    d2 = np.sum((sample - target) ** 2)
+    if d2 == 0:
+        return sample, 0.0
+    shrinkage = float(np.clip(b_bar2 / d2, 0.0, 1.0))
+    return shrinkage * target + (1 - shrinkage) * sample, shrinkage
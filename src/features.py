@@ -0,0 +1,202 @@
+import logging
+import os
+from typing import List
+import numpy as np
+import pandas as pd
+from src import shared
+from src.shared import PERIOD_MONTHS_AND_LAG
+from src.loader import load_statements, statement_paths, cache_key, write_cache
+from src.price_panel import PricePanel
+
+# bump whenever the feature definitions below change, older caches are then ignored
+FEATURES_VERSION = 1
+
+# column prefix per statement file, key metrics keep their names so models written against make_data still work
+FEATURE_PREFIXES = {
+    'key_metrics': '',
+    'income_statement': 'is_',
+    'balance_sheet_statement': 'bs_',
+    'cash_flow_statement': 'cf_',
+    'ratios': 'ratio_',
+    'income_growth': 'isg_',
+    'balance_sheet_growth': 'bsg_',
+    'cashflow_growth': 'cfg_',
+    'financial_growth': 'fg_',
+}
+# flow items summed over the last four quarters
+TTM_COLUMNS = ['is_revenue', 'is_grossProfit', 'is_operatingIncome', 'is_netIncome', 'is_ebitda', 'is_eps',
+               'cf_operatingCashFlow', 'cf_capitalExpenditure', 'cf_freeCashFlow', 'cf_dividendsPaid']
+# change against the same fiscal period a year earlier
+YOY_COLUMNS = ['is_revenue', 'is_grossProfit', 'is_operatingIncome', 'is_netIncome', 'is_eps',
+               'cf_operatingCashFlow', 'cf_freeCashFlow', 'bs_totalAssets', 'bs_totalStockholdersEquity',
+               'bs_totalDebt', 'bookValuePerShare']
+
+_KEYS = ['symbol', 'calendarYear', 'period']
+# per fiscal period attributes reported by every endpoint, the first non null one is kept
+_SHARED_COLUMNS = ['date', 'fillingDate', 'reportedCurrency']
+_DROP_COLUMNS = ['cik', 'link', 'finalLink', 'acceptedDate']
+# max days between the first and last of four consecutive quarters
+_TTM_MAX_SPAN_DAYS = 300
+
+
+def build_feature_panel(period: str = 'quarter',
+                        file_names: List[str] = None,
+                        artifacts_dir: str = None,
+                        prices: PricePanel = None,
+                        cache: bool = True) -> pd.DataFrame:
+    """
+    Align every statement endpoint on (symbol, calendarYear, period) in one wide frame and add derived features:
+    `ttm_*` trailing twelve month sums, `yoy_*` year over year changes, `available_date` (filing date, or the
+    period end plus the typical filing lag) and, if `prices` is given, `px_*` price ratios as of `available_date`.
+    The aligned frame is cached under artifacts/cache keyed on FEATURES_VERSION and the source files' mtimes,
+    replacing the cache of older versions.
+    :param period: annual or quarter
+    :param file_names: statement files to join, defaults to all of FEATURE_PREFIXES
+    :param artifacts_dir: defaults to the project artifacts folder
+    :param prices: price panel for the `px_*` features
+    :param cache: read and write the cache
+    :return: one row per (symbol, fiscal period)
+    """
+    artifacts_dir = artifacts_dir or os.path.join(shared.PROJECT_DIR, 'artifacts')
+    file_names = file_names or list(FEATURE_PREFIXES)
+    unknown = set(file_names) - set(FEATURE_PREFIXES)
+    if unknown:
+        raise ValueError(f"Unknown statement files {sorted(unknown)}, expected some of {list(FEATURE_PREFIXES)}")
+
+    cache_path = None
+    if cache:
+        paths = [p for f in file_names for p in statement_paths(artifacts_dir, f, period)]
+        prefix = f"features-{period}-{cache_key([], file_names)}"
+        cache_path = os.path.join(artifacts_dir, 'cache', f"{prefix}-v{FEATURES_VERSION}-{cache_key(paths)}.pkl")
+
+    if cache_path is not None and os.path.exists(cache_path):
+        logging.info(f"Loading {period} feature panel from cache {cache_path}")
+        df = pd.read_pickle(cache_path)
+    else:
+        df = _align(file_names, period, artifacts_dir)
+        df = _add_ttm(df, period)
+        df = _add_yoy(df)
+        df = _add_available_date(df, period)
+        if cache_path is not None:
+            write_cache(df, cache_path, f"{prefix}-*.pkl")
+    if prices is not None:
+        df = add_price_features(df, prices)
+    return df
+
+
+def add_price_features(df: pd.DataFrame, prices: PricePanel, dates=None) -> pd.DataFrame:
+    """
+    Price based ratios of a feature panel: `px_close`, `px_market_cap`, `px_pe_ttm`, `px_ps_ttm`, `px_pb` and
+    `px_fcf_yield`. Ratios with a non positive earnings, sales or book value denominator are NaN.
+    :param df: output of `build_feature_panel`
+    :param prices: price panel, closed days resolve to the next trading day
+    :param dates: price date per row or a single date for every row, defaults to `available_date`
+    :return: a new data frame
+    """
+    df = df.copy()
+    if dates is None:
+        dates = df['available_date']
+    elif np.ndim(dates) == 0:
+        dates = np.repeat(np.datetime64(pd.Timestamp(dates), 'ns'), len(df))
+    close = prices.lookup('Close', df['symbol'].astype(str).to_numpy(), dates)
+    shares = _col(df, 'is_weightedAverageShsOut')
+    market_cap = close * shares
+    df['px_close'] = close
+    df['px_market_cap'] = market_cap
+    df['px_pe_ttm'] = close / _positive(_col(df, 'ttm_is_eps'))
+    df['px_ps_ttm'] = market_cap / _positive(_col(df, 'ttm_is_revenue'))
+    df['px_pb'] = close / _positive(_col(df, 'bookValuePerShare'))
+    df['px_fcf_yield'] = _col(df, 'ttm_cf_freeCashFlow') / _positive(market_cap)
+    return df
+
+
+def as_of(df: pd.DataFrame, date, prices: PricePanel = None) -> pd.DataFrame:
+    """
+    Point in time snapshot: the latest fiscal period of every symbol published by `date`,
+    with the price features recomputed at `date` if `prices` is given.
+    :param df: output of `build_feature_panel`
+    :param date: snapshot date
+    :return: one row per symbol
+    """
+    date = pd.Timestamp(date)
+    snap = df[df['available_date'] <= date].sort_values(['symbol', 'available_date', 'date'], kind='stable')
+    snap = snap.drop_duplicates('symbol', keep='last').reset_index(drop=True)
+    if prices is not None:
+        snap = add_price_features(snap, prices, date)
+    return snap
+
+
+def _align(file_names: List[str], period: str, artifacts_dir: str) -> pd.DataFrame:
+    frames = []
+    for i, file_name in enumerate(file_names):
+        df = load_statements(file_name, period, artifacts_dir=artifacts_dir, cache=False)
+        if df.empty:
+            logging.warning(f"No {file_name} {period} statements found under {artifacts_dir}")
+            continue
+        df = df[df['symbol'].notnull()]
+        df['calendarYear'] = pd.to_numeric(df['calendarYear'], errors='coerce')
+        df = df[df['calendarYear'].notnull()].astype({'calendarYear': 'int64', 'symbol': str, 'period': str})
+        # restated periods appear twice, keep the latest report
+        df = df.sort_values('date', ascending=False, kind='stable').drop_duplicates(_KEYS)
+        df = df.drop(columns=[c for c in _DROP_COLUMNS if c in df.columns]).set_index(_KEYS)
+        prefix = FEATURE_PREFIXES[file_name]
+        df.columns = [f"__{i}_{c}" if c in _SHARED_COLUMNS else f"{prefix}{c}" for c in df.columns]
+        frames.append(df)
+    if not frames:
+        raise ValueError(f"No {period} statements found under {artifacts_dir}")
+
+    df = pd.concat(frames, axis=1, join='outer')
+    for c in _SHARED_COLUMNS:
+        cols = [f"__{i}_{c}" for i in range(len(file_names)) if f"__{i}_{c}" in df.columns]
+        if cols:
+            df[c] = df[cols].bfill(axis=1).iloc[:, 0]
+            df = df.drop(columns=cols)
+    df = df.reset_index()
+    df['date'] = pd.to_datetime(df['date'])
+    if 'fillingDate' in df.columns:
+        df['fillingDate'] = pd.to_datetime(df['fillingDate'], errors='coerce')
+    front = _KEYS + [c for c in _SHARED_COLUMNS if c in df.columns]
+    df = df[front + [c for c in df.columns if c not in front]]
+    return df.sort_values(['symbol', 'date'], kind='stable').reset_index(drop=True)
+
+
+def _add_ttm(df: pd.DataFrame, period: str) -> pd.DataFrame:
+    cols = [c for c in TTM_COLUMNS if c in df.columns]
+    if period != 'quarter':
+        # an annual report already covers twelve months
+        return df.assign(**{f"ttm_{c}": df[c] for c in cols})
+    # rows are sorted by (symbol, date), four consecutive rows of one symbol spanning under a year form a TTM
+    symbols = df['symbol'].to_numpy()
+    dates = df['date'].to_numpy()
+    valid = np.zeros(len(df), dtype=bool)
+    valid[3:] = (symbols[3:] == symbols[:-3]) & (dates[3:] - dates[:-3] <= np.timedelta64(_TTM_MAX_SPAN_DAYS, 'D'))
+    values = df[cols].to_numpy(dtype='float64')
+    ttm = np.full_like(values, np.nan)
+    ttm[3:] = values[3:] + values[2:-1] + values[1:-2] + values[:-3]
+    ttm[~valid] = np.nan
+    return pd.concat([df, pd.DataFrame(ttm, columns=[f"ttm_{c}" for c in cols], index=df.index)], axis=1)
+
+
+def _add_yoy(df: pd.DataFrame) -> pd.DataFrame:
+    cols = [c for c in YOY_COLUMNS if c in df.columns]
+    prev_idx = pd.MultiIndex.from_arrays([df['symbol'], df['calendarYear'] - 1, df['period']])
+    prev = df.set_index(_KEYS)[cols].reindex(prev_idx).to_numpy(dtype='float64')
+    values = df[cols].to_numpy(dtype='float64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        yoy = np.where(prev != 0, (values - prev) / np.abs(prev), np.nan)
+    return pd.concat([df, pd.DataFrame(yoy, columns=[f"yoy_{c}" for c in cols], index=df.index)], axis=1)
+
+
+def _add_available_date(df: pd.DataFrame, period: str) -> pd.DataFrame:
+    _, lag_days = PERIOD_MONTHS_AND_LAG[period]
+    estimated = df['date'] + pd.Timedelta(days=lag_days)
+    df['available_date'] = df['fillingDate'].fillna(estimated) if 'fillingDate' in df.columns else estimated
+    return df
+
+
+def _col(df: pd.DataFrame, c: str) -> np.ndarray:
+    return df[c].to_numpy(dtype='float64') if c in df.columns else np.full(len(df), np.nan)
+
+
+def _positive(x: np.ndarray) -> np.ndarray:
+    return np.where(x > 0, x, np.nan)
@@ -1,19 +1,62 @@
+import json
 import logging
 import os.path
+import time
 from tqdm import tqdm
 import threading
-import yfinance as yf
 import requests
-from typing import List, Callable
+from contextlib import contextmanager
+from typing import List, Callable, Dict, Tuple, Union, TYPE_CHECKING
 import pandas as pd
-from threading import Lock, Event
-import multitasking
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from src import shared
+from src.shared import STATEMENT_ENDPOINTS, PERIOD_MONTHS_AND_LAG
+from src.rate_limit import RateLimiter, shared_rate_limiter, parse_retry_after
+from src.metrics import FetchMetrics
+from src.batch import BatchExecutor, Batch, FetchResult, log_failures
+from src.ingest import ingest_json
 
+if TYPE_CHECKING:
+    from src.store import FundamentalsStore
+    from src.http_cache import ResponseCache
 
 class DataDownloader(object):
-    def __init__(self):
+    def __init__(self,
+                 pool_size: int = 32,
+                 rate_limiter: RateLimiter = None,
+                 store: 'FundamentalsStore' = None,
+                 write_csv: bool = True,
+                 metrics: FetchMetrics = None,
+                 workers: int = None,
+                 cache: 'ResponseCache' = None):
+        """
+        :param pool_size: max number of pooled HTTP connections
+        :param rate_limiter: limiter every FMP request waits on, defaults to the process wide one
+        :param store: optional columnar store statements are written to and read from
+        :param write_csv: keep writing the per-ticker csv files under artifacts/{ticker}/{period}/
+        :param metrics: per endpoint latency, status, retry, rate limit wait and parse/write time recorder.
+            Defaults to an in-memory one, see `metrics.summary()`
+        :param workers: max number of tickers fetched at once by `batch_fetch`/`submit_batch`,
+            defaults to twice the cpu count
+        :param cache: optional response cache, fresh responses are served from it even when refresh=True
+            and stale ones are revalidated with ETag / If-Modified-Since
+        """
         self.API_KEY = os.getenv('API_KEY')
+        # every FMP request goes through this limiter, shared process wide by default
+        self.rate_limiter = rate_limiter or shared_rate_limiter()
+        self.store = store
+        self.cache = cache
+        self.write_csv = write_csv
+        self.metrics = metrics or FetchMetrics()
+        self._open_batches = 0
+        self._batch_lock = threading.Lock()
+        self._executor = BatchExecutor(max_workers=workers)
+        # keep connections alive across calls instead of a new TCP/TLS handshake per request
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
 
     def fetch_tickers_global(self, exchange_names: list, refresh=False):
         """
@@ -29,17 +72,17 @@ class DataDownloader(object):
         if refresh:
             if self.API_KEY is None:
                 raise ValueError("API KEY is not provided, `source .dev_env` before running")
-            url = self._add_api_key("https://financialmodelingprep.com/api/v3/stock/list?")
-            resp = requests.get(url)
-            resp_json = resp.json()
-            df = pd.DataFrame(resp_json)
+            url = self._add_api_key(f"{shared.FMP_BASE_URL}/stock/list?")
+            body = self._get_body(url, ('stock/list', None, None, None))
+            with self.metrics.timed('stock/list', 'parse'):
+                df = ingest_json(body, 'stock/list')
             df.to_csv(_path, index=False)
         else:
             df = pd.read_csv(_path)
         df = df[df['exchangeShortName'].isin(exchange_names)]
         return df
 
-    def fetch_key_metrics(self, ticker: str, period: str, limit: int, refresh=False):
+    def fetch_key_metrics(self, ticker: str, period: str, limit: int, refresh=False, incremental=False):
         """
         Fetch P/B, P/E, ROE and other key metrics of a given ticker. Result will be stored as
         a csv data frame under artifacts/{ticker}/key_metrics.csv
@@ -47,233 +90,216 @@ class DataDownloader(object):
         :param period: annual or quarter
         :param limit: number of entries to fetch
         :param refresh: refresh artifacts data
+        :param incremental: with refresh, only fetch the periods newer than the stored data and merge them in
         :return:
         """
-        _api_path = "key-metrics"
-        _path = os.path.join(shared.PROJECT_DIR, 'artifacts', ticker.lower(), period, 'key_metrics.csv')
-        _check_or_create_directory(_path)
-        if refresh:
-            df = self._fetch_data_from_api(_api_path, ticker, period, limit)
-            df.to_csv(_path, index=False)
-            logging.info(f"Successfully fetched key metrics for {ticker}")
-        else:
-            df = pd.read_csv(_path)
-        return df
+        return self._fetch_statement("key-metrics", ticker, period, limit, refresh, incremental)
 
-    def fetch_income_statement(self, ticker: str, period: str, limit: int, refresh=False):
+    def fetch_income_statement(self, ticker: str, period: str, limit: int, refresh=False, incremental=False):
         """
         Reference to: https://site.financialmodelingprep.com/developer/docs#income-statements-financial-statements
         :param ticker: e.g. AAPL
         :param period: annual or quarter
         :param limit: number of entries to fetch
         :param refresh: refresh artifacts data
+        :param incremental: with refresh, only fetch the periods newer than the stored data and merge them in
         :return:
         """
-        _api_path = "income-statement"
-        _path = os.path.join(shared.PROJECT_DIR, 'artifacts', ticker.lower(), period, 'income_statement.csv')
-        _check_or_create_directory(_path)
-        if refresh:
-            df = self._fetch_data_from_api(_api_path, ticker, period, limit)
-            df.to_csv(_path, index=False)
-            logging.info(f"Successfully fetched income statement for {ticker}")
-        else:
-            df = pd.read_csv(_path)
-        return df
+        return self._fetch_statement("income-statement", ticker, period, limit, refresh, incremental)
 
-    def fetch_balance_sheet_statement(self, ticker: str, period: str, limit: int, refresh=False):
+    def fetch_balance_sheet_statement(self, ticker: str, period: str, limit: int, refresh=False, incremental=False):
         """
         Reference to: https://site.financialmodelingprep.com/developer/docs#balance-sheet-statements-financial-statements
         :param ticker: e.g. AAPL
         :param period: annual or quarter
         :param limit: number of entries to fetch
         :param refresh: refresh artifacts data
+        :param incremental: with refresh, only fetch the periods newer than the stored data and merge them in
         :return:
         """
-        _api_path = "balance-sheet-statement"
-        _path = os.path.join(shared.PROJECT_DIR, 'artifacts', ticker.lower(), period, 'balance_sheet_statement.csv')
-        _check_or_create_directory(_path)
-        if refresh:
-            df = self._fetch_data_from_api(_api_path, ticker, period, limit)
-            df.to_csv(_path, index=False)
-            logging.info(f"Successfully fetched balance sheet statement for {ticker}")
-        else:
-            df = pd.read_csv(_path)
-        return df
+        return self._fetch_statement("balance-sheet-statement", ticker, period, limit, refresh, incremental)
 
-    def fetch_cashflow_statement(self, ticker: str, period: str, limit: int, refresh=False):
+    def fetch_cashflow_statement(self, ticker: str, period: str, limit: int, refresh=False, incremental=False):
         """
         Reference to: https://site.financialmodelingprep.com/developer/docs#cashflow-statements-financial-statements
         :param ticker: e.g. AAPL
         :param period: annual or quarter
         :param limit: number of entries to fetch
         :param refresh: refresh artifacts data
+        :param incremental: with refresh, only fetch the periods newer than the stored data and merge them in
         :return:
         """
-        _api_path = "cash-flow-statement"
-        _path = os.path.join(shared.PROJECT_DIR, 'artifacts', ticker.lower(), period, 'cash_flow_statement.csv')
-        _check_or_create_directory(_path)
-        if refresh:
-            df = self._fetch_data_from_api(_api_path, ticker, period, limit)
-            df.to_csv(_path, index=False)
-            logging.info(f"Successfully fetched {_api_path} for {ticker}")
-        else:
-            df = pd.read_csv(_path)
-        return df
+        return self._fetch_statement("cash-flow-statement", ticker, period, limit, refresh, incremental)
 
-    def fetch_ratios(self, ticker: str, period: str, limit: int, refresh=False):
+    def fetch_ratios(self, ticker: str, period: str, limit: int, refresh=False, incremental=False):
         """
         Reference to: https://site.financialmodelingprep.com/developer/docs#ratios-statement-analysis
         :param ticker: e.g. AAPL
         :param period: annual or quarter
         :param limit: number of entries to fetch
         :param refresh: refresh artifacts data
+        :param incremental: with refresh, only fetch the periods newer than the stored data and merge them in
         :return:
         """
-        _api_path = "ratios"
-        _path = os.path.join(shared.PROJECT_DIR, 'artifacts', ticker.lower(), period, 'ratios.csv')
-        _check_or_create_directory(_path)
-        if refresh:
-            df = self._fetch_data_from_api(_api_path, ticker, period, limit)
-            df.to_csv(_path, index=False)
-            logging.info(f"Successfully fetched {_api_path} for {ticker}")
-        else:
-            df = pd.read_csv(_path)
-        return df
+        return self._fetch_statement("ratios", ticker, period, limit, refresh, incremental)
 
-    def fetch_cashflow_growth(self, ticker: str, period: str, limit: int, refresh=False):
+    def fetch_cashflow_growth(self, ticker: str, period: str, limit: int, refresh=False, incremental=False):
         """
         Reference to: https://site.financialmodelingprep.com/developer/docs#cashflow-growth-statement-analysis
         :param ticker: e.g. AAPL
         :param period: annual or quarter
         :param limit: number of entries to fetch
         :param refresh: refresh artifacts data
+        :param incremental: with refresh, only fetch the periods newer than the stored data and merge them in
         :return:
         """
-        _api_path = "cash-flow-statement-growth"
-        _path = os.path.join(shared.PROJECT_DIR, 'artifacts', ticker.lower(), period, 'cashflow_growth.csv')
-        _check_or_create_directory(_path)
-        if refresh:
-            df = self._fetch_data_from_api(_api_path, ticker, period, limit)
-            df.to_csv(_path, index=False)
-            logging.info(f"Successfully fetched {_api_path} for {ticker}")
-        else:
-            df = pd.read_csv(_path)
-        return df
+        return self._fetch_statement("cash-flow-statement-growth", ticker, period, limit, refresh, incremental)
 
-    def fetch_income_growth(self, ticker: str, period: str, limit: int, refresh=False):
+    def fetch_income_growth(self, ticker: str, period: str, limit: int, refresh=False, incremental=False):
         """
         Reference to: https://site.financialmodelingprep.com/developer/docs#income-growth-statement-analysis
         :param ticker: e.g. AAPL
         :param period: annual or quarter
         :param limit: number of entries to fetch
         :param refresh: refresh artifacts data
+        :param incremental: with refresh, only fetch the periods newer than the stored data and merge them in
         :return:
         """
-        _api_path = "income-statement-growth"
-        _path = os.path.join(shared.PROJECT_DIR, 'artifacts', ticker.lower(), period, 'income_growth.csv')
-        _check_or_create_directory(_path)
-        if refresh:
-            df = self._fetch_data_from_api(_api_path, ticker, period, limit)
-            df.to_csv(_path, index=False)
-            logging.info(f"Successfully fetched {_api_path} for {ticker}")
-        else:
-            df = pd.read_csv(_path)
-        return df
+        return self._fetch_statement("income-statement-growth", ticker, period, limit, refresh, incremental)
 
-    def fetch_balance_sheet_growth(self, ticker: str, period: str, limit: int, refresh=False):
+    def fetch_balance_sheet_growth(self, ticker: str, period: str, limit: int, refresh=False, incremental=False):
         """
         Reference to: https://site.financialmodelingprep.com/developer/docs#balance-sheet-growth-statement-analysis
         :param ticker: e.g. AAPL
         :param period: annual or quarter
         :param limit: number of entries to fetch
         :param refresh: refresh artifacts data
+        :param incremental: with refresh, only fetch the periods newer than the stored data and merge them in
         :return:
         """
-        _api_path = "balance-sheet-statement-growth"
-        _path = os.path.join(shared.PROJECT_DIR, 'artifacts', ticker.lower(), period, 'balance_sheet_growth.csv')
-        _check_or_create_directory(_path)
-        if refresh:
-            df = self._fetch_data_from_api(_api_path, ticker, period, limit)
-            df.to_csv(_path, index=False)
-            logging.info(f"Successfully fetched {_api_path} for {ticker}")
-        else:
-            df = pd.read_csv(_path)
-        return df
+        return self._fetch_statement("balance-sheet-statement-growth", ticker, period, limit, refresh, incremental)
 
-    def fetch_financial_growth(self, ticker: str, period: str, limit: int, refresh=False):
+    def fetch_financial_growth(self, ticker: str, period: str, limit: int, refresh=False, incremental=False):
         """
         Reference to: https://site.financialmodelingprep.com/developer/docs#financial-growth-statement-analysis
         :param ticker: e.g. AAPL
         :param period: annual or quarter
         :param limit: number of entries to fetch
         :param refresh: refresh artifacts data
+        :param incremental: with refresh, only fetch the periods newer than the stored data and merge them in
         :return:
         """
-        _api_path = "financial-growth"
-        _path = os.path.join(shared.PROJECT_DIR, 'artifacts', ticker.lower(), period, 'financial_growth.csv')
-        _check_or_create_directory(_path)
-        if refresh:
-            df = self._fetch_data_from_api(_api_path, ticker, period, limit)
-            df.to_csv(_path, index=False)
-            logging.info(f"Successfully fetched {_api_path} for {ticker}")
-        else:
-            df = pd.read_csv(_path)
-        return df
+        return self._fetch_statement("financial-growth", ticker, period, limit, refresh, incremental)
 
     def fetch_company_profile(self, ticker: str):
         ticker = self._standardize_ticker(ticker)
-        url = f"https://financialmodelingprep.com/api/v3/profile/{ticker}?"
+        url = f"{shared.FMP_BASE_URL}/profile/{ticker}?"
         url = self._add_api_key(url)
-        response = requests.get(url)
-        if response.status_code == 200:
-            return response.json()[0]
-        else:
-            raise ValueError(response.status_code, response.json())
+        return self._get_json(url, ('profile', ticker, None, None))[0]
 
     def batch_fetch(self,
                     func: Callable,
                     tickers: List[str],
                     period: str,
-                    limit: int):
+                    limit: int,
+                    incremental: bool = False) -> Dict[str, FetchResult]:
         """
-        Async fetch ticker key metrics
-        :param func: The functional API to call
+        Fetch one endpoint for many tickers on the downloader's thread pool and wait for all of them.
+        :param func: The functional API to call, e.g. `fetch_key_metrics`
         :param limit:
         :param period:
         :param tickers: List of tickers
+        :param incremental: only fetch periods newer than the stored data, see `fetch_key_metrics`
+        :return: dict of ticker -> FetchResult, failures are logged and reported there instead of raised
         """
-        lock = threading.Lock()
-        event = threading.Event()
-        done = []
+        kwargs = {'incremental': True} if incremental else {}
+        batch = self.submit_batch(func, tickers, period=period, limit=limit, refresh=True, **kwargs)
+        results = batch.wait()
+        log_failures(results)
+        return {ticker: r for (ticker, _), r in results.items()}
+
+    def submit_batch(self,
+                     tasks: Union[Callable, List[Callable], Dict[str, Callable]],
+                     tickers: List[str],
+                     **kwargs) -> Batch:
+        """
+        Submit tasks for many tickers without waiting, e.g. every statement endpoint of a ticker group in one
+        submission. Several batches may run at once, e.g. fundamentals and company profiles in parallel.
+        :param tasks: fetch method(s) called as `task(ticker=ticker, **kwargs)`, or a dict of name -> method
+        :param tickers: List of tickers
+        :return: Batch handle to wait on, cancel or collect the per (ticker, task) results from
+        """
+        self._begin_batch()
         try:
-            for i, ticker in enumerate(tickers):
-                self._async_fetch(func, ticker, period, limit, lock, event, len(tickers), done)
-            event.wait()
-        except Exception as e:
-            logging.error(f"Error fetching key metrics {e}\n Finished tickers are {done}")
-
-    @multitasking.task
-    def _async_fetch(self,
-                     func: Callable,
-                     ticker: str,
-                     period: str,
-                     limit: int,
-                     lock: Lock,
-                     event: Event,
-                     total: int,
-                     done: List):
-        multitasking.set_max_threads(multitasking.cpu_count() * 2)
+            batch = self._executor.submit(tasks, tickers, **kwargs)
+        except Exception:
+            self._end_batch()
+            raise
+        # the store is flushed once the last open batch finishes
+        batch.add_done_callback(lambda _: self._end_batch())
+        return batch
+
+    @contextmanager
+    def deferred_writes(self):
+        """
+        Defer store writes until the block exits, as if it were one batch, e.g. around many single fetch calls
+        made from a work queue.
+        """
+        self._begin_batch()
         try:
-            func(ticker=ticker, period=period, limit=limit, refresh=True)
-        except Exception as e:
-            raise ValueError(f"Error downloading {ticker} {e}")
+            yield self
         finally:
-            with lock:
-                shared.CNT += 1
-                done.append(ticker)
-                if shared.CNT >= total:
-                    event.set()
-                    shared.CNT = 0
+            self._end_batch()
+
+    def async_batch_fetch(self,
+                          tickers: List[str],
+                          period: str,
+                          limit: int,
+                          endpoints: List[str] = None,
+                          concurrency: int = 16,
+                          timeout: float = 30,
+                          retries: int = 3,
+                          incremental: bool = False) -> Dict[Tuple[str, str], pd.DataFrame]:
+        """
+        Fetch statement endpoints for many tickers in a single asyncio pipeline over a pooled HTTP session.
+        Results are saved to the same artifacts/{ticker}/{period}/*.csv files as the `fetch_*` methods.
+        :param tickers: List of tickers
+        :param period: annual or quarter
+        :param limit: number of entries to fetch
+        :param endpoints: FMP api paths to fetch, e.g. ['key-metrics', 'ratios']. Defaults to all statement endpoints
+        :param concurrency: max number of requests in flight
+        :param timeout: per request timeout in seconds
+        :param retries: number of retries on timeouts, connection errors and 5xx/429 responses
+        :param incremental: only fetch periods newer than the stored data, tickers already up to date are skipped
+        :return: dict of (api path, ticker) -> data frame for every successful request
+        """
+        from src.async_fetch import AsyncFetcher
+
+        if self.API_KEY is None:
+            raise ValueError("API KEY is not provided, `source .dev_env` before running")
+        endpoints = endpoints or list(STATEMENT_ENDPOINTS)
+        unknown = set(endpoints) - set(STATEMENT_ENDPOINTS)
+        if unknown:
+            raise ValueError(f"Unknown endpoints {sorted(unknown)}")
+
+        fetcher = AsyncFetcher(self.API_KEY, concurrency=concurrency, timeout=timeout, retries=retries,
+                               rate_limiter=self.rate_limiter, metrics=self.metrics, cache=self.cache)
+        jobs = []
+        for ticker in tickers:
+            for api_path in endpoints:
+                _limit = self._incremental_limit(api_path, ticker, period, limit) if incremental else limit
+                if _limit > 0:
+                    jobs.append((api_path, ticker, _limit))
+        logging.info(f"{len(jobs)} of {len(tickers) * len(endpoints)} ticker endpoints to fetch")
+
+        def _on_result(api_path, ticker, _period, df):
+            return self._save_statement(api_path, ticker, _period, df, merge=incremental)
+
+        self._begin_batch()
+        try:
+            return fetcher.run(jobs, period, on_result=_on_result)
+        finally:
+            self._end_batch()
 
     def batch_fetch_tickers_ohlc(self,
                                  tickers: List[str],
@@ -290,27 +316,215 @@ class DataDownloader(object):
         :param end_date: str in YYYY-DD-MM format
         :return: a data frame
         """
+        # imported on first use, yfinance alone takes a quarter of a second to import
+        import yfinance as yf
+
         tickers = [self._standardize_ticker(t) for t in tickers]
         df = yf.download(tickers=tickers, period=period, start=start_date, end=end_date, group_by='ticker')
 
         return df.stack(level=0).rename_axis(['Date', 'Ticker']).reset_index()
 
+    def chunked_fetch_tickers_ohlc(self,
+                                   tickers: List[str],
+                                   checkpoint_dir: str,
+                                   chunk_size: int = 50,
+                                   workers: int = 2,
+                                   period: str = None,
+                                   start_date: str = None,
+                                   end_date: str = None) -> List[str]:
+        """
+        Fetch OHLC in groups of tickers, writing each group's stacked Date, Ticker, OHLCV rows to its own parquet
+        file under `checkpoint_dir` as soon as it is downloaded. A manifest records finished chunks, so calling
+        this again with the same arguments only downloads the chunks that are missing.
+        :param tickers: List of tickers
+        :param checkpoint_dir: directory for the chunk files and manifest.json
+        :param chunk_size: tickers per yf.download call
+        :param workers: chunks downloaded in parallel
+        :param period: see `batch_fetch_tickers_ohlc`
+        :param start_date: see `batch_fetch_tickers_ohlc`
+        :param end_date: see `batch_fetch_tickers_ohlc`
+        :return: paths of the chunk files in ticker order
+        """
+        tickers = [self._standardize_ticker(t) for t in tickers]
+        params = {'period': period, 'start_date': start_date, 'end_date': end_date, 'chunk_size': chunk_size,
+                  'tickers': tickers}
+        manifest_path = os.path.join(checkpoint_dir, 'manifest.json')
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        manifest = {'params': params, 'chunks': {}}
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                saved = json.load(f)
+            if saved['params'] == params:
+                manifest = saved
+            else:
+                logging.info(f"Download parameters changed, discarding checkpoints in {checkpoint_dir}")
+
+        chunks = {f"{i:05d}": tickers[i:i + chunk_size] for i in range(0, len(tickers), chunk_size)}
+        todo = [
+            key for key in chunks
+            if key not in manifest['chunks'] or not os.path.exists(os.path.join(checkpoint_dir, f"{key}.parquet"))
+        ]
+        logging.info(f"{len(chunks) - len(todo)} of {len(chunks)} OHLC chunks already downloaded")
+        lock = threading.Lock()
+
+        def _download(key):
+            df = self.batch_fetch_tickers_ohlc(chunks[key], period=period, start_date=start_date, end_date=end_date)
+            _path = os.path.join(checkpoint_dir, f"{key}.parquet")
+            df.to_parquet(f"{_path}.tmp", index=False)
+            os.replace(f"{_path}.tmp", _path)
+            with lock:
+                manifest['chunks'][key] = {'tickers': chunks[key], 'rows': len(df)}
+                _atomic_write_json(manifest, manifest_path)
+            logging.info(f"Downloaded OHLC chunk {key} with {len(df)} rows")
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for future in [pool.submit(_download, key) for key in todo]:
+                future.result()
+        return [os.path.join(checkpoint_dir, f"{key}.parquet") for key in chunks]
+
     def _add_api_key(self, url: str) -> str:
         return url + f"apikey={self.API_KEY}"
 
     def _standardize_ticker(self, ticker: str):
         return ticker.replace('.', '-').upper()
 
+    def _get_json(self, url: str, key: tuple):
+        """
+        GET a json endpoint through the response cache if there is one.
+        :param key: cache key (endpoint, ticker, period, limit)
+        """
+        return json.loads(self._get_body(url, key))
+
+    def _get_body(self, url: str, key: tuple) -> bytes:
+        """
+        Raw response body of a 200 response, served from or revalidated against the response cache if there is one.
+        :param key: cache key (endpoint, ticker, period, limit)
+        """
+        endpoint = key[0]
+        entry = self.cache.get(key) if self.cache is not None else None
+        if entry is not None and entry.fresh():
+            self.metrics.record_cache(endpoint, 'hit')
+            return entry.body
+        response = self._get(url, endpoint=endpoint, headers=entry.conditional_headers() if entry else None)
+        if response.status_code == 304 and entry is not None:
+            self.metrics.record_cache(endpoint, 'revalidated')
+            entry = self.cache.revalidated(entry, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+            return entry.body
+        if response.status_code != 200:
+            raise ValueError(response.status_code, response.json())
+        if self.cache is not None:
+            self.metrics.record_cache(endpoint, 'miss')
+            self.cache.put(key, response.content, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        return response.content
+
+    def _get(self, url: str, endpoint: str = 'other', headers: dict = None,
+             max_throttled: int = 5) -> requests.Response:
+        response = None
+        for attempt in range(max_throttled):
+            if attempt:
+                self.metrics.record_retry(endpoint)
+            self.metrics.record_wait(endpoint, self.rate_limiter.acquire())
+            start = time.perf_counter()
+            try:
+                response = self._session.get(url, headers=headers)
+            except requests.RequestException as e:
+                self.metrics.record_request(endpoint, type(e).__name__, time.perf_counter() - start)
+                raise
+            self.metrics.record_request(endpoint, response.status_code, time.perf_counter() - start,
+                                        len(response.content))
+            if response.status_code != 429:
+                self.rate_limiter.on_success()
+                return response
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            logging.warning(f"Rate limited by FMP, backing off (Retry-After={retry_after})")
+            self.rate_limiter.on_throttled(retry_after)
+        return response
+
+    def _fetch_statement(self,
+                         api_path: str,
+                         ticker: str,
+                         period: str,
+                         limit: int,
+                         refresh: bool,
+                         incremental: bool = False):
+        if refresh:
+            if incremental:
+                limit = self._incremental_limit(api_path, ticker, period, limit)
+                if limit == 0:
+                    logging.info(f"{api_path} for {ticker} is up to date")
+                    return self._load_statement(api_path, ticker, period)
+            df = self._fetch_data_from_api(api_path, ticker, period, limit)
+            df = self._save_statement(api_path, ticker, period, df, merge=incremental)
+        else:
+            df = self._load_statement(api_path, ticker, period)
+        return df
+
+    def _load_statement(self, api_path: str, ticker: str, period: str) -> pd.DataFrame:
+        _path = _statement_path(api_path, ticker, period)
+        if self.store is not None and (not self.write_csv or not os.path.exists(_path)):
+            return self.store.read(api_path, period, tickers=[ticker])
+        return pd.read_csv(_path)
+
+    def _save_statement(self, api_path: str, ticker: str, period: str, df: pd.DataFrame, merge: bool = False):
+        _path = _statement_path(api_path, ticker, period)
+        if merge:
+            if os.path.exists(_path):
+                df = _merge_statements(pd.read_csv(_path), df)
+            elif self.store is not None and self.store.exists(api_path, period):
+                stored = self.store.read(api_path, period, tickers=[ticker])
+                stored['date'] = stored['date'].dt.strftime('%Y-%m-%d')
+                df = _merge_statements(stored, df)
+        if self.write_csv:
+            _check_or_create_directory(_path)
+            with self.metrics.timed(api_path, 'write'):
+                _atomic_write_csv(df, _path)
+        if self.store is not None:
+            self.store.stage(api_path, period, ticker, df)
+            with self._batch_lock:
+                flush_now = self._open_batches == 0
+            if flush_now:
+                self.store.flush()
+        logging.info(f"Successfully fetched {api_path} for {ticker}")
+        return df
+
+    def _begin_batch(self):
+        # store writes are deferred until the outermost batch finishes
+        with self._batch_lock:
+            self._open_batches += 1
+
+    def _end_batch(self):
+        with self._batch_lock:
+            self._open_batches -= 1
+            flush_now = self._open_batches == 0
+        if flush_now and self.store is not None:
+            self.store.flush()
+
+    def _incremental_limit(self, api_path: str, ticker: str, period: str, limit: int) -> int:
+        """
+        Number of entries to request so the stored statement becomes current, 0 if it already is.
+        """
+        _path = _statement_path(api_path, ticker, period)
+        if os.path.exists(_path):
+            dates = pd.read_csv(_path, usecols=lambda c: c == 'date')
+        elif self.store is not None and self.store.exists(api_path, period):
+            dates = self.store.read(api_path, period, columns=['date'], tickers=[ticker])
+        else:
+            return limit
+        if 'date' not in dates or dates['date'].isnull().all():
+            return limit
+        missing = _missing_periods(pd.to_datetime(dates['date']).max(), period)
+        # one extra entry re-fetches the latest stored period in case it has been restated
+        return min(limit, missing + 1) if missing > 0 else 0
+
     def _fetch_data_from_api(self, path: str, ticker: str, period: str, limit: int):
         ticker = self._standardize_ticker(ticker)
-        url = f"https://financialmodelingprep.com/api/v3/{path}/{ticker}?period={period}&limit={limit}&"
+        url = f"{shared.FMP_BASE_URL}/{path}/{ticker}?period={period}&limit={limit}&"
         url = self._add_api_key(url)
-        response = requests.get(url)
-        if response.status_code == 200:
-            df = pd.DataFrame(response.json())
-            return df
-        else:
-            raise ValueError(response.status_code, response.json())
+        body = self._get_body(url, (path, ticker, period, limit))
+        with self.metrics.timed(path, 'parse'):
+            # decoded record by record into typed columns, see src/ingest.py
+            df = ingest_json(body, path)
+        return df
 
 
 def fetch_sp500_tickers(refresh=False):
@@ -349,10 +563,61 @@ def fetch_sp500_ticker_change_history(refresh=False):
     return df
 
 
+def _statement_path(api_path: str, ticker: str, period: str) -> str:
+    return os.path.join(shared.PROJECT_DIR, 'artifacts', ticker.lower(), period, f"{STATEMENT_ENDPOINTS[api_path]}.csv")
+
+
+def _missing_periods(latest: pd.Timestamp, period: str, today: pd.Timestamp = None) -> int:
+    """
+    Number of fiscal periods ended after `latest` whose reports should be published by `today`.
+    """
+    months, lag_days = PERIOD_MONTHS_AND_LAG[period]
+    available = (today or pd.Timestamp.today()) - pd.Timedelta(days=lag_days)
+    elapsed = (available.year - latest.year) * 12 + available.month - latest.month
+    if available.day < latest.day:
+        elapsed -= 1
+    return max(0, elapsed // months)
+
+
+def _merge_statements(existing: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+    """
+    Union of stored and newly fetched rows, newer rows win on (symbol, date, period), newest first.
+    """
+    if existing.empty:
+        return new
+    if new.empty:
+        return existing
+    keys = [c for c in ('symbol', 'date', 'period') if c in new.columns and c in existing.columns]
+    for c in keys:
+        existing[c] = existing[c].astype(str)
+        new[c] = new[c].astype(str)
+    df = pd.concat([existing, new], ignore_index=True)
+    df = df.drop_duplicates(subset=keys, keep='last')
+    return df.sort_values('date', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def _atomic_write_csv(df: pd.DataFrame, path: str):
+    # write to a temp file in the same directory then rename, so readers never see a partial file
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        df.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _atomic_write_json(obj, path: str):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(obj, f)
+    os.replace(tmp_path, path)
+
+
 def _check_or_create_directory(path):
     dirname = os.path.dirname(path)
     if not os.path.exists(dirname):
-        os.makedirs(dirname)
+        os.makedirs(dirname, exist_ok=True)
 
 
 if __name__ == '__main__':
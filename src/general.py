@@ -1,83 +1,224 @@
 import os
-import time
 import pandas as pd
 from src import shared
 from src.fetch_data import DataDownloader
+from src.http_cache import ResponseCache
+from src.jobs import Job, JobLedger, run_jobs
+from src.membership import MembershipIndex
+from src.schema import compact_ohlc
+from src.price_panel import PricePanel, DEFAULT_PANEL_DIR
 from typing import List
 from tqdm import tqdm
 import logging
 from typing import Callable
 
-logging.basicConfig(level=logging.INFO)
+# created on first use so importing this module stays cheap, see `get_downloader`
+_downloader: DataDownloader = None
+# ledger name of the endpoint each fetch method downloads, e.g. fetch_key_metrics -> key-metrics
+_ENDPOINT_OF_METHOD = {method: api_path for api_path, method in shared.FETCH_METHODS.items()}
 
-_downloader = DataDownloader()
 
+def get_downloader() -> DataDownloader:
+    """
+    Downloader shared by the download jobs, created with the response cache on first use.
+    """
+    global _downloader
+    if _downloader is None:
+        _downloader = DataDownloader(cache=ResponseCache())
+    return _downloader
+
+
+def download_sp500_metrics(func: Callable,
+                           period: str,
+                           limit: int,
+                           batch_size: int = 10,
+                           membership: MembershipIndex = None,
+                           since: str = None,
+                           tickers: List[str] = None,
+                           resume: bool = False,
+                           retries: int = 2,
+                           ledger: JobLedger = None,
+                           incremental: bool = False):
+    """
+    Download one statement endpoint for every ticker. Each (ticker, endpoint, period) is a job in the ledger,
+    see src/jobs.py, recording its status, attempts, row count and last error as soon as it finishes.
+    Requests are paced by the downloader's rate limiter, see src/rate_limit.py.
+    :param func: a fetch method of `get_downloader()`, e.g. get_downloader().fetch_key_metrics
+    :param period: annual or quarter
+    :param limit: number of entries to fetch
+    :param batch_size: max number of tickers in flight at once
+    :param membership: point in time membership, fetch every ticker in the index since `since` instead of today's
+    :param since: start of the membership window, defaults to the whole history
+    :param tickers: explicit tickers to download instead of the SP500
+    :param resume: skip the jobs the ledger records as done, e.g. after a crash or partial outage, instead of
+        downloading everything again
+    :param retries: retries of a failed ticker, with exponential backoff
+    :param ledger: job ledger, defaults to artifacts/jobs.sqlite
+    :param incremental: only fetch the periods newer than the stored data of each ticker and merge them in,
+        tickers already up to date are not requested
+    :return: tickers that failed every attempt
+    """
+    sp500_tickers = tickers or _load_sp500_tickers(membership, since)
+    endpoint = _ENDPOINT_OF_METHOD.get(func.__name__, func.__name__)
+    jobs = [Job(ticker, endpoint, period) for ticker in dict.fromkeys(sp500_tickers)]
+    _ledger = ledger or JobLedger()
+    _ledger.add(jobs, reset=not resume)
+    todo = _ledger.not_done(jobs)
+    if resume:
+        print(f"Resuming {endpoint} {period}: {len(jobs) - len(todo)} of {len(jobs)} tickers already downloaded")
 
-def download_sp500_metrics(func: Callable, period: str, limit: int, batch_size: int = 10):
-    _sleep_seconds = 30
-    sp500_tickers = _load_sp500_tickers()
-    cnt = 0
-    batch_cnt = len(sp500_tickers) // batch_size + (1 if len(sp500_tickers) % batch_size else 0)
-    for tickers in tqdm(_batch_generator(sp500_tickers, batch_size), total=batch_cnt):
-        _downloader.batch_fetch(func, tickers, period=period, limit=limit)
-        cnt += len(tickers)
-        if cnt % 250 == 0:
-            print(f"Sleep {_sleep_seconds}s waiting for rate limit ...")
-            time.sleep(_sleep_seconds)
+    downloader = get_downloader()
+    downloader.metrics.reset()
+    kwargs = {'incremental': True} if incremental else {}
+    # store writes are deferred to the end of the run, so jobs only count as done once they are flushed
+    staged = downloader.store is not None
+    with tqdm(total=len(todo)) as progress, downloader.deferred_writes():
+        errors = run_jobs(todo, lambda job: func(job.ticker, period=period, limit=limit, refresh=True, **kwargs),
+                          _ledger, max_in_flight=batch_size, retries=retries,
+                          on_done=lambda job, ok: progress.update(), staged=staged)
+    if staged:
+        _ledger.commit(todo)
+    if ledger is None:
+        _ledger.close()
+    _print_fetch_summary()
+    failed = [job.ticker for job in errors]
+    if failed:
+        print(f"Failed to download {len(failed)} tickers: {failed}, rerun with resume=True to fetch only those")
+    return failed
 
 
-def download_sp500_company_profiles():
-    _sleep_seconds = 30
+def download_sp500_statements(period: str,
+                              limit: int,
+                              endpoints: List[str] = None,
+                              concurrency: int = 16,
+                              membership: MembershipIndex = None,
+                              since: str = None,
+                              tickers: List[str] = None,
+                              incremental: bool = False):
+    """
+    Download statement endpoints of all SP500 tickers in one asyncio pipeline.
+    :param period: annual or quarter
+    :param limit: number of entries to fetch
+    :param endpoints: FMP api paths, e.g. ['key-metrics', 'ratios']. Defaults to all statement endpoints
+    :param concurrency: max number of requests in flight
+    :param membership: point in time membership, fetch every ticker in the index since `since` instead of today's
+    :param since: start of the membership window, defaults to the whole history
+    :param tickers: explicit tickers to download instead of the SP500
+    :param incremental: only fetch the periods newer than the stored data and merge them in, tickers already up
+        to date are skipped
+    """
+    sp500_tickers = tickers or _load_sp500_tickers(membership, since)
+    downloader = get_downloader()
+    downloader.metrics.reset()
+    res = downloader.async_batch_fetch(sp500_tickers, period=period, limit=limit, endpoints=endpoints,
+                                        concurrency=concurrency, incremental=incremental)
+    print(f"Downloaded {len(res)} ticker endpoints")
+    _print_fetch_summary()
+    return res
+
+
+def download_sp500_company_profiles(membership: MembershipIndex = None, since: str = None, tickers: List[str] = None):
     _path = os.path.join(shared.PROJECT_DIR, 'artifacts', 'sp500_company_profiles.csv')
-    sp500_tickers = _load_sp500_tickers()
+    sp500_tickers = tickers or _load_sp500_tickers(membership, since)
+    downloader = get_downloader()
     res = []
-    for i, ticker in tqdm(enumerate(sp500_tickers)):
-        resp = _downloader.fetch_company_profile(ticker)
+    for ticker in tqdm(sp500_tickers):
+        resp = downloader.fetch_company_profile(ticker)
         res.append(resp)
-        if i+1 % 300 == 0:
-            print(f"Sleep {_sleep_seconds}s waiting for rate limit ...")
-            time.sleep(_sleep_seconds)
 
     pd.DataFrame(res).to_csv(_path, index=False)
     print("Result saved to", _path)
 
 
-def download_sp500_ohlc(period: str = None, start_date: str = None, end_date: str = None, save_file: str = None):
-    sp500_tickers = _load_sp500_tickers()
-    df = _downloader.batch_fetch_tickers_ohlc(
-        tickers=sp500_tickers,
-        period=period,
-        start_date=start_date,
-        end_date=end_date)
+def download_sp500_ohlc(period: str = None,
+                        start_date: str = None,
+                        end_date: str = None,
+                        save_file: str = None,
+                        save_panel: bool = False,
+                        chunk_size: int = None,
+                        workers: int = 2,
+                        membership: MembershipIndex = None,
+                        tickers: List[str] = None):
+    """
+    Download OHLC of all SP500 tickers as a long Date, Ticker, OHLCV frame.
+    :param save_file: csv file name under artifacts to save the frame to
+    :param save_panel: also save it as a memory-mapped price panel under artifacts/sp500_panel
+    :param chunk_size: download in groups of this many tickers, checkpointed under artifacts/ohlc_chunks
+        so an interrupted run resumes from the last finished chunk. Downloads all tickers at once if None
+    :param workers: chunks downloaded in parallel
+    :param membership: point in time membership, download every ticker in the index between start_date
+        and end_date instead of today's constituents
+    :param tickers: explicit tickers to download instead of the SP500
+    """
+    sp500_tickers = tickers or _load_sp500_tickers(membership, start_date, end_date)
+    if chunk_size is None:
+        df = get_downloader().batch_fetch_tickers_ohlc(
+            tickers=sp500_tickers,
+            period=period,
+            start_date=start_date,
+            end_date=end_date)
+        df = compact_ohlc(df)
+    else:
+        paths = get_downloader().chunked_fetch_tickers_ohlc(
+            tickers=sp500_tickers,
+            checkpoint_dir=os.path.join(shared.PROJECT_DIR, 'artifacts', 'ohlc_chunks'),
+            chunk_size=chunk_size,
+            workers=workers,
+            period=period,
+            start_date=start_date,
+            end_date=end_date)
+        # only one compact chunk is materialised in full precision at a time
+        df = pd.concat([compact_ohlc(pd.read_parquet(p)) for p in paths], ignore_index=True)
+        df['Ticker'] = df['Ticker'].astype('category')
     if save_file:
         _save_path = os.path.join(shared.PROJECT_DIR, 'artifacts', save_file)
         df.to_csv(_save_path, index=False)
         print(f"Data saved to {_save_path}")
+    if save_panel:
+        PricePanel.from_frame(df).save()
+        print(f"Price panel saved to {DEFAULT_PANEL_DIR}")
     return df
 
 
-def _batch_generator(lst: List, batch_size: int):
-    for i in range(0, len(lst), batch_size):
-        yield lst[i:i + batch_size]
+def _print_fetch_summary():
+    # wait_s is time spent on the rate limiter, parse_s/write_s time spent decoding responses and writing files
+    metrics = get_downloader().metrics
+    metrics.flush()
+    summary = metrics.summary()
+    if not summary.empty:
+        print(summary.to_string(float_format=lambda x: f"{x:.3f}"))
 
 
-def _load_sp500_tickers() -> List:
-    _path = os.path.join(shared.PROJECT_DIR, 'artifacts', 'sp500_stocks.csv')
-    sp500 = pd.read_csv(_path)
-    res = sp500['Symbol'].tolist()
+def _load_sp500_tickers(membership: MembershipIndex = None, since: str = None, until: str = None) -> List:
+    if membership is not None:
+        res = membership.ever(since, until)
+    else:
+        _path = os.path.join(shared.PROJECT_DIR, 'artifacts', 'sp500_stocks.csv')
+        sp500 = pd.read_csv(_path)
+        res = sp500['Symbol'].tolist()
     res.append('SPY')
     return res
 
 
 if __name__ == '__main__':
     """
-    Example:
+    Example, see also the command line interface `python -m src --help`:
     # download individual metrics
-    download_sp500_metrics(_downloader.fetch_income_statement, period='annual', limit=1000)
-    download_sp500_metrics(_downloader.fetch_key_metrics, period='quarter', limit=1000)
+    download_sp500_metrics(get_downloader().fetch_income_statement, period='annual', limit=1000)
+    download_sp500_metrics(get_downloader().fetch_key_metrics, period='quarter', limit=1000)
+    # after a crash or outage, only fetch what the job ledger does not record as done
+    download_sp500_metrics(get_downloader().fetch_key_metrics, period='quarter', limit=1000, resume=True)
+
+    # download all statement endpoints in one async pipeline
+    download_sp500_statements(period='quarter', limit=1000, concurrency=16)
+
+    # include every ticker that was in the index since 1985, not only today's constituents
+    download_sp500_statements(period='quarter', limit=1000, membership=MembershipIndex.from_artifacts(),
+                              since='1985-01-01')
     
     # download historical OHLC
-    data = download_sp500_ohlc(period='max', save_file='sp500_ohlc.csv')
+    data = download_sp500_ohlc(period='max', save_file='sp500_ohlc.csv', save_panel=True, chunk_size=50)
     print(data.head())
     """
+    logging.basicConfig(level=logging.INFO)
     download_sp500_company_profiles()
@@ -0,0 +1,256 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Tuple, Union
+import pandas as pd
+from src import shared
+from src.shared import STATEMENT_ENDPOINTS, PERIOD_MONTHS_AND_LAG
+
+# (endpoint, ticker, period, limit)
+CacheKey = Tuple[str, str, str, int]
+
+_DAY = 24 * 3600
+# `date` values of a statement body, found without decoding the json
+_DATE_RE = re.compile(rb'"date"\s*:\s*"(\d{4}-\d{2}-\d{2})')
+
+
+class CacheEntry(object):
+    """
+    A cached response body with its validators and freshness.
+    """
+    __slots__ = ('key', 'body', 'etag', 'last_modified', 'fetched_at', 'expires_at', '_latest_date')
+
+    def __init__(self, key: CacheKey, body: bytes, etag: str = None, last_modified: str = None,
+                 fetched_at: float = None, expires_at: float = float('inf'), latest_date: str = None):
+        self.key = key
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at if fetched_at is not None else time.time()
+        self.expires_at = expires_at
+        self._latest_date = latest_date
+
+    @property
+    def latest_date(self) -> str:
+        """
+        Newest `date` of the rows in the body as YYYY-MM-DD, '' if there is none. Scanned from the raw bytes once
+        and stored with the entry, so working out the expiry never decodes the body.
+        """
+        if self._latest_date is None:
+            self._latest_date = max(_DATE_RE.findall(self.body), default=b'').decode()
+        return self._latest_date
+
+    def fresh(self, now: float = None) -> bool:
+        return (now if now is not None else time.time()) < self.expires_at
+
+    def json(self):
+        return json.loads(self.body)
+
+    def conditional_headers(self) -> dict:
+        """
+        If-None-Match / If-Modified-Since headers to revalidate the entry, empty if the server sent no validators.
+        """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+def earnings_ttl(entry: CacheEntry) -> float:
+    """
+    Statements only change when a new report is published: keep them until the period after the newest cached
+    one should be out (period end + typical filing lag), then revalidate at most daily.
+    """
+    period = entry.key[2]
+    if not entry.latest_date or period not in PERIOD_MONTHS_AND_LAG:
+        return _DAY
+    months, lag_days = PERIOD_MONTHS_AND_LAG[period]
+    latest = pd.Timestamp(entry.latest_date)
+    next_available = latest + pd.DateOffset(months=months) + pd.Timedelta(days=lag_days)
+    return max(_DAY, next_available.timestamp() - entry.fetched_at)
+
+
+# seconds (None never expires) or a callable(entry) -> seconds, per endpoint
+DEFAULT_TTL = {
+    'profile': _DAY,
+    'stock/list': _DAY,
+    **{api_path: earnings_ttl for api_path in STATEMENT_ENDPOINTS},
+}
+
+
+class ResponseCache(object):
+    """
+    Cache of raw FMP responses keyed by (endpoint, ticker, period, limit): a bounded in-memory LRU
+    in front of gzip compressed files under artifacts/http_cache. Expired entries are kept so they can
+    be revalidated with ETag / Last-Modified instead of downloaded again, until they have not been fetched or
+    revalidated for `max_age`; such files are deleted when read and by `prune`, which runs on the first write.
+    """
+
+    def __init__(self,
+                 root: str = None,
+                 max_entries: int = 1024,
+                 ttl: Dict[str, Union[float, Callable[[CacheEntry], float]]] = None,
+                 default_ttl: float = 0,
+                 max_age: float = 30 * _DAY):
+        """
+        :param root: directory of the on-disk cache, defaults to artifacts/http_cache
+        :param max_entries: number of entries kept in memory
+        :param ttl: per endpoint seconds to consider a response fresh, or a callable(entry) -> seconds.
+            Merged over `DEFAULT_TTL`, None never expires
+        :param default_ttl: ttl of endpoints not in `ttl`, 0 always revalidates
+        :param max_age: seconds after its last fetch or revalidation an entry is deleted from disk, None keeps them
+        """
+        self.root = root or os.path.join(shared.PROJECT_DIR, 'artifacts', 'http_cache')
+        self.max_entries = max_entries
+        self.ttl = {**DEFAULT_TTL, **(ttl or {})}
+        self.default_ttl = default_ttl
+        self.max_age = max_age
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._pruned = False
+
+    def get(self, key: CacheKey) -> CacheEntry:
+        """
+        :return: the cached entry, fresh or not, None if the key was never cached
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                return entry
+        entry = self._read(key)
+        if entry is not None:
+            self._remember(entry)
+        return entry
+
+    def put(self, key: CacheKey, body: bytes, etag: str = None, last_modified: str = None) -> CacheEntry:
+        """
+        Cache a 200 response body.
+        """
+        entry = CacheEntry(key, body, etag=etag, last_modified=last_modified)
+        entry.expires_at = entry.fetched_at + self._ttl(entry)
+        self._remember(entry)
+        self._write(entry)
+        return entry
+
+    def revalidated(self, entry: CacheEntry, etag: str = None, last_modified: str = None) -> CacheEntry:
+        """
+        Mark an entry fresh again after a 304 Not Modified response.
+        """
+        entry.etag = etag or entry.etag
+        entry.last_modified = last_modified or entry.last_modified
+        entry.fetched_at = time.time()
+        entry.expires_at = entry.fetched_at + self._ttl(entry)
+        self._remember(entry)
+        self._write(entry)
+        return entry
+
+    def invalidate(self, key: CacheKey):
+        with self._lock:
+            self._memory.pop(key, None)
+        _path = self.path(key)
+        if os.path.exists(_path):
+            os.remove(_path)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        for dirpath, _, file_names in os.walk(self.root):
+            for file_name in file_names:
+                if file_name.endswith('.json.gz'):
+                    os.remove(os.path.join(dirpath, file_name))
+
+    def prune(self, now: float = None) -> int:
+        """
+        Delete the files of entries not fetched or revalidated for `max_age`, e.g. of limits or periods that are
+        no longer requested. Files are only written on fetch and revalidation, so their mtime tells the age
+        without reading them.
+        :return: number of deleted files
+        """
+        if self.max_age is None:
+            return 0
+        cutoff = (now if now is not None else time.time()) - self.max_age
+        removed = 0
+        for dirpath, _, file_names in os.walk(self.root):
+            for file_name in file_names:
+                _path = os.path.join(dirpath, file_name)
+                try:
+                    if file_name.endswith('.json.gz') and os.path.getmtime(_path) < cutoff:
+                        os.remove(_path)
+                        removed += 1
+                except FileNotFoundError:
+                    # removed by another process in the meantime
+                    pass
+        if removed:
+            with self._lock:
+                for key in [k for k, e in self._memory.items() if e.fetched_at < cutoff]:
+                    del self._memory[key]
+            logging.info(f"Pruned {removed} cache files older than {self.max_age / _DAY:.0f} days from {self.root}")
+        return removed
+
+    def path(self, key: CacheKey) -> str:
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()[:20]
+        return os.path.join(self.root, key[0].replace('/', '_'), f"{digest}.json.gz")
+
+    def _ttl(self, entry: CacheEntry) -> float:
+        ttl = self.ttl.get(entry.key[0], self.default_ttl)
+        if ttl is None:
+            return float('inf')
+        return ttl(entry) if callable(ttl) else ttl
+
+    def _remember(self, entry: CacheEntry):
+        with self._lock:
+            self._memory[entry.key] = entry
+            self._memory.move_to_end(entry.key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _read(self, key: CacheKey) -> CacheEntry:
+        _path = self.path(key)
+        if not os.path.exists(_path):
+            return None
+        try:
+            with gzip.open(_path, 'rt') as f:
+                record = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Dropping unreadable cache file {_path} {e!r}")
+            os.remove(_path)
+            return None
+        if tuple(record['key']) != key:
+            return None
+        if self.max_age is not None and record['fetched_at'] < time.time() - self.max_age:
+            os.remove(_path)
+            return None
+        entry = CacheEntry(key, record['body'].encode(), etag=record['etag'], last_modified=record['last_modified'],
+                           fetched_at=record['fetched_at'], latest_date=record.get('latest_date'))
+        # expiry follows the current ttl configuration rather than the one the entry was written with
+        entry.expires_at = entry.fetched_at + self._ttl(entry)
+        return entry
+
+    def _write(self, entry: CacheEntry):
+        with self._lock:
+            prune_now, self._pruned = not self._pruned, True
+        if prune_now:
+            self.prune()
+        _path = self.path(entry.key)
+        os.makedirs(os.path.dirname(_path), exist_ok=True)
+        record = {
+            'key': list(entry.key),
+            'etag': entry.etag,
+            'last_modified': entry.last_modified,
+            'fetched_at': entry.fetched_at,
+            'latest_date': entry.latest_date,
+            'body': entry.body.decode(),
+        }
+        tmp_path = f"{_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, 'wt', compresslevel=6) as f:
+            json.dump(record, f)
+        os.replace(tmp_path, _path)
@@ -0,0 +1,206 @@
+import codecs
+import json
+from typing import Dict, Iterable, Iterator, List, Union
+import numpy as np
+import pandas as pd
+from src.shared import STATEMENT_ENDPOINTS
+
+# FMP statement columns that are not numeric, everything else is numeric: int64 if every value is an integer,
+# as `pd.DataFrame(records)` infers it so the csv files keep writing 123 rather than 123.0, float64 otherwise
+DATE_COLUMNS = ['date', 'fillingDate', 'acceptedDate']
+CATEGORY_COLUMNS = ['symbol', 'reportedCurrency', 'period']
+STRING_COLUMNS = ['cik', 'link', 'finalLink', 'wsymbol']
+INT_COLUMNS = ['calendarYear']
+
+# records converted from python objects to typed arrays at a time, bounds the live object graph
+_BLOCK_ROWS = 4096
+# bytes of a whole body decoded at a time, so the full text is never held next to the body
+_CHUNK_BYTES = 1 << 16
+_WHITESPACE = ' \t\n\r'
+
+
+class Schema(object):
+    """
+    Fixed column types of one endpoint: date, category, string, int or float. Columns not listed get `default`,
+    so no per-response type inference is needed and every response of an endpoint yields the same dtypes.
+    """
+
+    def __init__(self, types: Dict[str, str], default: str = 'float'):
+        self.types = types
+        self.default = default
+
+    def type_of(self, column: str) -> str:
+        return self.types.get(column, self.default)
+
+
+STATEMENT_SCHEMA = Schema({
+    **{c: 'date' for c in DATE_COLUMNS},
+    **{c: 'category' for c in CATEGORY_COLUMNS},
+    **{c: 'string' for c in STRING_COLUMNS},
+    **{c: 'int' for c in INT_COLUMNS},
+})
+
+ENDPOINT_SCHEMAS = {
+    **{api_path: STATEMENT_SCHEMA for api_path in STATEMENT_ENDPOINTS},
+    'stock/list': Schema({'price': 'float', 'exchange': 'category', 'exchangeShortName': 'category',
+                          'type': 'category'}, default='string'),
+}
+
+
+class ColumnBuffers(object):
+    """
+    Column-wise accumulator of json records. Values are collected per column and converted to numpy arrays
+    of the schema type every `block_rows` records, so at most one block of python objects is alive at a time.
+    Records may miss keys or add new ones, missing values are null.
+    """
+
+    def __init__(self, schema: Schema, block_rows: int = _BLOCK_ROWS):
+        self.schema = schema
+        self.block_rows = block_rows
+        self.rows = 0
+        # column -> (first row, typed blocks), column -> values of the current block
+        self._blocks: Dict[str, tuple] = {}
+        self._pending: Dict[str, list] = {}
+        self._block_start = 0
+
+    def append(self, record: dict):
+        pending = self._pending
+        block_row = self.rows - self._block_start
+        padded = len(record) != len(pending)
+        for key, value in record.items():
+            values = pending.get(key)
+            if values is None:
+                values = pending[key] = [None] * block_row
+                self._blocks[key] = (self.rows, [])
+                padded = True
+            values.append(value)
+        self.rows += 1
+        if padded:
+            # a key was missing from this record or first seen in it
+            for values in pending.values():
+                if len(values) <= block_row:
+                    values.append(None)
+        if self.rows - self._block_start >= self.block_rows:
+            self._convert_block()
+
+    def extend(self, records: Iterable[dict]):
+        for record in records:
+            self.append(record)
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        :return: data frame with one column per key in first seen order, typed by the schema
+        """
+        self._convert_block()
+        columns = {}
+        for c, (first_row, blocks) in self._blocks.items():
+            kind = self.schema.type_of(c)
+            if first_row:
+                blocks = [_convert(kind, [None] * first_row)] + blocks
+            values = _concat(blocks)
+            columns[c] = pd.Categorical(values) if kind == 'category' else values
+        return pd.DataFrame(columns, index=pd.RangeIndex(self.rows))
+
+    def _convert_block(self):
+        for c, values in self._pending.items():
+            if values:
+                self._blocks[c][1].append(_convert(self.schema.type_of(c), values))
+                values.clear()
+        self._block_start = self.rows
+
+
+def iter_records(chunks: Union[bytes, Iterable[bytes]]) -> Iterator[dict]:
+    """
+    Incrementally decode the objects of a top level json array, e.g. an FMP response body or its chunks as they
+    arrive, without materialising the whole list.
+    """
+    if isinstance(chunks, (bytes, bytearray, memoryview)):
+        view = memoryview(chunks)
+        chunks = (view[i:i + _CHUNK_BYTES] for i in range(0, len(view), _CHUNK_BYTES))
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    scan = json.JSONDecoder().raw_decode
+    buf, pos, started, finished = '', 0, False, False
+    for chunk in _chain(chunks):
+        final = chunk is None
+        buf = buf[pos:] + decoder.decode(b'' if final else chunk, final=final)
+        pos = 0
+        while not finished:
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos == len(buf):
+                break
+            if not started:
+                if buf[pos] != '[':
+                    # e.g. an error message object
+                    raise ValueError(f"Expected a json array, got {buf[pos:pos + 200]!r}")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == ',':
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                finished = True
+                break
+            try:
+                record, end = scan(buf, pos)
+            except json.JSONDecodeError:
+                if final:
+                    raise
+                # the object continues in the next chunk
+                break
+            yield record
+            pos = end
+    if not finished:
+        raise ValueError("Truncated json array")
+
+
+def ingest_json(chunks: Union[bytes, Iterable[bytes]], api_path: str, schema: Schema = None) -> pd.DataFrame:
+    """
+    Decode a json array response straight into typed columns, instead of `pd.DataFrame(response.json())`
+    which holds the text, the list of dicts and the frame at once and infers the dtypes of every response.
+    :param chunks: response body or an iterable of its chunks
+    :param api_path: FMP api path selecting the schema, e.g. key-metrics
+    :param schema: overrides the endpoint schema
+    :return: data frame typed by the schema, the dtypes `FundamentalsStore` writes
+    """
+    buffers = ColumnBuffers(schema or ENDPOINT_SCHEMAS.get(api_path, STATEMENT_SCHEMA))
+    buffers.extend(iter_records(chunks))
+    return buffers.to_frame()
+
+
+def _chain(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    # None marks the end of the input so the decoder flushes and a truncated object is an error
+    for chunk in chunks:
+        if chunk:
+            yield bytes(chunk)
+    yield None
+
+
+def _convert(kind: str, values: List) -> Union[np.ndarray, pd.api.extensions.ExtensionArray]:
+    if kind == 'float':
+        try:
+            values_ = np.array(values)
+        except (OverflowError, TypeError, ValueError):
+            # e.g. integers beyond int64 or lists of different lengths
+            values_ = None
+        if values_ is not None and values_.ndim == 1 and values_.dtype == np.int64:
+            # blocks of integers are concatenated with float blocks to float64 by `_concat`
+            return values_
+        if values_ is not None and values_.ndim == 1 and values_.dtype == np.float64:
+            return values_
+        # None, integers beyond int64, lists, or strings such as "" or "N/A" in a numeric column
+        return pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(dtype='float64')
+    if kind == 'int':
+        return pd.array(pd.to_numeric(pd.Series(values, dtype=object), errors='coerce'), dtype='Int32')
+    if kind == 'date':
+        return pd.to_datetime(pd.Series(values, dtype=object), errors='coerce').array
+    return pd.array([None if v is None else str(v) for v in values], dtype='string')
+
+
+def _concat(blocks: list):
+    if len(blocks) == 1:
+        return blocks[0]
+    if isinstance(blocks[0], np.ndarray):
+        return np.concatenate(blocks)
+    return pd.concat([pd.Series(b) for b in blocks], ignore_index=True).array
@@ -0,0 +1,243 @@
+"""
+Ledger of bulk download jobs, one row per (ticker, endpoint, period) with its status, attempts, row count,
+last error and timestamps, kept in a small SQLite file so a crashed or partially failed run can be resumed
+and only the missing items fetched again. Only the standard library is imported, so the command line can
+report on the ledger without loading pandas.
+"""
+import heapq
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Iterable, List
+from src import shared
+
+PENDING, RUNNING, STAGED, DONE, FAILED = 'pending', 'running', 'staged', 'done', 'failed'
+
+Job = namedtuple('Job', ['ticker', 'endpoint', 'period'])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    ticker TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    period TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    rows INTEGER,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    PRIMARY KEY (ticker, endpoint, period)
+)
+"""
+
+
+class JobLedger(object):
+    """
+    Per (ticker, endpoint, period) status of download jobs. Every status change is committed right away,
+    so after a crash the ledger tells exactly which items finished; jobs left `running` or `staged`, fetched but
+    not yet written, count as not done.
+    """
+
+    def __init__(self, path: str = None):
+        """
+        :param path: SQLite file, defaults to artifacts/jobs.sqlite. ':memory:' keeps the ledger in memory
+        """
+        self.path = path or default_ledger_path()
+        if self.path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._conn:
+            if self.path != ':memory:':
+                # readers such as `python -m src jobs` do not block a running download
+                self._conn.execute('PRAGMA journal_mode=WAL')
+                self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute(_SCHEMA)
+
+    def add(self, jobs: Iterable[Job], reset: bool = False) -> int:
+        """
+        Register jobs, jobs already in the ledger keep their status unless `reset`.
+        :param reset: mark every given job pending again, e.g. to refresh data that was downloaded before
+        :return: number of jobs that are not done
+        """
+        jobs = [Job(*job) for job in jobs]
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO jobs (ticker, endpoint, period, status, created_at) VALUES (?, ?, ?, ?, ?)',
+                [(*job, PENDING, now) for job in jobs])
+            if reset:
+                self._conn.executemany(
+                    'UPDATE jobs SET status = ?, attempts = 0, rows = NULL, error = NULL, started_at = NULL, '
+                    'finished_at = NULL WHERE ticker = ? AND endpoint = ? AND period = ?',
+                    [(PENDING, *job) for job in jobs])
+        return len(self.not_done(jobs))
+
+    def not_done(self, jobs: Iterable[Job]) -> List[Job]:
+        """
+        The given jobs that have not finished successfully, in the given order.
+        """
+        jobs = [Job(*job) for job in jobs]
+        done = set()
+        with self._lock:
+            for endpoint, period in {(job.endpoint, job.period) for job in jobs}:
+                cursor = self._conn.execute('SELECT ticker FROM jobs WHERE endpoint = ? AND period = ? AND status = ?',
+                                            (endpoint, period, DONE))
+                done.update((ticker, endpoint, period) for ticker, in cursor)
+        return [job for job in jobs if tuple(job) not in done]
+
+    def start(self, job: Job):
+        self._update(job, 'status = ?, attempts = attempts + 1, error = NULL, started_at = ?', (RUNNING, time.time()))
+
+    def finish(self, job: Job, rows: int = None, staged: bool = False):
+        """
+        :param staged: the rows are only staged in memory, the job is done once `commit` records them as written
+        """
+        self._update(job, 'status = ?, rows = ?, error = NULL, finished_at = ?',
+                     (STAGED if staged else DONE, rows, time.time()))
+
+    def commit(self, jobs: Iterable[Job]):
+        """
+        Mark the staged ones of the given jobs done, once their rows have been written, e.g. by a store flush.
+        """
+        with self._lock, self._conn:
+            self._conn.executemany('UPDATE jobs SET status = ? WHERE ticker = ? AND endpoint = ? AND period = ? '
+                                   'AND status = ?', [(DONE, *Job(*job), STAGED) for job in jobs])
+
+    def fail(self, job: Job, error: BaseException):
+        self._update(job, 'status = ?, error = ?, finished_at = ?', (FAILED, repr(error)[:1000], time.time()))
+
+    def get(self, job: Job) -> dict:
+        """
+        :return: the ledger row of a job as a dict, None if it was never added
+        """
+        with self._lock:
+            cursor = self._conn.execute('SELECT * FROM jobs WHERE ticker = ? AND endpoint = ? AND period = ?',
+                                        tuple(job))
+            row = cursor.fetchone()
+            return dict(zip([c[0] for c in cursor.description], row)) if row else None
+
+    def failed(self, endpoint: str = None, period: str = None) -> List[dict]:
+        """
+        Failed jobs with their attempts and last error, optionally of one endpoint and period.
+        """
+        return self._select('SELECT ticker, endpoint, period, attempts, error, finished_at FROM jobs WHERE status = ?',
+                            (FAILED,), endpoint, period, order='endpoint, period, ticker')
+
+    def summary(self, endpoint: str = None, period: str = None) -> List[dict]:
+        """
+        Number of jobs and rows per endpoint, period and status, and when the last one of them finished.
+        """
+        return self._select('SELECT endpoint, period, status, COUNT(*) AS jobs, SUM(rows) AS rows, '
+                            'MAX(finished_at) AS last_finished FROM jobs WHERE 1 = 1', (), endpoint, period,
+                            group='endpoint, period, status', order='endpoint, period, status')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _update(self, job: Job, assignments: str, params: tuple):
+        with self._lock, self._conn:
+            self._conn.execute(f'UPDATE jobs SET {assignments} WHERE ticker = ? AND endpoint = ? AND period = ?',
+                               (*params, *job))
+
+    def _select(self, sql: str, params: tuple, endpoint: str, period: str, group: str = None,
+                order: str = None) -> List[dict]:
+        if endpoint is not None:
+            sql, params = sql + ' AND endpoint = ?', params + (endpoint,)
+        if period is not None:
+            sql, params = sql + ' AND period = ?', params + (period,)
+        if group:
+            sql += f' GROUP BY {group}'
+        if order:
+            sql += f' ORDER BY {order}'
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            columns = [c[0] for c in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor]
+
+
+def run_jobs(jobs: Iterable[Job],
+             fetch: Callable[[Job], object],
+             ledger: JobLedger,
+             max_in_flight: int = 10,
+             retries: int = 2,
+             backoff: float = 2.0,
+             max_backoff: float = 60.0,
+             on_done: Callable[[Job, bool], None] = None,
+             staged: bool = False) -> Dict[Job, BaseException]:
+    """
+    Run jobs on a bounded work queue, recording every attempt in the ledger. At most `max_in_flight` jobs run
+    at once and later ones are only queued when a slot frees up. A failed job is retried after an exponential
+    backoff with jitter while the other jobs keep running, and client errors (4xx other than 429) are not retried.
+    :param jobs: jobs to run, usually `ledger.not_done(...)` of the wanted ones
+    :param fetch: called as `fetch(job)`, the length of its result is recorded as the row count
+    :param ledger: job ledger
+    :param max_in_flight: max number of jobs running at once
+    :param retries: retries per job after its first attempt
+    :param backoff: seconds before the first retry, doubled on every further one
+    :param max_backoff: cap of the retry delay in seconds
+    :param on_done: called as `on_done(job, ok)` once a job succeeded or gave up, e.g. to advance a progress bar
+    :param staged: `fetch` only stages its rows in memory, successful jobs are recorded as staged and have to be
+        committed with `ledger.commit` once the rows are written
+    :return: dict of job -> last error for the jobs that failed every attempt
+    """
+    queue = deque(Job(*job) for job in jobs)
+    # (time a retry is due, sequence, job)
+    delayed = []
+    attempts: Dict[Job, int] = {}
+    errors: Dict[Job, BaseException] = {}
+    sequence = 0
+    with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='job') as pool:
+        in_flight = {}
+        while queue or delayed or in_flight:
+            now = time.monotonic()
+            while delayed and delayed[0][0] <= now:
+                queue.append(heapq.heappop(delayed)[2])
+            while queue and len(in_flight) < max_in_flight:
+                job = queue.popleft()
+                attempts[job] = attempts.get(job, 0) + 1
+                ledger.start(job)
+                in_flight[pool.submit(fetch, job)] = job
+            if not in_flight:
+                time.sleep(max(delayed[0][0] - now, 0))
+                continue
+            timeout = max(delayed[0][0] - now, 0) if delayed else None
+            finished, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in finished:
+                job = in_flight.pop(future)
+                error = future.exception()
+                if error is None:
+                    result = future.result()
+                    ledger.finish(job, len(result) if hasattr(result, '__len__') else None, staged=staged)
+                    errors.pop(job, None)
+                else:
+                    ledger.fail(job, error)
+                    errors[job] = error
+                    if attempts[job] <= retries and _retryable(error):
+                        delay = min(backoff * 2 ** (attempts[job] - 1), max_backoff) * random.uniform(0.5, 1.0)
+                        logging.warning(f"Retrying {job.endpoint} for {job.ticker} in {delay:.1f}s "
+                                        f"after {error!r}")
+                        sequence += 1
+                        heapq.heappush(delayed, (time.monotonic() + delay, sequence, job))
+                        continue
+                    logging.error(f"Error downloading {job.endpoint} for {job.ticker} {error!r}")
+                if on_done is not None:
+                    on_done(job, error is None)
+    return errors
+
+
+def default_ledger_path() -> str:
+    return os.path.join(shared.PROJECT_DIR, 'artifacts', 'jobs.sqlite')
+
+
+def _retryable(error: BaseException) -> bool:
+    # DataDownloader raises ValueError(status code, body) for non 200 responses
+    status = error.args[0] if isinstance(error, ValueError) and error.args else None
+    return not (isinstance(status, int) and 400 <= status < 500 and status != 429)
@@ -0,0 +1,117 @@
+import glob
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+import pandas as pd
+from src import shared
+
+
+def load_statements(file_name: str = 'key_metrics',
+                    period: str = 'quarter',
+                    columns: List[str] = None,
+                    start_year: int = None,
+                    end_year: int = None,
+                    workers: int = None,
+                    cache: bool = True,
+                    artifacts_dir: str = None) -> pd.DataFrame:
+    """
+    Load one statement of every ticker under artifacts/{ticker}/{period}/{file_name}.csv into a single frame.
+    Files are read in a thread pool and concatenated once. The merged result is cached under
+    artifacts/cache, keyed on the source files' mtimes and the arguments, so repeated runs skip the csv parsing.
+    Writing it removes the caches of older versions of the files for the same arguments.
+    :param file_name: statement file without extension, e.g. key_metrics, ratios
+    :param period: annual or quarter
+    :param columns: columns to keep, defaults to all
+    :param start_year: keep rows with calendarYear >= start_year
+    :param end_year: keep rows with calendarYear < end_year
+    :param workers: size of the thread pool, defaults to min(32, cpu count + 4)
+    :param cache: read and write the merged result cache
+    :param artifacts_dir: defaults to the project artifacts folder
+    :return: data frame of all tickers
+    """
+    artifacts_dir = artifacts_dir or os.path.join(shared.PROJECT_DIR, 'artifacts')
+    paths = statement_paths(artifacts_dir, file_name, period)
+
+    cache_path = None
+    if cache:
+        prefix = f"{file_name}-{period}-{cache_key([], columns, start_year, end_year)}"
+        cache_path = os.path.join(artifacts_dir, 'cache', f"{prefix}-{cache_key(paths)}.pkl")
+        if os.path.exists(cache_path):
+            logging.info(f"Loading {file_name} {period} from cache {cache_path}")
+            return pd.read_pickle(cache_path)
+
+    def _read(path):
+        return _read_statement(path, columns, start_year, end_year)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        frames = [df for df in pool.map(_read, paths) if not df.empty]
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+
+    if cache_path is not None:
+        write_cache(df, cache_path, f"{prefix}-*.pkl")
+    return df
+
+
+def statement_paths(artifacts_dir: str, file_name: str, period: str) -> List[str]:
+    """
+    Per-ticker csv files of a statement, artifacts_dir/{ticker}/{period}/{file_name}.csv, sorted by ticker.
+    """
+    paths = []
+    for d in sorted(os.listdir(artifacts_dir)):
+        _path = os.path.join(artifacts_dir, d, period, f"{file_name}.csv")
+        if os.path.isfile(_path):
+            paths.append(_path)
+    return paths
+
+
+def _read_statement(path: str, columns: List[str], start_year: int, end_year: int) -> pd.DataFrame:
+    usecols = None
+    if columns is not None:
+        # calendarYear and wsymbol are needed for filtering and fixing up symbols even if not requested
+        wanted = set(columns) | {'calendarYear', 'wsymbol', 'symbol'}
+        usecols = lambda c: c in wanted
+    df = pd.read_csv(path, usecols=usecols)
+    if 'wsymbol' in df.columns:
+        # some FMP rows only carry the ticker in `wsymbol`
+        if 'symbol' in df.columns:
+            df.loc[df['symbol'].isnull(), 'symbol'] = df.loc[df['symbol'].isnull(), 'wsymbol']
+        df = df.drop(['wsymbol'], axis=1)
+    if start_year is not None:
+        df = df[df['calendarYear'] >= start_year]
+    if end_year is not None:
+        df = df[df['calendarYear'] < end_year]
+    if columns is not None:
+        df = df[[c for c in columns if c in df.columns]]
+    return df
+
+
+def write_cache(df: pd.DataFrame, cache_path: str, stale: str):
+    """
+    Pickle `df` to `cache_path` atomically and remove the other cache files in its directory matching the glob
+    `stale`, e.g. the same cache keyed on older versions of its source files.
+    """
+    cache_dir = os.path.dirname(cache_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    df.to_pickle(tmp_path)
+    os.replace(tmp_path, cache_path)
+    for _path in glob.glob(os.path.join(glob.escape(cache_dir), stale)):
+        if _path != cache_path:
+            try:
+                os.remove(_path)
+            except FileNotFoundError:
+                # removed by another process in the meantime
+                pass
+
+
+def cache_key(paths: List[str], *args) -> str:
+    """
+    Hash of `args` and the path, modification time and size of every file, changes whenever one of them does.
+    """
+    h = hashlib.sha1(repr(args).encode())
+    for p in paths:
+        st = os.stat(p)
+        h.update(f"{p}:{st.st_mtime_ns}:{st.st_size}".encode())
+    return h.hexdigest()[:16]
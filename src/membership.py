@@ -0,0 +1,169 @@
+import logging
+from typing import List, Union
+import numpy as np
+import pandas as pd
+from src.fetch_data import fetch_sp500_tickers, fetch_sp500_ticker_change_history
+
+_MIN_DATE = np.datetime64('1900-01-01', 'D')
+_MAX_DATE = np.datetime64('2262-01-01', 'D')
+# columns of the wikipedia change table by position, its two row header does not survive the csv round trip
+_CHANGE_COLUMNS = ['date', 'added_ticker', 'added_security', 'removed_ticker', 'removed_security', 'reason']
+
+DateLike = Union[str, pd.Timestamp, np.datetime64]
+
+
+class MembershipIndex(object):
+    """
+    Point in time S&P 500 membership. Built by replaying the change history backwards from today's
+    constituents into one [start, end) interval per membership spell, then snapshotting the members
+    between consecutive change dates so `constituents` and `ever` are a binary search plus the output.
+    Tickers are returned as listed on wikipedia, e.g. BRK.B; queries also accept the FMP form BRK-B.
+    """
+
+    def __init__(self, tickers: List[str], starts: np.ndarray, ends: np.ndarray):
+        """
+        :param tickers: ticker of every membership spell
+        :param starts: first day of every spell
+        :param ends: day after the last day of every spell, far future for current members
+        """
+        self.tickers, codes = np.unique(np.asarray(tickers, dtype=object).astype(str), return_inverse=True)
+        starts = np.asarray(starts, dtype='datetime64[D]')
+        ends = np.asarray(ends, dtype='datetime64[D]')
+        self._codes_by_symbol = {_symbol(t): i for i, t in enumerate(self.tickers)}
+
+        # spells sorted by (ticker, start) for point lookups
+        order = np.lexsort((starts, codes))
+        self._codes, self._starts, self._ends = codes[order], starts[order], ends[order]
+        self._keys = self._codes.astype('int64') * _span() + _days(self._starts)
+
+        # members of every segment between consecutive change dates, stored CSR style
+        self._boundaries = np.unique(np.concatenate([[_MIN_DATE], starts, ends]))
+        self._boundaries = self._boundaries[self._boundaries < _MAX_DATE]
+        members, offsets = [], [0]
+        for b in self._boundaries:
+            m = np.unique(codes[(starts <= b) & (ends > b)])
+            members.append(m)
+            offsets.append(offsets[-1] + len(m))
+        self._members = np.concatenate(members) if members else np.array([], dtype=int)
+        self._offsets = np.asarray(offsets)
+
+        # spells by start date for the tickers added within a range
+        by_start = np.argsort(starts, kind='stable')
+        self._added_dates, self._added_codes = starts[by_start], codes[by_start]
+
+    @classmethod
+    def from_frames(cls, current: pd.DataFrame, changes: pd.DataFrame) -> 'MembershipIndex':
+        """
+        :param current: today's constituents as saved by `fetch_sp500_tickers`, `Symbol` and optionally `Date added`
+        :param changes: change table as saved by `fetch_sp500_ticker_change_history`
+        """
+        changes = normalize_changes(changes)
+        date_added = {}
+        if 'Date added' in current.columns:
+            date_added = dict(zip(current['Symbol'], pd.to_datetime(current['Date added'], errors='coerce')))
+
+        # replay backwards: `open_end` holds the end of the spell each ticker is in at the replay date
+        open_end = {t: _MAX_DATE for t in current['Symbol']}
+        tickers, starts, ends = [], [], []
+        skipped = 0
+        for row in changes.sort_values('date', ascending=False, kind='stable').itertuples(index=False):
+            day = np.datetime64(row.date, 'D')
+            if row.added_ticker:
+                if row.added_ticker in open_end:
+                    tickers.append(row.added_ticker)
+                    starts.append(day)
+                    ends.append(open_end.pop(row.added_ticker))
+                else:
+                    skipped += 1
+            if row.removed_ticker and row.removed_ticker not in open_end:
+                open_end[row.removed_ticker] = day
+        if skipped:
+            logging.debug(f"{skipped} additions of tickers no longer listed under the same symbol were skipped")
+
+        # spells open before the first recorded change start at `Date added` if known, else the beginning of time
+        for ticker, end in open_end.items():
+            added = date_added.get(ticker)
+            start = np.datetime64(added, 'D') if added is not None and not pd.isnull(added) else _MIN_DATE
+            tickers.append(ticker)
+            starts.append(start if end == _MAX_DATE else _MIN_DATE)
+            ends.append(end)
+        return cls(tickers, np.array(starts, dtype='datetime64[D]'), np.array(ends, dtype='datetime64[D]'))
+
+    @classmethod
+    def from_artifacts(cls, refresh: bool = False) -> 'MembershipIndex':
+        """
+        Build from artifacts/sp500_stocks.csv and artifacts/sp500_stocks_change_history.csv.
+        :param refresh: scrape both tables from wikipedia again first
+        """
+        return cls.from_frames(fetch_sp500_tickers(refresh), fetch_sp500_ticker_change_history(refresh))
+
+    def constituents(self, date: DateLike) -> List[str]:
+        """
+        Index members on `date`.
+        """
+        return self.tickers[self._segment_members(_to_day(date))].tolist()
+
+    def ever(self, start: DateLike = None, end: DateLike = None) -> List[str]:
+        """
+        Tickers that were members on any day in [start, end].
+        :param start: defaults to the beginning of the history
+        :param end: defaults to today
+        """
+        start = _to_day(start) if start is not None else _MIN_DATE
+        end = _to_day(end) if end is not None else _to_day(pd.Timestamp.today())
+        lo, hi = np.searchsorted(self._added_dates, [start, end], side='right')
+        codes = np.union1d(self._segment_members(start), self._added_codes[lo:hi])
+        return self.tickers[codes].tolist()
+
+    def contains(self, tickers, dates) -> np.ndarray:
+        """
+        Vectorized membership test of (ticker, date) pairs, e.g. the symbol and date columns of a statement frame.
+        :return: boolean array
+        """
+        codes = np.array([self._codes_by_symbol.get(_symbol(t), -1) for t in tickers], dtype='int64')
+        days = np.asarray(pd.to_datetime(dates), dtype='datetime64[D]')
+        if len(codes) == 0:
+            return np.zeros(0, dtype=bool)
+        pos = np.searchsorted(self._keys, codes * _span() + _days(days), side='right') - 1
+        pos_ = np.clip(pos, 0, None)
+        return (codes >= 0) & (pos >= 0) & (self._codes[pos_] == codes) & (self._ends[pos_] > days)
+
+    def _segment_members(self, day: np.datetime64) -> np.ndarray:
+        i = np.searchsorted(self._boundaries, day, side='right') - 1
+        if i < 0:
+            return np.array([], dtype=int)
+        return self._members[self._offsets[i]:self._offsets[i + 1]]
+
+
+def normalize_changes(changes: pd.DataFrame) -> pd.DataFrame:
+    """
+    Name the change table columns by position and drop the header rows that the two row wikipedia header
+    leaves in the csv, e.g. `Ticker,Security,Ticker,Security`.
+    """
+    df = changes.iloc[:, :len(_CHANGE_COLUMNS)].copy()
+    df.columns = _CHANGE_COLUMNS[:df.shape[1]]
+    dates = pd.to_datetime(df['date'], format='%B %d, %Y', errors='coerce')
+    unparsed = dates.isnull() & df['date'].notnull()
+    if unparsed.any():
+        dates[unparsed] = [pd.to_datetime(d, errors='coerce') for d in df.loc[unparsed, 'date']]
+    df['date'] = dates
+    df = df[df['date'].notnull()]
+    for c in ('added_ticker', 'removed_ticker'):
+        df[c] = df[c].where(df[c].notnull(), '').astype(str).str.strip()
+    return df.reset_index(drop=True)
+
+
+def _symbol(ticker: str) -> str:
+    return str(ticker).replace('.', '-').upper()
+
+
+def _to_day(date: DateLike) -> np.datetime64:
+    return np.datetime64(pd.Timestamp(date).date(), 'D')
+
+
+def _days(days: np.ndarray) -> np.ndarray:
+    return (days - _MIN_DATE).astype('int64')
+
+
+def _span() -> int:
+    return int(_days(np.array([_MAX_DATE]))[0]) + 1
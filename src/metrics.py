@@ -0,0 +1,276 @@
+import bisect
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import List
+import pandas as pd
+
+# upper bounds in seconds of the request latency histogram buckets
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+
+
+class MetricsSink(object):
+    """
+    Receives every event recorded by `FetchMetrics`. Events are dicts with keys
+    ts, event (request, retry, wait, stage or cache), endpoint and the event specific fields
+    status, seconds, bytes, stage and result.
+    """
+
+    def emit(self, event: dict):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+
+class InMemorySink(MetricsSink):
+    """
+    Aggregates events per endpoint: latency histogram, status counts, bytes, retries,
+    rate limit waits and time spent parsing and writing.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._stats = defaultdict(self._empty_stats)
+
+    def emit(self, event: dict):
+        with self._lock:
+            stats = self._stats[event['endpoint']]
+            kind = event['event']
+            if kind == 'request':
+                stats['status'][event['status']] += 1
+                stats['bytes'] += event.get('bytes', 0)
+                stats['histogram'][bisect.bisect_left(self.buckets, event['seconds'])] += 1
+                stats['latency_sum'] += event['seconds']
+                stats['latency_max'] = max(stats['latency_max'], event['seconds'])
+            elif kind == 'retry':
+                stats['retries'] += 1
+            elif kind == 'wait':
+                stats['wait'] += event['seconds']
+            elif kind == 'stage':
+                stats['stages'][event['stage']] += event['seconds']
+            elif kind == 'cache':
+                stats['cache'][event['result']] += 1
+
+    def summary(self) -> pd.DataFrame:
+        """
+        One row per endpoint. Latency quantiles are interpolated within the histogram buckets.
+        :return: dataframe indexed by endpoint
+        """
+        rows = []
+        with self._lock:
+            for endpoint, stats in sorted(self._stats.items()):
+                n = sum(stats['histogram'])
+                errors = sum(cnt for status, cnt in stats['status'].items() if not 200 <= _as_int(status) < 400)
+                rows.append({
+                    'endpoint': endpoint,
+                    'requests': n,
+                    'errors': errors,
+                    'status': ' '.join(f"{s}:{c}" for s, c in sorted(stats['status'].items(), key=str)),
+                    'retries': stats['retries'],
+                    'cache_hits': stats['cache']['hit'] + stats['cache']['revalidated'],
+                    'mb': stats['bytes'] / 2 ** 20,
+                    'mean_s': stats['latency_sum'] / n if n else float('nan'),
+                    'p50_s': self._quantile(stats, 0.5),
+                    'p95_s': self._quantile(stats, 0.95),
+                    'max_s': stats['latency_max'] if n else float('nan'),
+                    'wait_s': stats['wait'],
+                    'parse_s': stats['stages'].get('parse', 0.0),
+                    'write_s': stats['stages'].get('write', 0.0),
+                })
+        return pd.DataFrame(rows).set_index('endpoint') if rows else pd.DataFrame()
+
+    def to_prometheus(self, prefix: str = 'fmp') -> str:
+        """
+        Render the aggregates in the Prometheus text exposition format.
+        """
+        lines = [
+            f"# HELP {prefix}_request_duration_seconds Latency of HTTP requests",
+            f"# TYPE {prefix}_request_duration_seconds histogram",
+        ]
+        with self._lock:
+            stats_items = sorted(self._stats.items())
+            for endpoint, stats in stats_items:
+                cumulative = 0
+                for le, cnt in zip(self.buckets, stats['histogram']):
+                    cumulative += cnt
+                    le = '+Inf' if le == float('inf') else repr(le)
+                    lines.append(f'{prefix}_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{le}"}} '
+                                 f'{cumulative}')
+                lines.append(f'{prefix}_request_duration_seconds_sum{{endpoint="{endpoint}"}} {stats["latency_sum"]}')
+                lines.append(f'{prefix}_request_duration_seconds_count{{endpoint="{endpoint}"}} {cumulative}')
+            lines += [f"# HELP {prefix}_requests_total HTTP responses by status",
+                      f"# TYPE {prefix}_requests_total counter"]
+            for endpoint, stats in stats_items:
+                for status, cnt in sorted(stats['status'].items(), key=str):
+                    lines.append(f'{prefix}_requests_total{{endpoint="{endpoint}",status="{status}"}} {cnt}')
+            for name, key, help_text in [
+                ('response_bytes_total', 'bytes', 'Bytes received'),
+                ('retries_total', 'retries', 'Retried requests'),
+                ('rate_limit_wait_seconds_total', 'wait', 'Seconds spent waiting on the rate limiter'),
+            ]:
+                lines += [f"# HELP {prefix}_{name} {help_text}", f"# TYPE {prefix}_{name} counter"]
+                for endpoint, stats in stats_items:
+                    lines.append(f'{prefix}_{name}{{endpoint="{endpoint}"}} {stats[key]}')
+            lines += [f"# HELP {prefix}_cache_total Response cache lookups by result",
+                      f"# TYPE {prefix}_cache_total counter"]
+            for endpoint, stats in stats_items:
+                for result, cnt in sorted(stats['cache'].items()):
+                    lines.append(f'{prefix}_cache_total{{endpoint="{endpoint}",result="{result}"}} {cnt}')
+            lines += [f"# HELP {prefix}_stage_seconds_total Seconds spent parsing and writing responses",
+                      f"# TYPE {prefix}_stage_seconds_total counter"]
+            for endpoint, stats in stats_items:
+                for stage, seconds in sorted(stats['stages'].items()):
+                    lines.append(f'{prefix}_stage_seconds_total{{endpoint="{endpoint}",stage="{stage}"}} {seconds}')
+        return '\n'.join(lines) + '\n'
+
+    def _empty_stats(self):
+        return {
+            'status': defaultdict(int),
+            'bytes': 0,
+            'histogram': [0] * len(self.buckets),
+            'latency_sum': 0.0,
+            'latency_max': 0.0,
+            'retries': 0,
+            'wait': 0.0,
+            'stages': defaultdict(float),
+            'cache': defaultdict(int),
+        }
+
+    def _quantile(self, stats: dict, q: float) -> float:
+        n = sum(stats['histogram'])
+        if n == 0:
+            return float('nan')
+        rank = q * n
+        cumulative = 0
+        lower = 0.0
+        for upper, cnt in zip(self.buckets, stats['histogram']):
+            if cnt and cumulative + cnt >= rank:
+                upper = min(upper, stats['latency_max'])
+                return lower + (upper - lower) * (rank - cumulative) / cnt
+            cumulative += cnt
+            lower = upper
+        return stats['latency_max']
+
+
+class JsonLinesSink(MetricsSink):
+    """
+    Append every event as one json line to `path`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', buffering=1)
+
+    def emit(self, event: dict):
+        line = json.dumps(event)
+        with self._lock:
+            self._file.write(line + '\n')
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+
+class PrometheusSink(InMemorySink):
+    """
+    Aggregate in memory and dump the Prometheus text format to `path` on every flush,
+    e.g. for the node exporter textfile collector.
+    """
+
+    def __init__(self, path: str, buckets=DEFAULT_BUCKETS):
+        super().__init__(buckets)
+        self.path = path
+
+    def flush(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, self.path)
+
+
+class FetchMetrics(object):
+    """
+    Instrumentation of the fetch layer. Thread and coroutine safe; every record call is forwarded to all sinks.
+    """
+
+    def __init__(self, sinks: List[MetricsSink] = None):
+        """
+        :param sinks: event sinks, defaults to a single `InMemorySink`
+        """
+        self.sinks = list(sinks) if sinks else [InMemorySink()]
+
+    def record_request(self, endpoint: str, status, seconds: float, nbytes: int = 0):
+        """
+        :param status: HTTP status code, or the exception name if no response was received
+        """
+        self._emit({'event': 'request', 'endpoint': endpoint, 'status': status, 'seconds': seconds, 'bytes': nbytes})
+
+    def record_retry(self, endpoint: str):
+        self._emit({'event': 'retry', 'endpoint': endpoint})
+
+    def record_wait(self, endpoint: str, seconds: float):
+        if seconds > 0:
+            self._emit({'event': 'wait', 'endpoint': endpoint, 'seconds': seconds})
+
+    def record_cache(self, endpoint: str, result: str):
+        """
+        :param result: hit, revalidated (304) or miss
+        """
+        self._emit({'event': 'cache', 'endpoint': endpoint, 'result': result})
+
+    def record_stage(self, endpoint: str, stage: str, seconds: float):
+        self._emit({'event': 'stage', 'endpoint': endpoint, 'stage': stage, 'seconds': seconds})
+
+    @contextmanager
+    def timed(self, endpoint: str, stage: str):
+        """
+        Time the enclosed block as `stage`, e.g. parse or write.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(endpoint, stage, time.perf_counter() - start)
+
+    def summary(self) -> pd.DataFrame:
+        """
+        Per endpoint summary of the first in-memory sink, empty if there is none.
+        """
+        for sink in self.sinks:
+            if isinstance(sink, InMemorySink):
+                return sink.summary()
+        return pd.DataFrame()
+
+    def reset(self):
+        """
+        Clear the in-memory aggregates, e.g. before a new run.
+        """
+        for sink in self.sinks:
+            if isinstance(sink, InMemorySink):
+                sink.reset()
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+
+    def _emit(self, event: dict):
+        event['ts'] = time.time()
+        for sink in self.sinks:
+            sink.emit(event)
+
+
+def _as_int(status) -> int:
+    try:
+        return int(status)
+    except (TypeError, ValueError):
+        return 0
@@ -0,0 +1,206 @@
+import logging
+from typing import Tuple, Sequence
+import numpy as np
+import pandas as pd
+
+_TOL = 1e-10
+
+
+def min_variance(cov_matrix: np.ndarray,
+                 mean_returns: np.ndarray = None,
+                 target_return: float = None,
+                 w0: np.ndarray = None,
+                 max_iter: int = None) -> np.ndarray:
+    """
+    Long only minimum variance weights: min w'Σw s.t. sum(w) = 1, w >= 0 and, if given, mean_returns'w = target_return.
+    Solved exactly with a primal active-set method, which only factorises the KKT system of the
+    assets currently held, so it scales to hundreds of assets when the optimal portfolio is sparse.
+    :param cov_matrix: covariance of asset returns
+    :param mean_returns: expected asset returns, required with target_return
+    :param target_return: expected portfolio return, in the units of mean_returns
+    :param w0: feasible starting weights to warm start from
+    :param max_iter: defaults to 10 x number of assets
+    :return: weights, all NaN if target_return is outside [min(mean_returns), max(mean_returns)]
+    """
+    cov_matrix = np.asarray(cov_matrix, dtype='float64')
+    n = len(cov_matrix)
+    if target_return is None:
+        a, b = np.ones((1, n)), np.ones(1)
+        start = w0 if w0 is not None else np.full(n, 1 / n)
+    else:
+        mean_returns = np.asarray(mean_returns, dtype='float64')
+        a, b = np.vstack([np.ones(n), mean_returns]), np.array([1.0, target_return])
+        start = w0 if w0 is not None else _two_asset_start(mean_returns, target_return)
+        if start is None:
+            return np.full(n, np.nan)
+    return _active_set_qp(cov_matrix, a, b, start, max_iter)
+
+
+def max_sharpe(mean_returns: np.ndarray, cov_matrix: np.ndarray, risk_free_rate: float = 0.0) -> np.ndarray:
+    """
+    Long only maximum Sharpe ratio weights, solved exactly as the QP
+    min y'Σy s.t. (mean_returns - risk_free_rate)'y = 1, y >= 0 and w = y / sum(y).
+    Falls back to the minimum variance portfolio when no asset beats the risk free rate.
+    :param risk_free_rate: in the units of mean_returns, e.g. annual rate / 252 for daily returns
+    """
+    mean_returns = np.asarray(mean_returns, dtype='float64')
+    excess = mean_returns - risk_free_rate
+    if excess.max() <= 0:
+        logging.debug("No asset has a positive excess return, using the minimum variance portfolio")
+        return min_variance(cov_matrix)
+    best = int(np.argmax(excess))
+    start = np.zeros(len(excess))
+    start[best] = 1 / excess[best]
+    y = _active_set_qp(np.asarray(cov_matrix, dtype='float64'), excess[None, :], np.ones(1), start)
+    return y / y.sum()
+
+
+def efficient_frontier(mean_returns: np.ndarray,
+                       cov_matrix: np.ndarray,
+                       target_returns: Sequence[float]) -> Tuple[pd.DataFrame, np.ndarray]:
+    """
+    Minimum variance portfolios for a sequence of target returns. Targets are solved in increasing order,
+    each warm started from the previous solution nudged towards the highest return asset, so every
+    solve only has to release or block a few assets.
+    :param target_returns: in the units of mean_returns
+    :return: frame of target_return and volatility, and weights of shape [len(target_returns), n_assets]
+    """
+    mean_returns = np.asarray(mean_returns, dtype='float64')
+    cov_matrix = np.asarray(cov_matrix, dtype='float64')
+    targets = np.asarray(target_returns, dtype='float64')
+    order = np.argsort(targets)
+    weights = np.full((len(targets), len(mean_returns)), np.nan)
+    prev = None
+    for i in order:
+        start = _warm_start(prev, mean_returns, targets[i]) if prev is not None else None
+        w = min_variance(cov_matrix, mean_returns, targets[i], w0=start)
+        weights[i] = w
+        if not np.isnan(w).any():
+            prev = w
+    volatility = np.sqrt(np.einsum('ki,ij,kj->k', weights, cov_matrix, weights))
+    return pd.DataFrame({'target_return': targets, 'volatility': volatility}), weights
+
+
+def negative_sharpe_gradient(weights: np.ndarray, mean_returns: np.ndarray, cov_matrix: np.ndarray,
+                             risk_free_rate: float = 0.01, periods: int = 252) -> np.ndarray:
+    """
+    Gradient of portfolio.negative_sharpe, for use as `jac` with scipy.optimize.minimize.
+    """
+    mean_returns = np.asarray(mean_returns)
+    cov_w = np.asarray(cov_matrix) @ weights
+    std_dev = np.sqrt(weights @ cov_w * periods)
+    ret = mean_returns @ weights * periods
+    d_std = cov_w * periods / std_dev
+    return -(mean_returns * periods * std_dev - (ret - risk_free_rate) * d_std) / std_dev ** 2
+
+
+def sortino_gradient(weights: np.ndarray, returns, target_return: float = 0.0, periods: int = 252) -> np.ndarray:
+    """
+    Gradient of analytics.sortino_ratio, whose downside risk does not depend on the weights.
+    """
+    returns = np.asarray(returns)
+    downside_returns = np.where(returns < target_return, returns - target_return, 0)
+    downside_risk = np.sqrt(np.mean(np.square(downside_returns)) * periods)
+    if downside_risk == 0:
+        return np.zeros_like(weights)
+    return -returns.mean(axis=0) * periods / downside_risk
+
+
+def omega_gradient(weights: np.ndarray, returns, threshold_return: float = 0.0, periods: int = 252) -> np.ndarray:
+    """
+    Gradient of analytics.omega_ratio, piecewise constant between the kinks of the daily returns.
+    """
+    returns = np.asarray(returns)
+    relative_returns = returns @ weights - threshold_return / periods
+    up, down = relative_returns > 0, relative_returns < 0
+    gain, loss = relative_returns[up].sum(), -relative_returns[down].sum()
+    if loss == 0:
+        return np.zeros_like(weights)
+    d_gain, d_loss = returns[up].sum(axis=0), -returns[down].sum(axis=0)
+    return -(d_gain * loss - gain * d_loss) / loss ** 2
+
+
+def _active_set_qp(q: np.ndarray, a: np.ndarray, b: np.ndarray, w: np.ndarray, max_iter: int = None) -> np.ndarray:
+    """
+    Primal active-set method for min ½w'Qw s.t. Aw = b, w >= 0 from a feasible w.
+    """
+    n = len(w)
+    w = np.maximum(np.asarray(w, dtype='float64'), 0)
+    free = w > _TOL
+    max_iter = max_iter or 10 * n + 10
+    for _ in range(max_iter):
+        idx = np.flatnonzero(free)
+        w_eq, lam = _solve_eqp(q[np.ix_(idx, idx)], a[:, idx], b)
+        p = w_eq - w[idx]
+        if np.abs(p).max(initial=0) <= 1e-12 * max(1.0, np.abs(w).max()):
+            # stationary on the free set, check the multipliers of the assets held at zero
+            multipliers = q @ w - a.T @ lam
+            multipliers[free] = np.inf
+            j = int(np.argmin(multipliers))
+            if multipliers[j] >= -1e-12 * max(1.0, np.abs(q).max()):
+                return w
+            free[j] = True
+            continue
+        # longest step towards the equality solution that keeps every weight non-negative
+        decreasing = p < 0
+        steps = np.where(decreasing, -w[idx] / np.where(decreasing, p, -1), np.inf)
+        k = int(np.argmin(steps))
+        alpha = min(1.0, steps[k])
+        w[idx] += alpha * p
+        if alpha < 1.0:
+            w[idx[k]] = 0.0
+            free[idx[k]] = False
+        w[w < 0] = 0.0
+    logging.warning("Active-set QP did not converge, returning the last feasible weights")
+    return w
+
+
+def _solve_eqp(q: np.ndarray, a: np.ndarray, b: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    min ½x'Qx s.t. Ax = b through its KKT system, least squares when it is singular.
+    """
+    n, m = q.shape[0], a.shape[0]
+    kkt = np.zeros((n + m, n + m))
+    kkt[:n, :n] = q
+    kkt[:n, n:] = -a.T
+    kkt[n:, :n] = a
+    rhs = np.concatenate([np.zeros(n), b])
+    try:
+        sol = np.linalg.solve(kkt, rhs)
+    except np.linalg.LinAlgError:
+        sol = np.linalg.lstsq(kkt, rhs, rcond=None)[0]
+    return sol[:n], sol[n:]
+
+
+def _two_asset_start(mean_returns: np.ndarray, target_return: float) -> np.ndarray:
+    """
+    Feasible weights hitting target_return with at most two assets, None if no long only portfolio can.
+    """
+    lo, hi = int(np.argmin(mean_returns)), int(np.argmax(mean_returns))
+    if not mean_returns[lo] - _TOL <= target_return <= mean_returns[hi] + _TOL:
+        return None
+    w = np.zeros(len(mean_returns))
+    if mean_returns[hi] - mean_returns[lo] <= _TOL:
+        w[hi] = 1.0
+        return w
+    w[lo] = (mean_returns[hi] - target_return) / (mean_returns[hi] - mean_returns[lo])
+    w[hi] = 1.0 - w[lo]
+    return np.clip(w, 0, 1)
+
+
+def _warm_start(prev: np.ndarray, mean_returns: np.ndarray, target_return: float) -> np.ndarray:
+    """
+    Blend the previous frontier portfolio with the single asset on the side of the new target,
+    the smallest move that reaches target_return while staying long only.
+    """
+    prev_return = mean_returns @ prev
+    j = int(np.argmax(mean_returns)) if target_return >= prev_return else int(np.argmin(mean_returns))
+    gap = mean_returns[j] - prev_return
+    if abs(gap) <= _TOL:
+        return _two_asset_start(mean_returns, target_return)
+    t = (target_return - prev_return) / gap
+    if not 0 <= t <= 1:
+        return _two_asset_start(mean_returns, target_return)
+    w = (1 - t) * prev
+    w[j] += t
+    return w
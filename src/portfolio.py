@@ -0,0 +1,187 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+import numpy as np
+import pandas as pd
+from scipy.optimize import minimize
+from src.analytics import TRADING_DAYS, sortino_ratio, omega_ratio
+from src.covariance import rolling_window_moments
+from src.optimizer import max_sharpe, sortino_gradient, omega_gradient
+from src.trading_calendar import TradingCalendar
+
+
+def portfolio_annual_performance(weights: np.ndarray, mean_returns: np.ndarray, cov_matrix: np.ndarray):
+    """
+    :return: annualised standard deviation and return of daily mean returns and covariance
+    """
+    returns = np.sum(mean_returns * weights) * TRADING_DAYS
+    std_dev = np.sqrt(np.dot(weights.T, np.dot(cov_matrix, weights))) * np.sqrt(TRADING_DAYS)
+    return std_dev, returns
+
+
+def negative_sharpe(weights: np.ndarray, mean_returns: np.ndarray, cov_matrix: np.ndarray, risk_free_rate=0.01):
+    p_std, p_ret = portfolio_annual_performance(weights, mean_returns, cov_matrix)
+    return -(p_ret - risk_free_rate) / p_std
+
+
+def optimize_portfolio(returns, method: str = 'sharpe') -> np.ndarray:
+    """
+    Long only weights summing to 1 that optimise the given ratio over daily returns.
+    :param returns: data frame or array of daily returns, one column per asset
+    :param method: sharpe, sortino or omega
+    :return: weights
+    """
+    returns = np.asarray(returns)
+    if method == 'sharpe':
+        return _optimize_sharpe(returns.mean(axis=0), np.cov(returns, rowvar=False))
+    return _optimize_returns(returns, method)
+
+
+def bootstrap_indices(n_obs: int, n_days: int, n_bootstraps: int, seed=None) -> np.ndarray:
+    """
+    Row indices of all bootstrap samples, drawn with replacement.
+    :return: int array of shape [n_bootstraps, n_days]
+    """
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, n_obs, size=(n_bootstraps, n_days))
+
+
+def batched_moments(returns: np.ndarray, indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Means and sample covariances of every bootstrap sample at once.
+    :param returns: daily returns of shape [n_obs, n_assets]
+    :param indices: bootstrap rows of shape [n_bootstraps, n_days]
+    :return: means [n_bootstraps, n_assets] and covariances [n_bootstraps, n_assets, n_assets]
+    """
+    samples = returns[indices]
+    means = samples.mean(axis=1)
+    centered = samples - means[:, None, :]
+    covs = np.einsum('bdi,bdj->bij', centered, centered, optimize=True) / (indices.shape[1] - 1)
+    return means, covs
+
+
+def bootstrap_resample(returns,
+                       n_bootstraps: int,
+                       n_days: int,
+                       method: str = 'sharpe',
+                       seed=None,
+                       workers: int = None,
+                       chunk_size: int = 32) -> np.ndarray:
+    """
+    Average of the optimal weights over bootstrap resamples of the daily returns.
+    All resamples are drawn up front from `seed`, so the result does not depend on `workers`.
+    :param returns: data frame or array of daily returns, one column per asset
+    :param n_bootstraps: number of resamples
+    :param n_days: days per resample
+    :param method: sharpe, sortino or omega
+    :param seed: seed or np.random.SeedSequence for reproducible resamples
+    :param workers: processes to spread the optimisations over, 1 to run in this process
+    :param chunk_size: resamples per task
+    :return: averaged weights
+    """
+    returns = np.asarray(returns, dtype='float64')
+    indices = bootstrap_indices(len(returns), n_days, n_bootstraps, seed)
+    tasks = [(returns, indices[i:i + chunk_size], method) for i in range(0, n_bootstraps, chunk_size)]
+    weights = np.concatenate(_map(_optimize_chunk, tasks, workers))
+    return weights.mean(axis=0)
+
+
+def walk_forward_optimize(returns: pd.DataFrame,
+                          years: List[int],
+                          window: int = 10,
+                          n_bootstraps: int = 100,
+                          n_days: int = TRADING_DAYS,
+                          method: str = 'sharpe',
+                          risk_free_rate: float = 0.01,
+                          seed: int = None,
+                          workers: int = None,
+                          chunk_size: int = 32) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    For each year, optimise bootstrap averaged weights on the previous `window` years and compare the
+    following year's return and Sharpe ratio with an equal weight portfolio. Resamples of every year are
+    scheduled on one process pool.
+    :param returns: daily returns indexed by date, one column per asset
+    :param years: years to hold the optimised portfolio
+    :param n_bootstraps: resamples per year, 0 to optimise on the window moments directly (sharpe only),
+        which are then updated incrementally from one window to the next
+    :return: per year results and the weights used in each year
+    """
+    n_assets = returns.shape[1]
+    values = returns.to_numpy(dtype='float64')
+    # rows of the training window and of the holding year of every year, resolved once
+    calendar = TradingCalendar(returns.index)
+    years = list(years)
+    train_lo, _ = calendar.year_index(np.asarray(years) - window)
+    hold_lo, hold_hi = calendar.year_index(years)
+    if n_bootstraps == 0:
+        if method != 'sharpe':
+            raise ValueError("Optimising without bootstrap resamples is only supported for method='sharpe'")
+        windows = [(f"{year - window}-01-01", f"{year - 1}-12-31") for year in years]
+        weights = np.stack([_optimize_sharpe(m, c) for m, c in rolling_window_moments(returns, windows)])
+    else:
+        seeds = np.random.SeedSequence(seed).spawn(len(years))
+        tasks, owners = [], []
+        for i, year in enumerate(years):
+            window_returns = values[train_lo[i]:hold_lo[i]]
+            indices = bootstrap_indices(len(window_returns), n_days, n_bootstraps, seeds[i])
+            for j in range(0, n_bootstraps, chunk_size):
+                tasks.append((window_returns, indices[j:j + chunk_size], method))
+                owners.append(i)
+
+        chunks = _map(_optimize_chunk, tasks, workers)
+        weight_sums = np.zeros((len(years), n_assets))
+        for i, w in zip(owners, chunks):
+            weight_sums[i] += w.sum(axis=0)
+        weights = weight_sums / n_bootstraps
+
+    equal_weights = np.full(n_assets, 1 / n_assets)
+    rows = []
+    for i, year in enumerate(years):
+        next_year = returns.iloc[hold_lo[i]:hold_hi[i]]
+        mean_returns = next_year.mean().to_numpy()
+        cov_matrix = next_year.cov().to_numpy()
+        std_dev, ret = portfolio_annual_performance(weights[i], mean_returns, cov_matrix)
+        eq_std_dev, eq_ret = portfolio_annual_performance(equal_weights, mean_returns, cov_matrix)
+        rows.append({
+            'Year': year,
+            'Sharpe_Markowitz': (ret - risk_free_rate) / std_dev,
+            'Sharpe_Equal': (eq_ret - risk_free_rate) / eq_std_dev,
+            'Ret_Markowitz': ret,
+            'Ret_Equal': eq_ret,
+        })
+    return pd.DataFrame(rows), pd.DataFrame(weights, index=list(years), columns=returns.columns)
+
+
+def _optimize_chunk(task) -> np.ndarray:
+    returns, indices, method = task
+    if method == 'sharpe':
+        means, covs = batched_moments(returns, indices)
+        return np.stack([_optimize_sharpe(m, c) for m, c in zip(means, covs)])
+    return np.stack([_optimize_returns(returns[idx], method) for idx in indices])
+
+
+def _optimize_sharpe(mean_returns: np.ndarray, cov_matrix: np.ndarray, risk_free_rate=0.01) -> np.ndarray:
+    # exact QP solve of the negative_sharpe objective, with the annual risk free rate in daily units
+    return max_sharpe(mean_returns, cov_matrix, risk_free_rate / TRADING_DAYS)
+
+
+def _optimize_returns(returns: np.ndarray, method: str) -> np.ndarray:
+    objectives = {'sortino': (sortino_ratio, sortino_gradient), 'omega': (omega_ratio, omega_gradient)}
+    if method not in objectives:
+        raise ValueError(f"Unknown method {method}, use one of sharpe, {', '.join(objectives)}")
+    objective, gradient = objectives[method]
+    num_assets = returns.shape[1]
+    result = minimize(objective, np.full(num_assets, 1 / num_assets), args=(returns,), jac=gradient,
+                      method='SLSQP', bounds=[(0, 1)] * num_assets, constraints=_SUM_TO_ONE)
+    return result.x
+
+
+def _map(func, tasks: list, workers: int = None) -> list:
+    workers = workers or os.cpu_count()
+    if workers == 1 or len(tasks) == 1:
+        return [func(t) for t in tasks]
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+        return list(pool.map(func, tasks))
+
+
+_SUM_TO_ONE = ({'type': 'eq', 'fun': lambda x: np.sum(x) - 1, 'jac': lambda x: np.ones_like(x)},)
@@ -0,0 +1,166 @@
+import json
+import os
+from typing import List, Dict
+import numpy as np
+import pandas as pd
+from src import shared
+
+DEFAULT_PANEL_DIR = os.path.join(shared.PROJECT_DIR, 'artifacts', 'sp500_panel')
+_MANIFEST = 'manifest.json'
+_DATES = 'dates.npy'
+
+
+class PricePanel(object):
+    """
+    Dense [dates x tickers] price matrices, one per field (Open, Close, ...).
+    Saved as one .npy file per field plus a small date index and ticker list, and opened
+    memory-mapped so loading is instant and slices are views into the files.
+    """
+
+    def __init__(self, dates: np.ndarray, tickers: List[str], fields: Dict[str, np.ndarray]):
+        """
+        :param dates: sorted trading dates, datetime64[D]
+        :param tickers: column labels
+        :param fields: field name -> array of shape [len(dates), len(tickers)]
+        """
+        self.dates = np.asarray(dates, dtype='datetime64[D]')
+        self.tickers = list(tickers)
+        self.fields = fields
+        self._ticker_idx = {t: i for i, t in enumerate(self.tickers)}
+        self._date_idx = {d: i for i, d in enumerate(self.dates.astype('int64'))}
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, fields: List[str] = None, dtype: str = 'float32') -> 'PricePanel':
+        """
+        Build a panel from the long Date, Ticker, OHLCV frame of `download_sp500_ohlc`.
+        :param df: long format OHLC frame
+        :param fields: value columns to keep, defaults to every column but Date and Ticker
+        :param dtype: dtype of the price matrices, Volume is always kept as float64
+        """
+        fields = fields or [c for c in df.columns if c not in ('Date', 'Ticker')]
+        dates, date_codes = np.unique(pd.to_datetime(df['Date']).values.astype('datetime64[D]'), return_inverse=True)
+        tickers, ticker_codes = np.unique(df['Ticker'].astype(str).values, return_inverse=True)
+        arrays = {}
+        for f in fields:
+            f_dtype = 'float64' if f == 'Volume' else dtype
+            arr = np.full((len(dates), len(tickers)), np.nan, dtype=f_dtype)
+            arr[date_codes, ticker_codes] = df[f].to_numpy(dtype=f_dtype, na_value=np.nan)
+            arrays[f] = arr
+        return cls(dates, tickers.tolist(), arrays)
+
+    @classmethod
+    def open(cls, root: str = None, mmap_mode: str = 'r') -> 'PricePanel':
+        """
+        Open a saved panel, memory-mapped by default.
+        """
+        root = root or DEFAULT_PANEL_DIR
+        with open(os.path.join(root, _MANIFEST)) as f:
+            manifest = json.load(f)
+        dates = np.load(os.path.join(root, _DATES))
+        fields = {
+            field: np.load(os.path.join(root, file_name), mmap_mode=mmap_mode)
+            for field, file_name in manifest['fields'].items()
+        }
+        return cls(dates, manifest['tickers'], fields)
+
+    @staticmethod
+    def exists(root: str = None) -> bool:
+        return os.path.exists(os.path.join(root or DEFAULT_PANEL_DIR, _MANIFEST))
+
+    def save(self, root: str = None):
+        root = root or DEFAULT_PANEL_DIR
+        os.makedirs(root, exist_ok=True)
+        file_names = {}
+        for field, arr in self.fields.items():
+            file_names[field] = f"{field.lower().replace(' ', '_')}.npy"
+            np.save(os.path.join(root, file_names[field]), np.ascontiguousarray(arr))
+        np.save(os.path.join(root, _DATES), self.dates)
+        # manifest last, a panel without it is incomplete and will not be opened
+        with open(os.path.join(root, _MANIFEST), 'w') as f:
+            json.dump({'fields': file_names, 'tickers': self.tickers}, f)
+
+    @property
+    def shape(self):
+        return len(self.dates), len(self.tickers)
+
+    def ticker_index(self, ticker: str) -> int:
+        return self._ticker_idx[ticker]
+
+    def date_index(self, date) -> int:
+        """
+        Row of an exact trading date, KeyError if the market was closed.
+        """
+        return self._date_idx[np.datetime64(pd.Timestamp(date).date(), 'D').astype('int64')]
+
+    def asof_rows(self, dates) -> np.ndarray:
+        """
+        Rows of the first trading date on or after each date, so a date the market was closed
+        resolves to the next trading day. Dates after the last trading date map to len(self.dates).
+        """
+        dates = np.asarray(pd.to_datetime(dates).values.astype('datetime64[D]'))
+        return np.searchsorted(self.dates, dates, side='left')
+
+    def lookup(self, field: str, tickers, dates) -> np.ndarray:
+        """
+        Vectorized as-of lookup of `field` for pairs of (ticker, date), resolving closed days to the
+        next trading day. NaN where the ticker is unknown, the date is past the panel or there is no price.
+        :param field: e.g. Close
+        :param tickers: sequence of tickers
+        :param dates: sequence of dates, same length as tickers
+        :return: float array of prices
+        """
+        return self.take(field, tickers, self.asof_rows(dates))
+
+    def take(self, field: str, tickers, rows) -> np.ndarray:
+        """
+        Vectorized lookup of `field` for pairs of (ticker, row), e.g. rows resolved by a `TradingCalendar`.
+        NaN where the ticker is unknown, the row is out of range or there is no price.
+        :return: float array of prices
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.fromiter((self._ticker_idx.get(t, -1) for t in tickers), dtype=np.int64, count=len(tickers))
+        ok = (cols >= 0) & (rows >= 0) & (rows < len(self.dates))
+        res = np.full(len(cols), np.nan, dtype='float64')
+        res[ok] = self.fields[field][rows[ok], cols[ok]]
+        return res
+
+    def column(self, field: str, ticker: str) -> np.ndarray:
+        """
+        Full history of one ticker, a view into the panel.
+        """
+        return self.fields[field][:, self._ticker_idx[ticker]]
+
+    def slice(self, field: str, start=None, end=None, tickers: List[str] = None) -> np.ndarray:
+        """
+        Rows from `start` to `end` (inclusive) of a field. Without `tickers` this is a view,
+        selecting tickers copies the selected columns.
+        """
+        lo = 0 if start is None else int(np.searchsorted(self.dates, np.datetime64(pd.Timestamp(start).date(), 'D')))
+        hi = len(self.dates) if end is None else int(
+            np.searchsorted(self.dates, np.datetime64(pd.Timestamp(end).date(), 'D'), side='right'))
+        arr = self.fields[field][lo:hi]
+        if tickers is not None:
+            arr = arr[:, [self._ticker_idx[t] for t in tickers]]
+        return arr
+
+    def to_frame(self, field: str) -> pd.DataFrame:
+        """
+        Wide dates x tickers frame of one field.
+        """
+        return pd.DataFrame(self.fields[field], index=pd.DatetimeIndex(self.dates, name='Date'),
+                            columns=pd.Index(self.tickers, name='Ticker'), copy=False)
+
+    def to_long_frame(self, fields: List[str] = None) -> pd.DataFrame:
+        """
+        Long Date, Ticker, fields frame in the format of `download_sp500_ohlc`, rows without a price dropped.
+        """
+        fields = fields or list(self.fields)
+        key = 'Close' if 'Close' in self.fields else fields[0]
+        rows, cols = np.nonzero(~np.isnan(self.fields[key]))
+        df = pd.DataFrame({
+            'Date': pd.DatetimeIndex(self.dates[rows]),
+            'Ticker': pd.Categorical.from_codes(cols, categories=self.tickers),
+        })
+        for f in fields:
+            df[f] = self.fields[f][rows, cols]
+        return df
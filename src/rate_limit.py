@@ -0,0 +1,105 @@
+import asyncio
+import os
+import threading
+import time
+
+# Requests per minute allowed by the FMP plan, e.g. 300 for the starter plan
+DEFAULT_REQUESTS_PER_MINUTE = int(os.getenv('FMP_REQUESTS_PER_MINUTE', 300))
+
+
+class RateLimiter(object):
+    """
+    Token bucket shared by every thread and coroutine that talks to the same API.
+    Each call reserves a token up front, so concurrent callers are spaced out evenly instead of
+    bursting and sleeping together. On HTTP 429 the rate is halved and all callers pause; the rate
+    then recovers additively on successful responses.
+    """
+
+    def __init__(self, requests_per_minute: int = None, burst: int = None, min_fraction: float = 0.1):
+        """
+        :param requests_per_minute: request budget, defaults to env FMP_REQUESTS_PER_MINUTE or 300
+        :param burst: max tokens that can accumulate while idle, defaults to one second worth of requests
+        :param min_fraction: lowest fraction of the budget the adaptive rate can drop to
+        """
+        requests_per_minute = requests_per_minute or DEFAULT_REQUESTS_PER_MINUTE
+        self.target_rate = requests_per_minute / 60
+        self.min_rate = self.target_rate * min_fraction
+        self.rate = self.target_rate
+        self.capacity = burst or max(1, int(self.target_rate))
+        self._tokens = float(self.capacity)
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Block the calling thread until a request is allowed.
+        :return: seconds waited
+        """
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self) -> float:
+        """
+        Suspend the calling coroutine until a request is allowed.
+        :return: seconds waited
+        """
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def on_throttled(self, retry_after: float = None):
+        """
+        Report an HTTP 429. Halves the rate and pauses everyone for `retry_after` seconds
+        (or the time to earn one token at the reduced rate).
+        """
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            pause = retry_after if retry_after is not None else 1 / self.rate
+            self._paused_until = max(self._paused_until, time.monotonic() + pause)
+            self._tokens = min(self._tokens, 0.0)
+
+    def on_success(self):
+        """
+        Report a successful response, recovering the rate towards the configured budget.
+        """
+        if self.rate < self.target_rate:
+            with self._lock:
+                self.rate = min(self.target_rate, self.rate + self.target_rate * 0.05)
+
+    def _reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(wait, self._paused_until - now)
+
+
+def parse_retry_after(value) -> float:
+    """
+    Parse the seconds form of a Retry-After header, None if absent or not numeric.
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+_shared_limiter = None
+_shared_lock = threading.Lock()
+
+
+def shared_rate_limiter() -> RateLimiter:
+    """
+    Process wide limiter used by every DataDownloader unless one is passed explicitly.
+    """
+    global _shared_limiter
+    with _shared_lock:
+        if _shared_limiter is None:
+            _shared_limiter = RateLimiter()
+        return _shared_limiter
@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+
+# low cardinality string columns stored as categoricals
+METRICS_CATEGORY_COLUMNS = ['symbol', 'period', 'reportedCurrency', 'GICS Sector', 'GICS Sub-Industry']
+# integer columns narrowed to the smallest fitting int, other integers keep their dtype
+METRICS_INTEGER_COLUMNS = ['calendarYear']
+OHLC_CATEGORY_COLUMNS = ['Ticker']
+OHLC_PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Adj Close']
+# integers above this are not exactly representable in float32
+_FLOAT32_EXACT_INT = 2 ** 24
+
+
+def compact_metrics(df: pd.DataFrame, rtol: float = 1e-6) -> pd.DataFrame:
+    """
+    Memory compact dtypes for statement frames such as the output of `make_data`: categorical symbols,
+    periods and sectors, datetime64 dates, int16 calendar years and float32 metrics where safe.
+    :param df: statement data frame
+    :param rtol: max relative error tolerated when downcasting float64 to float32
+    :return: a new data frame
+    """
+    df = df.copy()
+    for c in df.columns:
+        if c in METRICS_CATEGORY_COLUMNS:
+            df[c] = df[c].astype('category')
+        elif c == 'date':
+            df[c] = pd.to_datetime(df[c])
+        elif c in METRICS_INTEGER_COLUMNS:
+            df[c] = downcast_numeric(pd.to_numeric(df[c], errors='coerce'), rtol, integer=True)
+        elif pd.api.types.is_numeric_dtype(df[c]) and not pd.api.types.is_bool_dtype(df[c]):
+            df[c] = downcast_numeric(df[c], rtol)
+    return df
+
+
+def compact_ohlc(df: pd.DataFrame, rtol: float = 1e-6) -> pd.DataFrame:
+    """
+    Memory compact dtypes for the long format OHLC frame from `download_sp500_ohlc`.
+    :param df: data frame with Date, Ticker and OHLCV columns
+    :param rtol: max relative error tolerated when downcasting float64 to float32
+    :return: a new data frame
+    """
+    df = df.copy()
+    for c in df.columns:
+        if c in OHLC_CATEGORY_COLUMNS:
+            df[c] = df[c].astype('category')
+        elif c == 'Date':
+            df[c] = pd.to_datetime(df[c])
+        elif pd.api.types.is_numeric_dtype(df[c]):
+            df[c] = downcast_numeric(df[c], rtol)
+    return df
+
+
+def read_ohlc_csv(path: str) -> pd.DataFrame:
+    """
+    Read a saved OHLC csv straight into compact dtypes, avoiding a full float64/object copy.
+    """
+    header = pd.read_csv(path, nrows=0).columns
+    dtype = {c: 'float32' for c in OHLC_PRICE_COLUMNS if c in header}
+    dtype.update({c: 'category' for c in OHLC_CATEGORY_COLUMNS if c in header})
+    df = pd.read_csv(path, dtype=dtype, parse_dates=['Date'])
+    if 'Volume' in df.columns:
+        df['Volume'] = downcast_numeric(df['Volume'])
+    return df
+
+
+def downcast_numeric(s: pd.Series, rtol: float = 1e-6, integer: bool = False) -> pd.Series:
+    """
+    float64 columns become float32 if every value round trips within `rtol`, other dtypes are kept, so integer
+    counts and ids are not narrowed to types that overflow in later arithmetic.
+    :param integer: the column holds integers such as calendar years, without missing values they become the
+        smallest fitting int, with missing values float32 only while exactly representable
+    """
+    if not integer and s.dtype != np.float64:
+        return s
+    values = s.to_numpy(dtype='float64', na_value=np.nan)
+    finite = values[np.isfinite(values)]
+    if finite.size == 0:
+        return s.astype('float32')
+    if integer and np.all(finite == np.round(finite)):
+        if finite.size == values.size:
+            for dtype in (np.int8, np.int16, np.int32, np.int64):
+                info = np.iinfo(dtype)
+                if info.min <= finite.min() and finite.max() <= info.max:
+                    return s.astype(dtype)
+        if np.abs(finite).max() <= _FLOAT32_EXACT_INT:
+            return s.astype('float32')
+        return s.astype('float64')
+    if np.abs(finite).max() >= np.finfo(np.float32).max:
+        return s.astype('float64')
+    as32 = finite.astype('float32').astype('float64')
+    nonzero = finite != 0
+    if np.all(np.abs(as32[nonzero] - finite[nonzero]) <= rtol * np.abs(finite[nonzero])):
+        return s.astype('float32')
+    return s.astype('float64')
+
+
+def memory_usage_mb(df: pd.DataFrame) -> float:
+    return df.memory_usage(deep=True).sum() / 1024 ** 2
@@ -1,4 +1,37 @@
 import os
 
 PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-CNT = 0
+FMP_BASE_URL = os.getenv('FMP_BASE_URL', 'https://financialmodelingprep.com/api/v3')
+
+# FMP statement endpoints and the csv file each one is saved to under artifacts/{ticker}/{period}/,
+# defined here rather than in fetch_data so the command line can list them without importing pandas
+STATEMENT_ENDPOINTS = {
+    'key-metrics': 'key_metrics',
+    'income-statement': 'income_statement',
+    'balance-sheet-statement': 'balance_sheet_statement',
+    'cash-flow-statement': 'cash_flow_statement',
+    'ratios': 'ratios',
+    'cash-flow-statement-growth': 'cashflow_growth',
+    'income-statement-growth': 'income_growth',
+    'balance-sheet-statement-growth': 'balance_sheet_growth',
+    'financial-growth': 'financial_growth',
+}
+
+# months per fiscal period and the typical days after period end until the report is published
+PERIOD_MONTHS_AND_LAG = {
+    'quarter': (3, 45),
+    'annual': (12, 90),
+}
+
+# DataDownloader method fetching each statement endpoint
+FETCH_METHODS = {
+    'key-metrics': 'fetch_key_metrics',
+    'income-statement': 'fetch_income_statement',
+    'balance-sheet-statement': 'fetch_balance_sheet_statement',
+    'cash-flow-statement': 'fetch_cashflow_statement',
+    'ratios': 'fetch_ratios',
+    'cash-flow-statement-growth': 'fetch_cashflow_growth',
+    'income-statement-growth': 'fetch_income_growth',
+    'balance-sheet-statement-growth': 'fetch_balance_sheet_growth',
+    'financial-growth': 'fetch_financial_growth',
+}
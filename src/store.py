@@ -0,0 +1,174 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from src import shared
+from src.shared import STATEMENT_ENDPOINTS
+from src.ingest import STATEMENT_SCHEMA
+
+
+class FundamentalsStore(object):
+    """
+    Columnar store of FMP statements: one parquet file per endpoint and period, e.g.
+    artifacts/store/key_metrics/quarter.parquet, sorted by (symbol, date) so that filters on
+    symbol and date skip row groups and only the requested columns are decoded.
+
+    Writes are staged in memory and merged into the files on `flush`, replacing the rows
+    of every re-fetched symbol.
+    """
+
+    def __init__(self, root: str = None, row_group_size: int = 16384, flush_rows: int = 500_000):
+        """
+        :param root: directory of the store, defaults to artifacts/store
+        :param row_group_size: rows per parquet row group, the granularity of filter pushdown
+        :param flush_rows: staged rows that trigger an automatic flush
+        """
+        self.root = root or os.path.join(shared.PROJECT_DIR, 'artifacts', 'store')
+        self.row_group_size = row_group_size
+        self.flush_rows = flush_rows
+        self._pending: Dict[tuple, Dict[str, pd.DataFrame]] = {}
+        self._pending_rows = 0
+        self._lock = threading.Lock()
+        self._file_locks: Dict[str, threading.Lock] = {}
+
+    def path(self, api_path: str, period: str) -> str:
+        return os.path.join(self.root, STATEMENT_ENDPOINTS[api_path], f"{period}.parquet")
+
+    def stage(self, api_path: str, period: str, ticker: str, df: pd.DataFrame):
+        """
+        Queue the full statement history of one ticker to be written on the next flush.
+        """
+        with self._lock:
+            self._pending.setdefault((api_path, period), {})[_symbol(ticker)] = df
+            self._pending_rows += len(df)
+            should_flush = self._pending_rows >= self.flush_rows
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        """
+        Merge all staged frames into their parquet files.
+        """
+        with self._lock:
+            pending, self._pending, self._pending_rows = self._pending, {}, 0
+        for (api_path, period), frames in pending.items():
+            self.write(api_path, period, frames)
+
+    def write(self, api_path: str, period: str, frames: Dict[str, pd.DataFrame]):
+        """
+        Replace the rows of the given tickers in the endpoint file.
+        :param api_path: FMP api path, e.g. key-metrics
+        :param period: annual or quarter
+        :param frames: dict of ticker -> statement data frame
+        """
+        _path = self.path(api_path, period)
+        os.makedirs(os.path.dirname(_path), exist_ok=True)
+        frames = {_symbol(t): df for t, df in frames.items()}
+        symbols = list(frames)
+        new = pd.concat([_with_symbol(df, s) for s, df in frames.items()], ignore_index=True)
+        with self._file_lock(_path):
+            if os.path.exists(_path):
+                existing = pq.read_table(_path, filters=[('symbol', 'not in', symbols)]).to_pandas()
+                new = pd.concat([existing, _normalize(new)], ignore_index=True)
+            df = _normalize(new).sort_values(['symbol', 'date'], kind='stable').reset_index(drop=True)
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            tmp_path = f"{_path}.{os.getpid()}.tmp"
+            pq.write_table(table, tmp_path, row_group_size=self.row_group_size, compression='zstd')
+            os.replace(tmp_path, _path)
+        logging.info(f"Stored {len(symbols)} tickers of {api_path} {period} to {_path}")
+
+    def read(self,
+             api_path: str,
+             period: str,
+             columns: List[str] = None,
+             tickers: List[str] = None,
+             start_date: str = None,
+             end_date: str = None) -> pd.DataFrame:
+        """
+        Load an endpoint with column and predicate pushdown.
+        :param api_path: FMP api path, e.g. key-metrics
+        :param period: annual or quarter
+        :param columns: columns to load, defaults to all
+        :param tickers: tickers to load, defaults to all
+        :param start_date: inclusive lower bound of `date`, YYYY-MM-DD
+        :param end_date: inclusive upper bound of `date`, YYYY-MM-DD
+        :return: data frame with typed columns
+        """
+        filters = []
+        if tickers is not None:
+            filters.append(('symbol', 'in', [_symbol(t) for t in tickers]))
+        if start_date is not None:
+            filters.append(('date', '>=', pd.Timestamp(start_date)))
+        if end_date is not None:
+            filters.append(('date', '<=', pd.Timestamp(end_date)))
+        table = pq.read_table(self.path(api_path, period), columns=columns, filters=filters or None)
+        return table.to_pandas()
+
+    def exists(self, api_path: str, period: str) -> bool:
+        return os.path.exists(self.path(api_path, period))
+
+    def import_csv(self, api_path: str, period: str, artifacts_dir: str = None, workers: int = 16):
+        """
+        Build the endpoint file from the per-ticker csv layout artifacts/{ticker}/{period}/*.csv
+        """
+        artifacts_dir = artifacts_dir or os.path.join(shared.PROJECT_DIR, 'artifacts')
+        file_name = f"{STATEMENT_ENDPOINTS[api_path]}.csv"
+        paths = {
+            d: os.path.join(artifacts_dir, d, period, file_name)
+            for d in sorted(os.listdir(artifacts_dir))
+            if os.path.isfile(os.path.join(artifacts_dir, d, period, file_name))
+        }
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            frames = dict(zip(paths, pool.map(pd.read_csv, paths.values())))
+        frames = {t: df for t, df in frames.items() if not df.empty}
+        self.write(api_path, period, frames)
+
+    def export_csv(self, api_path: str, period: str, artifacts_dir: str = None, tickers: List[str] = None):
+        """
+        Write the endpoint back out as the per-ticker csv layout artifacts/{ticker}/{period}/*.csv
+        """
+        artifacts_dir = artifacts_dir or os.path.join(shared.PROJECT_DIR, 'artifacts')
+        file_name = f"{STATEMENT_ENDPOINTS[api_path]}.csv"
+        df = self.read(api_path, period, tickers=tickers)
+        df['date'] = df['date'].dt.strftime('%Y-%m-%d')
+        for symbol, sub in df.groupby('symbol', observed=True):
+            _path = os.path.join(artifacts_dir, symbol.lower().replace('-', '.'), period, file_name)
+            os.makedirs(os.path.dirname(_path), exist_ok=True)
+            sub.sort_values('date', ascending=False).to_csv(_path, index=False)
+
+    def _file_lock(self, path: str) -> threading.Lock:
+        with self._lock:
+            return self._file_locks.setdefault(path, threading.Lock())
+
+
+def _symbol(ticker: str) -> str:
+    return ticker.replace('.', '-').upper()
+
+
+def _with_symbol(df: pd.DataFrame, symbol: str) -> pd.DataFrame:
+    # a few FMP rows come back without `symbol`, the ticker they were fetched for is authoritative
+    df = df.copy()
+    df['symbol'] = symbol
+    return df
+
+
+def _normalize(df: pd.DataFrame) -> pd.DataFrame:
+    # the same column types as `ingest_json`, except that integral numeric columns are stored as float64 too
+    df = df.copy()
+    for c in df.columns:
+        kind = STATEMENT_SCHEMA.type_of(c)
+        if kind == 'date':
+            df[c] = pd.to_datetime(df[c], errors='coerce')
+        elif kind == 'category':
+            df[c] = df[c].astype('string').astype('category')
+        elif kind == 'string':
+            df[c] = df[c].astype('string')
+        elif kind == 'int':
+            df[c] = pd.to_numeric(df[c], errors='coerce').astype('Int32')
+        else:
+            df[c] = pd.to_numeric(df[c], errors='coerce').astype('float64')
+    return df
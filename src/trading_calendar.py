@@ -0,0 +1,146 @@
+from typing import Tuple
+import numpy as np
+import pandas as pd
+from src.price_panel import PricePanel
+
+_FREQ_MONTHS = {'M': 1, 'Q': 3, 'Y': 12}
+
+
+class TradingCalendar(object):
+    """
+    Sorted trading days of the stored OHLC data with vectorized date resolution. Every query resolves dates
+    with one binary search over all of them and returns integer rows into `days`, which are also the rows of
+    a `PricePanel` built on the same dates or of a returns frame indexed by them, so backtests index arrays
+    instead of scanning or slicing by date strings.
+    """
+
+    def __init__(self, days):
+        """
+        :param days: trading days, sorted ascending
+        """
+        self.days = np.asarray(pd.to_datetime(days).values.astype('datetime64[D]'))
+        if len(self.days) > 1 and (np.diff(self.days.astype('int64')) <= 0).any():
+            raise ValueError("Trading days must be sorted ascending without duplicates")
+
+    @classmethod
+    def from_panel(cls, panel: PricePanel) -> 'TradingCalendar':
+        return cls(panel.dates)
+
+    @classmethod
+    def from_artifacts(cls, root: str = None) -> 'TradingCalendar':
+        """
+        Calendar of the saved price panel, defaults to artifacts/sp500_panel.
+        The price files are only memory-mapped, not read.
+        """
+        return cls.from_panel(PricePanel.open(root))
+
+    def __len__(self):
+        return len(self.days)
+
+    def next_index(self, dates, offset: int = 0) -> np.ndarray:
+        """
+        Rows of the first trading day on or after each date, moved `offset` trading days further.
+        Rows past the last trading day are len(self).
+        """
+        rows = np.searchsorted(self.days, _to_days(dates), side='left') + offset
+        return np.clip(rows, 0, len(self.days))
+
+    def prev_index(self, dates, offset: int = 0) -> np.ndarray:
+        """
+        Rows of the last trading day on or before each date, moved `offset` trading days back.
+        Rows before the first trading day are -1.
+        """
+        rows = np.searchsorted(self.days, _to_days(dates), side='right') - 1 - offset
+        return np.clip(rows, -1, len(self.days) - 1)
+
+    def next_day(self, dates, offset: int = 0) -> np.ndarray:
+        """
+        First trading day on or after each date, NaT past the last one.
+        """
+        return self.day(self.next_index(dates, offset))
+
+    def prev_day(self, dates, offset: int = 0) -> np.ndarray:
+        """
+        Last trading day on or before each date, NaT before the first one.
+        """
+        return self.day(self.prev_index(dates, offset))
+
+    def day(self, rows) -> np.ndarray:
+        """
+        Trading day of each row, NaT for rows out of range.
+        """
+        rows = np.asarray(rows)
+        ok = (rows >= 0) & (rows < len(self.days))
+        res = np.full(rows.shape, np.datetime64('NaT'), dtype='datetime64[D]')
+        res[ok] = self.days[rows[ok]]
+        return res
+
+    def first_monday_index(self, dates, days: int = 0) -> np.ndarray:
+        """
+        Rows of the first Monday on or after each date plus `days` calendar days, or of the trading day
+        after it if that Monday is a holiday. E.g. the entry of a pick 30 days after its report date.
+        """
+        shifted = _to_days(dates) + np.timedelta64(days, 'D')
+        mondays = np.busday_offset(shifted, 0, roll='forward', weekmask='Mon')
+        return self.next_index(mondays)
+
+    def year_index(self, years) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :param years: calendar years
+        :return: first row and end row (exclusive) of each year, equal if the year has no trading days
+        """
+        years = np.asarray(years, dtype='int64')
+        return self._bounds((years - 1970).astype('datetime64[Y]'), (years - 1969).astype('datetime64[Y]'))
+
+    def quarter_index(self, years, quarters) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :param years: calendar years
+        :param quarters: quarters 1 to 4, or labels like Q1, same length as years
+        :return: first row and end row (exclusive) of each quarter
+        """
+        quarters = np.asarray([int(str(q).lstrip('Qq')) for q in np.atleast_1d(quarters)], dtype='int64')
+        months = (np.asarray(years, dtype='int64') - 1970) * 12 + (quarters - 1) * 3
+        return self._bounds(months.astype('datetime64[M]'), (months + 3).astype('datetime64[M]'))
+
+    def window_index(self, starts, ends) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :param starts: first day of each window
+        :param ends: last day of each window, inclusive
+        :return: first row and end row (exclusive) of each window, e.g. values[lo:hi]
+        """
+        return (np.searchsorted(self.days, _to_days(starts), side='left'),
+                np.searchsorted(self.days, _to_days(ends), side='right'))
+
+    def rebalance_index(self, start=None, end=None, freq: str = 'Q', offset: int = 0) -> np.ndarray:
+        """
+        Rebalance schedule as rows: the first trading day of every month (M), quarter (Q) or year (Y)
+        between `start` and `end`, moved `offset` trading days forward, or `W` for the first trading day
+        of every week.
+        :param start: defaults to the first trading day
+        :param end: defaults to the last trading day, inclusive
+        """
+        if freq == 'W':
+            # weeks numbered from a Monday, 1970-01-01 was a Thursday
+            period = (self.days.astype('int64') - 4) // 7
+        elif freq in _FREQ_MONTHS:
+            period = self.days.astype('datetime64[M]').astype('int64') // _FREQ_MONTHS[freq]
+        else:
+            raise ValueError(f"Unknown rebalance frequency {freq}, expected one of W, M, Q or Y")
+        # the first trading day of the calendar opens a period too
+        first = np.flatnonzero(np.diff(period, prepend=period[:1] - 1) != 0)
+        lo = 0 if start is None else np.searchsorted(self.days, _to_days(start), side='left')
+        hi = len(self.days) if end is None else np.searchsorted(self.days, _to_days(end), side='right')
+        rows = first[(first >= lo) & (first < hi)] + offset
+        return rows[(rows >= 0) & (rows < len(self.days))]
+
+    def _bounds(self, starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        return (np.searchsorted(self.days, starts.astype('datetime64[D]'), side='left'),
+                np.searchsorted(self.days, ends.astype('datetime64[D]'), side='left'))
+
+
+def _to_days(dates) -> np.ndarray:
+    if isinstance(dates, np.ndarray) and dates.dtype.kind == 'M':
+        return dates.astype('datetime64[D]')
+    if np.ndim(dates) == 0:
+        return np.datetime64(pd.Timestamp(dates).date(), 'D') if not pd.isnull(dates) else np.datetime64('NaT', 'D')
+    return np.asarray(pd.to_datetime(dates).values.astype('datetime64[D]'))
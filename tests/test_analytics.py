@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+import pytest
+from src.analytics import equity_curves
+from src.price_panel import PricePanel
+
+_DATES = pd.bdate_range('2020-01-01', periods=30)
+
+
+def _panel() -> PricePanel:
+    # AAA doubles over the window, BBB is flat
+    aaa = np.linspace(10, 20, len(_DATES))
+    bbb = np.full(len(_DATES), 5.0)
+    df = pd.DataFrame({'Date': np.repeat(_DATES, 2), 'Ticker': np.tile(['AAA', 'BBB'], len(_DATES)),
+                       'Close': np.column_stack([aaa, bbb]).ravel()})
+    return PricePanel.from_frame(df, fields=['Close'], dtype='float64')
+
+
+def test_unpriced_rebalance_keeps_the_previous_holdings_drifting():
+    panel = _panel()
+    picks = pd.DataFrame({'date': [_DATES[5], _DATES[15], _DATES[25]], 'symbol': ['AAA', 'ZZZ', 'BBB']})
+    curves, rebalances = equity_curves(panel, {'s': picks})
+    close = panel.column('Close', 'AAA')
+    value = curves['s'].to_numpy()
+
+    assert np.isnan(value[:5]).all()
+    # AAA is held on through the unpriced rebalance on day 15 until BBB is bought on day 25
+    np.testing.assert_allclose(value[5:26], close[5:26] / close[5])
+    np.testing.assert_allclose(value[26:], close[25] / close[5])
+    assert rebalances['date'].tolist() == [_DATES[25]]
+    assert rebalances['turnover'].tolist() == [pytest.approx(1.0)]
+
+
+def test_curve_starts_at_the_first_priced_rebalance():
+    panel = _panel()
+    picks = pd.DataFrame({'date': [_DATES[3], _DATES[10]], 'symbol': ['ZZZ', 'AAA']})
+    curves, rebalances = equity_curves(panel, {'s': picks})
+    value = curves['s'].to_numpy()
+
+    assert np.isnan(value[:10]).all()
+    assert value[10] == pytest.approx(1.0)
+    assert rebalances.empty
@@ -0,0 +1,62 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'notebooks'))
+
+import utils  # noqa: E402
+from src.price_panel import PricePanel  # noqa: E402
+
+
+def _ohlc(start='2008-01-01', end='2016-12-31', seed=0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    tickers = ['AAA', 'BBB', 'SPY']
+    dates = pd.bdate_range(start, end)
+    close = np.exp(np.cumsum(rng.normal(0.0003, 0.02, (len(dates), len(tickers))), axis=0)) * 50
+    return pd.DataFrame({'Date': np.repeat(dates, len(tickers)), 'Ticker': np.tile(tickers, len(dates)),
+                         'Close': close.ravel()})
+
+
+def _reports(first_year=2010, last_year=2015) -> pd.DataFrame:
+    rows = [{'symbol': s, 'date': pd.Timestamp(y, 3, 31), 'calendarYear': y, 'period': 'Q1'}
+            for y in range(first_year, last_year + 1) for s in ['AAA', 'BBB']]
+    return pd.DataFrame(rows)
+
+
+def _baseline_spy_returns(ohlc: pd.DataFrame, data: pd.DataFrame) -> pd.DataFrame:
+    # the per year loop of the original Evaluator over the SPY closes from the first report date on
+    sub_ = ohlc[(ohlc['Date'] >= data['date'].min()) & (ohlc['Ticker'] == 'SPY')].sort_values('Date')
+    years = range(data['calendarYear'].min(), data['calendarYear'].max() - 1)
+    ret = []
+    for year in years:
+        yr_sub_ = sub_[sub_['Date'].dt.year == year]
+        ret.append((yr_sub_.iloc[-1]['Close'] - yr_sub_.iloc[0]['Close']) / yr_sub_.iloc[0]['Close'])
+    return pd.DataFrame({'year': years, 'return': ret})
+
+
+@pytest.fixture
+def prices(monkeypatch):
+    ohlc = _ohlc()
+    ohlc['Close'] = ohlc['Close'].astype('float32')
+    monkeypatch.setattr(utils, '_DF_OHLC', ohlc)
+    monkeypatch.setattr(utils, '_PANEL', None)
+    return ohlc
+
+
+@pytest.mark.parametrize('shared_panel', [False, True])
+def test_spy_annual_return_matches_baseline(prices, monkeypatch, shared_panel):
+    if shared_panel:
+        # the shared panel starts two years before the first report
+        monkeypatch.setattr(utils, '_PANEL', PricePanel.from_frame(prices, fields=['Close']))
+    data = _reports()
+    e = utils.Evaluator(None)
+    e.data = data
+    res, agg = e.calculate_spy_annual_return()
+    expected = _baseline_spy_returns(prices, data)
+
+    assert res['year'].tolist() == expected['year'].tolist()
+    np.testing.assert_allclose(res['return'], expected['return'], rtol=1e-6)
+    assert agg['average'] == pytest.approx(expected['return'].mean(), rel=1e-6)
+    assert agg['std'] == pytest.approx(expected['return'].std(), rel=1e-6)
@@ -0,0 +1,73 @@
+import json
+import os
+import time
+import pandas as pd
+import pytest
+from src import http_cache
+from src.http_cache import CacheEntry, ResponseCache, earnings_ttl
+
+_DAY = 24 * 3600
+
+
+def _body(dates) -> bytes:
+    return json.dumps([{'symbol': 'AAPL', 'date': d, 'revenue': 1} for d in dates]).encode()
+
+
+@pytest.fixture
+def no_json_decode(monkeypatch):
+    def _fail(*args, **kwargs):
+        raise AssertionError("the cache decoded a response body")
+
+    monkeypatch.setattr(CacheEntry, 'json', _fail)
+
+
+def test_earnings_ttl_reads_the_latest_date_without_decoding(no_json_decode, monkeypatch):
+    def _fail(*args, **kwargs):
+        raise AssertionError("the body was decoded")
+
+    monkeypatch.setattr(http_cache.json, 'loads', _fail)
+    fetched_at = pd.Timestamp('2024-01-10').timestamp()
+    entry = CacheEntry(('key-metrics', 'AAPL', 'quarter', 4), _body(['2023-06-30', '2023-09-30', '2023-03-31']),
+                       fetched_at=fetched_at)
+    assert entry.latest_date == '2023-09-30'
+    # next quarter end plus the 45 day filing lag
+    expected = (pd.Timestamp('2023-12-30') + pd.Timedelta(days=45)).timestamp() - fetched_at
+    assert earnings_ttl(entry) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('body', [b'[]', json.dumps([{'symbol': 'AAPL'}, {'date': None}]).encode()])
+def test_earnings_ttl_without_dates_is_a_day(body):
+    entry = CacheEntry(('key-metrics', 'AAPL', 'quarter', 4), body)
+    assert earnings_ttl(entry) == _DAY
+
+
+def test_latest_date_is_persisted(tmp_path, no_json_decode):
+    key = ('income-statement', 'AAPL', 'annual', 5)
+    ResponseCache(root=str(tmp_path)).put(key, _body(['2022-12-31', '2023-12-31']))
+    entry = ResponseCache(root=str(tmp_path)).get(key)
+    assert entry._latest_date == '2023-12-31'
+    assert entry.fresh()
+
+
+def test_prune_deletes_entries_not_fetched_for_max_age(tmp_path):
+    cache = ResponseCache(root=str(tmp_path), max_age=7 * _DAY)
+    old_key, new_key = ('profile', 'AAPL', None, None), ('profile', 'MSFT', None, None)
+    cache.put(old_key, b'[{"symbol": "AAPL"}]')
+    cache.put(new_key, b'[{"symbol": "MSFT"}]')
+    stale = time.time() - 8 * _DAY
+    os.utime(cache.path(old_key), (stale, stale))
+
+    assert cache.prune() == 1
+    assert not os.path.exists(cache.path(old_key))
+    assert os.path.exists(cache.path(new_key))
+    assert ResponseCache(root=str(tmp_path)).get(new_key) is not None
+
+
+def test_stale_records_are_deleted_on_read(tmp_path):
+    cache = ResponseCache(root=str(tmp_path))
+    key = ('profile', 'AAPL', None, None)
+    # fetched 40 days ago, past the default max_age of 30 days
+    cache._write(CacheEntry(key, b'[{"symbol": "AAPL"}]', fetched_at=time.time() - 40 * _DAY))
+    assert os.path.exists(cache.path(key))
+    assert ResponseCache(root=str(tmp_path)).get(key) is None
+    assert not os.path.exists(cache.path(key))
@@ -0,0 +1,25 @@
+import json
+import numpy as np
+import pytest
+from src.ingest import ingest_json
+
+
+@pytest.mark.parametrize('values, expected', [
+    ([[1, 2], [3]], [np.nan, np.nan]),
+    ([[1, 2], [3, 4]], [np.nan, np.nan]),
+    ([1.5, [1, 2]], [1.5, np.nan]),
+    ([{'a': 1}, 2], [np.nan, 2.0]),
+    ([1, 'N/A'], [1.0, np.nan]),
+])
+def test_lists_and_strings_in_numeric_columns_are_coerced(values, expected):
+    body = json.dumps([{'symbol': 'AAPL', 'date': '2023-12-31', 'revenue': v} for v in values]).encode()
+    df = ingest_json(body, 'income-statement')
+    assert df['revenue'].dtype == np.float64
+    np.testing.assert_array_equal(df['revenue'].to_numpy(), expected)
+
+
+def test_integer_columns_stay_int64():
+    body = json.dumps([{'symbol': 'AAPL', 'date': '2023-12-31', 'revenue': v} for v in [1, 2 ** 40]]).encode()
+    df = ingest_json(body, 'income-statement')
+    assert df['revenue'].dtype == np.int64
+    assert df['revenue'].tolist() == [1, 2 ** 40]
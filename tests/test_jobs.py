@@ -0,0 +1,25 @@
+from src.jobs import DONE, STAGED, Job, JobLedger, run_jobs
+
+
+def test_staged_jobs_are_not_done_until_committed():
+    ledger = JobLedger(':memory:')
+    jobs = [Job('AAPL', 'key-metrics', 'quarter'), Job('MSFT', 'key-metrics', 'quarter')]
+    ledger.add(jobs)
+    errors = run_jobs(jobs, lambda job: [1, 2, 3], ledger, staged=True)
+    assert errors == {}
+    assert [ledger.get(job)['status'] for job in jobs] == [STAGED, STAGED]
+    # a crash before the store is flushed leaves them to be fetched again on resume
+    assert ledger.not_done(jobs) == jobs
+
+    ledger.commit(jobs)
+    assert [ledger.get(job)['status'] for job in jobs] == [DONE, DONE]
+    assert ledger.get(jobs[0])['rows'] == 3
+    assert ledger.not_done(jobs) == []
+
+
+def test_jobs_without_staging_are_done_right_away():
+    ledger = JobLedger(':memory:')
+    job = Job('AAPL', 'key-metrics', 'quarter')
+    ledger.add([job])
+    run_jobs([job], lambda job: [1], ledger)
+    assert ledger.get(job)['status'] == DONE
@@ -0,0 +1,27 @@
+import os
+import time
+from benchmarks.synthetic import write_artifacts
+from src.loader import load_statements
+
+
+def _cache_files(root: str) -> list:
+    return sorted(os.listdir(os.path.join(root, 'cache')))
+
+
+def test_rewritten_cache_replaces_the_stale_one(tmp_path):
+    root = str(tmp_path)
+    write_artifacts(root, ['AAA', 'BBB'], 2015, 2020)
+    load_statements('key_metrics', 'quarter', artifacts_dir=root)
+    load_statements('key_metrics', 'quarter', columns=['symbol', 'peRatio'], artifacts_dir=root)
+    files = _cache_files(root)
+    assert len(files) == 2
+
+    path = os.path.join(root, 'aaa', 'quarter', 'key_metrics.csv')
+    later = time.time() + 10
+    os.utime(path, (later, later))
+    df = load_statements('key_metrics', 'quarter', artifacts_dir=root)
+    assert not df.empty
+    # the cache of the old file version is gone, the one of other columns is kept
+    new_files = _cache_files(root)
+    assert len(new_files) == 2
+    assert len(set(files) & set(new_files)) == 1
@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+from src.schema import compact_metrics, downcast_numeric
+
+
+def test_integer_columns_keep_their_dtype():
+    s = pd.Series([1, 2, 3], dtype='int64')
+    assert downcast_numeric(s).dtype == np.int64
+    assert downcast_numeric(pd.Series([True, False])).dtype == np.bool_
+
+
+def test_floats_become_float32_only_within_rtol():
+    assert downcast_numeric(pd.Series([0.5, 1.25, np.nan])).dtype == np.float32
+    assert downcast_numeric(pd.Series([1.0, 2.0])).dtype == np.float32
+    assert downcast_numeric(pd.Series([1.0, 1 + 1e-9]), rtol=1e-12).dtype == np.float64
+    assert downcast_numeric(pd.Series([1e300])).dtype == np.float64
+
+
+def test_compact_metrics_narrows_only_calendar_years():
+    df = pd.DataFrame({'symbol': ['AAPL', 'MSFT'], 'calendarYear': ['2022', '2023'],
+                       'weightedAverageShsOut': [100, 120], 'peRatio': [20.5, 31.25]})
+    res = compact_metrics(df)
+    assert res['calendarYear'].dtype == np.int16
+    assert res['calendarYear'].tolist() == [2022, 2023]
+    assert res['weightedAverageShsOut'].dtype == np.int64
+    assert res['peRatio'].dtype == np.float32
+    assert res['symbol'].dtype == 'category'